@@ -41,7 +41,7 @@ from core.models import (
     TextualWitness,
     Transcription,
 )
-from core.tasks import segment, segtrain, train, transcribe
+from core.tasks import segment, segtrain, train
 from imports.forms import FileImportError, clean_import_uri, clean_upload_file
 from imports.models import DocumentImport
 from imports.tasks import document_import
@@ -53,8 +53,9 @@ logger = logging.getLogger(__name__)
 
 
 class ImageField(serializers.ImageField):
-    def __init__(self, *args, thumbnails=None, **kwargs):
+    def __init__(self, *args, thumbnails=None, tiles=False, **kwargs):
         self.thumbnails = thumbnails
+        self.tiles = tiles
         super().__init__(*args, **kwargs)
 
     def to_internal_value(self, data):
@@ -81,6 +82,9 @@ class ImageField(serializers.ImageField):
                                 settings.THUMBNAIL_ALIASES[''][alias], generate=False).url
                         except AttributeError:
                             pass
+                if self.tiles and getattr(settings, 'TILES_ENABLE', False):
+                    # Deep Zoom descriptor of the tile pyramid, if it was generated
+                    data['tiles'] = img.instance.tiles_uri
             return data
 
 
@@ -587,7 +591,7 @@ class DocumentPartMetadataSerializer(serializers.ModelSerializer):
 
 
 class PartSerializer(serializers.ModelSerializer):
-    image = ImageField(required=False, thumbnails=['card', 'large'])
+    image = ImageField(required=False, thumbnails=['card', 'large'], tiles=True)
     image_file_size = serializers.IntegerField(required=False)
     filename = serializers.CharField(read_only=True)
     workflow = serializers.JSONField(read_only=True)
@@ -1220,15 +1224,9 @@ class TranscribeSerializer(ProcessSerializerMixin, serializers.Serializer):
             ocr_model_document.executed_on = timezone.now()
             ocr_model_document.save()
 
-        for part in parts:
-            part.chain_tasks(
-                transcribe.si(
-                    task_group_pk=self.task_group.pk,
-                    transcription_pk=transcription.pk,
-                    instance_pk=part.pk,
-                    model_pk=model.pk,
-                    user_pk=self.user.pk)
-            )
+        self.document.queue_transcription(parts, model, transcription,
+                                          user=self.user,
+                                          task_group=self.task_group)
 
 
 class EditableMultipleChoiceField(serializers.MultipleChoiceField):
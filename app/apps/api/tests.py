@@ -23,7 +23,7 @@ from core.models import (
     Transcription,
 )
 from core.tests.factory import CoreFactoryTestCase
-from reporting.models import TaskGroup
+from reporting.models import TaskGroup, TaskReport
 
 
 class UserViewSetTestCase(CoreFactoryTestCase):
@@ -255,7 +255,6 @@ class DocumentViewSetTestCase(CoreFactoryTestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(self.doc.ocr_models.filter(job=OcrModel.MODEL_JOB_RECOGNIZE).count(), 1)
 
-    @unittest.expectedFailure
     def test_transcribe(self):
         trans = Transcription.objects.create(document=self.part.document)
 
@@ -271,6 +270,15 @@ class DocumentViewSetTestCase(CoreFactoryTestCase):
         self.assertEqual(resp.content, b'{"status":"ok"}')
         # won't work with dummy model and image
         # self.assertEqual(LineTranscription.objects.filter(transcription=trans).count(), 2)
+        # so the part with lines fails and the empty one is transcribed,
+        # the failure being recorded in its own report
+        reports = TaskReport.objects.filter(method='core.tasks.transcribe')
+        self.assertEqual(
+            dict(reports.values_list('document_part_id', 'workflow_state')),
+            {self.part.pk: TaskReport.WORKFLOW_STATE_ERROR,
+             self.part2.pk: TaskReport.WORKFLOW_STATE_DONE})
+        self.assertIn(f'Failed to transcribe the part {self.part.pk}',
+                      reports.get(document_part=self.part).messages)
 
     def test_align(self):
         self.client.force_login(self.doc.owner)
@@ -787,7 +795,7 @@ class PartViewSetTestCase(CoreFactoryTestCase):
         self.client.force_login(self.user)
         uri = reverse('api:part-list',
                       kwargs={'document_pk': self.part.document.pk})
-        with self.assertNumQueries(25):
+        with self.assertNumQueries(26):
             img = self.factory.make_image_file()
             resp = self.client.post(uri, {
                 'image': SimpleUploadedFile(
@@ -976,7 +984,7 @@ class LineViewSetTestCase(CoreFactoryTestCase):
         self.client.force_login(self.user)
         uri = reverse('api:line-bulk-delete',
                       kwargs={'document_pk': self.part.document.pk, 'part_pk': self.part.pk})
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(14):
             resp = self.client.post(uri, {'lines': [self.line.pk]},
                                     content_type='application/json')
         self.assertEqual(Line.objects.count(), 2)
@@ -1123,7 +1131,7 @@ class LineTranscriptionViewSetTestCase(CoreFactoryTestCase):
                       kwargs={'document_pk': self.part.document.pk,
                               'part_pk': self.part.pk,
                               'pk': self.lt.pk})
-        with self.assertNumQueries(14):
+        with self.assertNumQueries(15):
             resp = self.client.patch(uri, {
                 'content': 'update'
             }, content_type='application/json')
@@ -1135,7 +1143,7 @@ class LineTranscriptionViewSetTestCase(CoreFactoryTestCase):
                       kwargs={'document_pk': self.part.document.pk,
                               'part_pk': self.part.pk})
 
-        with self.assertNumQueries(25):
+        with self.assertNumQueries(26):
             resp = self.client.post(uri, {
                 'line': self.line2.pk,
                 'transcription': self.transcription.pk,
@@ -1150,7 +1158,7 @@ class LineTranscriptionViewSetTestCase(CoreFactoryTestCase):
                               'part_pk': self.part.pk,
                               'pk': self.lt.pk})
 
-        with self.assertNumQueries(16):
+        with self.assertNumQueries(17):
             resp = self.client.put(uri, {'content': 'test',
                                          'transcription': self.lt.transcription.pk,
                                          'line': self.lt.line.pk},
@@ -1166,7 +1174,7 @@ class LineTranscriptionViewSetTestCase(CoreFactoryTestCase):
         ll = Line.objects.create(
             mask=[10, 10, 50, 50],
             document_part=self.part)
-        with self.assertNumQueries(28):
+        with self.assertNumQueries(30):
             resp = self.client.post(
                 uri,
                 {'lines': [
@@ -1184,7 +1192,7 @@ class LineTranscriptionViewSetTestCase(CoreFactoryTestCase):
         uri = reverse('api:linetranscription-bulk-update',
                       kwargs={'document_pk': self.part.document.pk, 'part_pk': self.part.pk})
 
-        with self.assertNumQueries(36):
+        with self.assertNumQueries(38):
             resp = self.client.put(uri, {'lines': [
                 {'pk': self.lt.pk,
                  'content': 'test1 new',
@@ -1206,7 +1214,7 @@ class LineTranscriptionViewSetTestCase(CoreFactoryTestCase):
         self.client.force_login(self.user)
         uri = reverse('api:linetranscription-bulk-delete',
                       kwargs={'document_pk': self.part.document.pk, 'part_pk': self.part.pk})
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(7):
             resp = self.client.post(uri, {'lines': [self.lt.pk, self.lt2.pk]},
                                     content_type='application/json')
             lines = LineTranscription.objects.all()
@@ -85,6 +85,7 @@ from core.models import (
     LineTranscription,
     LineType,
     OcrModel,
+    PendingIndexation,
     Project,
     ProjectTag,
     ProtectedObjectException,
@@ -93,6 +94,7 @@ from core.models import (
     TextualWitness,
     Transcription,
 )
+from core.search import invalidate_search_results
 from core.tasks import recalculate_masks
 from imports.forms import ExportForm, ImportForm
 from imports.parsers import ParseError
@@ -1306,6 +1308,9 @@ class LineTranscriptionViewSet(DocumentPermissionMixin, ModelViewSet):
         lines = request.data.get("lines")
         qs = LineTranscription.objects.filter(pk__in=lines)
         qs.update(content='')
+        rows = list(qs.values_list('line_id', 'transcription_id'))
+        PendingIndexation.enqueue([line_id for line_id, _ in rows])
+        invalidate_search_results([transcription_id for _, transcription_id in rows])
         return Response(status=status.HTTP_204_NO_CONTENT, )
 
 
@@ -1,12 +1,13 @@
 import logging
-import re
 from datetime import datetime
+from math import ceil
 from os.path import basename, splitext
 
 from bootstrap.forms import BootstrapFormMixin
 from django import forms
 from django.conf import settings
 from django.core.validators import FileExtensionValidator
+from django.db import DataError
 from django.db.models import Q
 from django.forms.models import BaseInlineFormSet, inlineformset_factory
 from django.utils import timezone
@@ -36,6 +37,10 @@ from core.models import (
 from core.search import (
     REGEX_SEARCH_MODE,
     WORD_BY_WORD_SEARCH_MODE,
+    SearchCache,
+    check_regex,
+    normalize_terms,
+    replacement_preview,
     search_content_es,
     search_content_psql_regex,
     search_content_psql_word,
@@ -129,6 +134,15 @@ class BaseSearchForm(BootstrapFormMixin, forms.Form):
         """
         pass
 
+    def search_cache(self, **params):
+        return SearchCache(
+            self.user,
+            project_id=self.cleaned_data['project'].id if self.cleaned_data['project'] else None,
+            document_id=self.cleaned_data['document'].id if self.cleaned_data['document'] else None,
+            transcription_id=self.cleaned_data['transcription'].id if self.cleaned_data['transcription'] else None,
+            **params
+        )
+
 
 class SearchForm(BaseSearchForm):
     def __init__(self, *args, **kwargs):
@@ -140,16 +154,27 @@ class SearchForm(BaseSearchForm):
         projects = [self.cleaned_data['project'].id] if self.cleaned_data['project'] else None
         documents = [self.cleaned_data['document'].id] if self.cleaned_data['document'] else None
         transcriptions = [self.cleaned_data['transcription'].id] if self.cleaned_data['transcription'] else None
-
-        return search_content_es(
-            page,
-            paginate_by,
-            self.user.id,
-            self.cleaned_data['query'],
-            projects=projects,
-            documents=documents,
-            transcriptions=transcriptions
-        )
+        terms = normalize_terms(self.cleaned_data['query'])
+
+        search_cache = self.search_cache(mode='elasticsearch', query=terms, paginate_by=paginate_by)
+        results = search_cache.get(f'page:{page}')
+        if results is None:
+            results = search_content_es(
+                page,
+                paginate_by,
+                self.user.id,
+                terms,
+                projects=projects,
+                documents=documents,
+                transcriptions=transcriptions,
+                # known once the previous page has been displayed
+                search_after=search_cache.get(f'cursor:{page}'),
+            )
+            search_cache.set(f'page:{page}', results)
+            hits = results['hits']['hits']
+            if hits:
+                search_cache.set(f'cursor:{page + 1}', hits[-1]['sort'])
+        return results
 
 
 class FindAndReplaceForm(BaseSearchForm):
@@ -192,19 +217,13 @@ class FindAndReplaceForm(BaseSearchForm):
         mode = self.cleaned_data.get('mode')
         query_pattern = self.cleaned_data['query']
         if mode == REGEX_SEARCH_MODE and query_pattern:
+            # the search and the replacement are made by PostgreSQL, with its own regex syntax,
+            # which ignores the references to missing groups in the replacement
             try:
-                re.compile(query_pattern)
-            except re.error as e:
+                check_regex(query_pattern)
+            except DataError as e:
                 self.add_error('query', f'You must enter a valid regex pattern: {e}')
 
-        replacement_pattern = self.cleaned_data['replacement']
-        if mode == REGEX_SEARCH_MODE and replacement_pattern:
-            try:
-                # We want to compile the pattern and check for invalid group references
-                re.sub(query_pattern, replacement_pattern, '')
-            except re.error as e:
-                self.add_error('replacement', f'You must enter a valid regex pattern: {e}')
-
         return super().clean()
 
     def search(self, page=None, paginate_by=None):
@@ -227,6 +246,41 @@ class FindAndReplaceForm(BaseSearchForm):
             part_id=part_id
         )
 
+    def search_page(self, page, paginate_by):
+        """
+        Returns the line transcriptions of a page and the total of results,
+        the pages are ordered by pk to start a page after the last line transcription of the previous one.
+        """
+        mode = self.cleaned_data.get('mode') or WORD_BY_WORD_SEARCH_MODE
+        query = self.cleaned_data['query']
+        search_cache = self.search_cache(
+            mode=mode,
+            query=normalize_terms(query) if mode == WORD_BY_WORD_SEARCH_MODE else query,
+            part_id=self.cleaned_data['part'].id if self.cleaned_data['part'] else None,
+            paginate_by=paginate_by,
+        )
+        results = self.search().order_by('pk')
+
+        total = search_cache.get('count')
+        if total is None:
+            total = results.count()
+            search_cache.set('count', total)
+        page = max(min(page, ceil(total / paginate_by)), 1)
+
+        cursor = search_cache.get(f'cursor:{page}')
+        replacement = self.cleaned_data['replacement']
+        if replacement:
+            results = results.annotate(
+                replacement_preview=replacement_preview(mode, query, replacement, 'text-success')
+            )
+        if cursor:
+            page_results = list(results.filter(pk__gt=cursor)[:paginate_by])
+        else:
+            page_results = list(results[(page - 1) * paginate_by:page * paginate_by])
+        if page_results:
+            search_cache.set(f'cursor:{page + 1}', page_results[-1].pk)
+        return page_results, total
+
 
 class ProjectForm(BootstrapFormMixin, forms.ModelForm):
     class Meta:
@@ -749,12 +803,20 @@ class TranscribeForm(BootstrapFormMixin, DocumentProcessFormBase):
             ocr_model_document.executed_on = timezone.now()
             ocr_model_document.save()
 
-        for part in self.cleaned_data.get('parts'):
-            part.task('transcribe',
-                      user_pk=self.user.pk,
-                      task_group_pk=self.task_group.pk,
-                      model_pk=model.pk,
-                      transcription_pk=transcription and transcription.pk or None)
+        parts = self.cleaned_data.get('parts')
+        segmented = set(parts.filter(lines__isnull=False).values_list('pk', flat=True))
+        # parts that still need to be segmented go through their own chain of tasks
+        for part in parts:
+            if part.pk not in segmented:
+                part.task('transcribe',
+                          user_pk=self.user.pk,
+                          task_group_pk=self.task_group.pk,
+                          model_pk=model.pk,
+                          transcription_pk=transcription and transcription.pk or None)
+        self.document.queue_transcription([part for part in parts if part.pk in segmented],
+                                          model, transcription,
+                                          user=self.user,
+                                          task_group=self.task_group)
 
 
 class AlignForm(BootstrapFormMixin, DocumentProcessFormBase, RegionTypesFormMixin):
@@ -0,0 +1,309 @@
+"""
+Elasticsearch entries of the line transcriptions, one for each LineTranscription.
+
+The index management command builds them for whole projects. In between, the
+changed lines are enqueued in PendingIndexation (by signal receivers and by the
+code writing line transcriptions in bulk) and a low priority task reindexes
+their regions in batches, so that the context of their neighbours is updated as
+well. Sharing and archival changes of a document only update its entries by query.
+"""
+import logging
+from collections import defaultdict
+from itertools import groupby
+from math import ceil
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import F, Q
+from easy_thumbnails.files import get_thumbnailer
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk as es_bulk
+
+from core.search import invalidate_search_results
+
+logger = logging.getLogger("es_indexing")
+
+INDEX_MAPPING = {
+    "properties": {
+        "bounding_box": {"type": "long"},
+        "context": {"type": "text"},
+        "context_after": {"type": "text"},
+        "context_before": {"type": "text"},
+        "document_archived": {"type": "boolean"},
+        "document_id": {"type": "long"},
+        "document_name": {"type": "keyword"},
+        "document_part_id": {"type": "long"},
+        "have_access": {"type": "long"},
+        "image_height": {"type": "long"},
+        "image_url": {"type": "keyword"},
+        "image_width": {"type": "long"},
+        "line_id": {"type": "long"},
+        "line_number": {"type": "long"},
+        "part_title": {"type": "keyword"},
+        "project_id": {"type": "long"},
+        "raw_content": {"type": "text"},
+        "transcription_id": {"type": "long"},
+        "transcription_name": {"type": "keyword"},
+    }
+}
+
+
+def get_es_client():
+    return Elasticsearch(hosts=[settings.ELASTICSEARCH_URL])
+
+
+def get_box(mask, baseline):
+    # Same as Line.get_box() without instantiating the lines
+    if mask:
+        return [*map(min, *mask), *map(max, *mask)]
+    elif baseline:
+        return [*map(min, *baseline), *map(max, *baseline)]
+    return None
+
+
+def ordered_line_transcriptions(line_transcriptions):
+    """
+    Orders the line transcriptions by part, region and line, the lines that aren't
+    associated to a region come after the regions of their part.
+    Only the values needed by the entries are fetched.
+    """
+    return line_transcriptions.order_by(
+        "line__document_part__order",
+        "line__document_part_id",
+        F("line__block__order").asc(nulls_last=True),
+        "line__block_id",
+        "line__order",
+        "line_id",
+    ).values_list(
+        "line__document_part_id",
+        "line__block_id",
+        "line_id",
+        "line__order",
+        "line__mask",
+        "line__baseline",
+        "id",
+        "transcription_id",
+        "transcription__name",
+        "content",
+    )
+
+
+def part_fields(part, allowed_users):
+    """
+    Returns the fields shared by all the entries of the part,
+    and the factors to scale its line bboxes to the thumbnail.
+    """
+    thumbnailer = get_thumbnailer(part.image)
+    try:
+        thumbnail = thumbnailer.get_thumbnail(
+            settings.THUMBNAIL_ALIASES[""]["large"], generate=False
+        )
+        assert thumbnail
+    except Exception:
+        thumbnail = part.image
+        pass
+
+    # Factors to scale line bboxes if necessary
+    scale_factors = [
+        thumbnail.width / part.image.width,
+        thumbnail.height / part.image.height,
+    ] * 2
+
+    document = part.document
+    common = {
+        "_index": settings.ELASTICSEARCH_COMMON_INDEX,
+        "project_id": document.project_id,
+        "document_id": document.id,
+        "document_name": document.name,
+        "document_archived": document.is_archived,
+        "document_part_id": part.id,
+        "part_title": part.title,
+        "image_url": thumbnail.url,
+        "image_width": thumbnail.width,
+        "image_height": thumbnail.height,
+        "have_access": allowed_users,
+    }
+    return common, scale_factors
+
+
+def block_entries(common, scale_factors, rows):
+    # The context "cache" is reset for each region to avoid connecting lines from different regions,
+    # an entry is only yielded once the next line of its Transcription is known
+    previous = {}
+    line_id = None
+    for _, _, row_line_id, line_order, mask, baseline, lt_id, tr_id, tr_name, content in rows:
+        if row_line_id != line_id:
+            line_id = row_line_id
+            line_box = get_box(mask, baseline)
+            bounding_box = None
+            if line_box:
+                bounding_box = [
+                    ceil(value * factor)
+                    for value, factor in zip(line_box, scale_factors)
+                ]
+
+        entry = previous.get(tr_id)
+        if entry is not None:
+            # Enhance the previous ES document for this Transcription with the content of its next neighbor
+            entry["context"] += f" {content}"
+            entry["context_after"] = content
+            if entry["raw_content"]:
+                yield entry
+
+        # If you change the document structure here, don't forget to update the INDEX_MAPPING constant
+        previous[tr_id] = {
+            **common,
+            "_id": f"{lt_id}",
+            "line_id": line_id,
+            "transcription_id": tr_id,
+            "transcription_name": tr_name,
+            "line_number": line_order + 1,
+            "raw_content": content,
+            # Build the enhanced LineTranscription context by adding the last LineTranscription content for this Transcription
+            "context_before": entry["raw_content"] if entry is not None else None,
+            "context_after": None,
+            "context": f"{entry['raw_content']} {content}" if entry is not None else content,
+            # Rescaling the line bbox to match the thumbnail if necessary
+            "bounding_box": bounding_box,
+        }
+
+    for entry in previous.values():
+        if entry["raw_content"]:
+            yield entry
+
+
+def line_transcriptions_entries(rows, parts, allowed_users):
+    """
+    Yields the entries of the rows of ordered_line_transcriptions(),
+    parts maps the pk of the parts to the instances (with their document),
+    allowed_users maps the pk of the documents to the users having a read access.
+    """
+    for part_id, part_rows in groupby(rows, key=itemgetter(0)):
+        part = parts[part_id]
+        # A failing part (e.g. its image is missing) doesn't prevent the others from being indexed
+        try:
+            common, scale_factors = part_fields(part, allowed_users[part.document_id])
+            for _, block_rows in groupby(part_rows, key=itemgetter(1)):
+                yield from block_entries(common, scale_factors, block_rows)
+        except Exception as e:
+            logger.exception(f"Failed to index part {part_id} because: {e}")
+
+
+def retrieve_allowed_users(documents):
+    """
+    Returns the ids of the users that have a read access on each of the documents.
+    """
+    from core.models import DocumentAccess
+
+    allowed_users = defaultdict(list)
+    for document_id, user_id in DocumentAccess.objects.filter(document__in=documents).values_list("document_id", "user_id"):
+        allowed_users[document_id].append(user_id)
+    return allowed_users
+
+
+def index_pending_lines(es_client, batch_size=1000):
+    """
+    Reindexes the regions of the lines enqueued in PendingIndexation, batch by batch,
+    and removes the entries of the deleted or emptied line transcriptions.
+    Returns the number of lines processed.
+    """
+    from core.models import (
+        Document,
+        DocumentPart,
+        Line,
+        LineTranscription,
+        PendingIndexation,
+    )
+
+    total = 0
+    while True:
+        pending = list(
+            PendingIndexation.objects.order_by("queued_at")
+            .values_list("line_id", "document_part_id", "block_id", "queued_at")[:batch_size]
+        )
+        if not pending:
+            return total
+
+        line_ids = {line_id for line_id, _, _, _ in pending}
+        # the deleted lines come with their region
+        regions = {(part_id, block_id) for _, part_id, block_id, _ in pending if part_id}
+        regions.update(Line.objects.filter(pk__in=line_ids).values_list("document_part_id", "block_id"))
+
+        parts = DocumentPart.objects.select_related("document").in_bulk({part_id for part_id, _ in regions})
+        allowed_users = retrieve_allowed_users(Document.objects.filter(parts__in=list(parts)).distinct())
+        regions_filter = Q(pk__in=[])
+        for part_id, block_id in regions:
+            if part_id in parts:
+                regions_filter |= Q(line__document_part=part_id, line__block=block_id)
+        rows = ordered_line_transcriptions(LineTranscription.objects.filter(regions_filter))
+
+        indexed = []
+        transcriptions = set()
+
+        def actions():
+            for entry in line_transcriptions_entries(rows.iterator(), parts, allowed_users):
+                if entry["line_id"] in line_ids:
+                    indexed.append(entry["_id"])
+                transcriptions.add(entry["transcription_id"])
+                yield entry
+
+        _, failed = es_bulk(es_client, actions(), stats_only=True, raise_on_error=False)
+        if failed:
+            logger.error(f"Failed to index {failed} entries of the lines {sorted(line_ids)}")
+        es_client.delete_by_query(
+            index=settings.ELASTICSEARCH_COMMON_INDEX,
+            body={"query": {"bool": {
+                "filter": [{"terms": {"line_id": list(line_ids)}}],
+                "must_not": [{"ids": {"values": indexed}}],
+            }}},
+            conflicts="proceed",
+        )
+        # the search results cached before the indexing
+        invalidate_search_results(transcriptions)
+
+        # the lines enqueued again in the meantime stay in the queue
+        PendingIndexation.objects.filter(
+            line_id__in=line_ids,
+            queued_at__lte=max(queued_at for _, _, _, queued_at in pending),
+        ).delete()
+        total += len(line_ids)
+
+
+def update_documents(es_client, document_ids):
+    """
+    Updates the read access, the name and the archival state in the entries
+    of the documents, without building them again.
+    """
+    from core.models import Document
+
+    documents = Document.objects.filter(pk__in=document_ids)
+    allowed_users = retrieve_allowed_users(documents)
+    for document in documents.only("id", "name", "workflow_state"):
+        es_client.update_by_query(
+            index=settings.ELASTICSEARCH_COMMON_INDEX,
+            body={
+                "query": {"term": {"document_id": document.id}},
+                "script": {
+                    "source": "ctx._source.have_access = params.have_access;"
+                              "ctx._source.document_archived = params.document_archived;"
+                              "ctx._source.document_name = params.document_name;",
+                    "params": {
+                        "have_access": allowed_users[document.id],
+                        "document_archived": document.is_archived,
+                        "document_name": document.name,
+                    },
+                },
+            },
+            conflicts="proceed",
+        )
+
+
+def delete_entries(es_client, field, values):
+    """
+    Deletes the entries of whole documents, parts or transcriptions.
+    """
+    es_client.delete_by_query(
+        index=settings.ELASTICSEARCH_COMMON_INDEX,
+        body={"query": {"terms": {field: values}}},
+        conflicts="proceed",
+    )
@@ -1,44 +1,25 @@
 import logging
-from math import ceil
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, SimpleQueue
 
 from django.conf import settings
-from django.contrib.auth.models import Group
 from django.core.management.base import BaseCommand
-from django.db.models import Prefetch, Q
-from easy_thumbnails.files import get_thumbnailer
-from elasticsearch import Elasticsearch
+from django.db import connection
 from elasticsearch.client import IndicesClient
-from elasticsearch.helpers import bulk as es_bulk
-
+from elasticsearch.helpers import streaming_bulk as es_streaming_bulk
+
+from core.indexing import (
+    INDEX_MAPPING,
+    get_es_client,
+    line_transcriptions_entries,
+    ordered_line_transcriptions,
+    retrieve_allowed_users,
+)
 from core.models import LineTranscription, Project
-from users.models import User
 
 logger = logging.getLogger("es_indexing")
 logger.setLevel(logging.ERROR)
 
-INDEX_MAPPING = {
-    "properties": {
-        "bounding_box": {"type": "long"},
-        "context": {"type": "text"},
-        "context_after": {"type": "text"},
-        "context_before": {"type": "text"},
-        "document_archived": {"type": "boolean"},
-        "document_id": {"type": "long"},
-        "document_name": {"type": "keyword"},
-        "document_part_id": {"type": "long"},
-        "have_access": {"type": "long"},
-        "image_height": {"type": "long"},
-        "image_url": {"type": "keyword"},
-        "image_width": {"type": "long"},
-        "line_number": {"type": "long"},
-        "part_title": {"type": "keyword"},
-        "project_id": {"type": "long"},
-        "raw_content": {"type": "text"},
-        "transcription_id": {"type": "long"},
-        "transcription_name": {"type": "keyword"},
-    }
-}
-
 
 class Command(BaseCommand):
     help = "Index projects by creating one Elasticsearch document for each LineTranscription."
@@ -62,6 +43,18 @@ class Command(BaseCommand):
             type=int,
             help="Specify a few part PKs to index. If unset, all parts will be indexed by default.",
         )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Number of entries sent to Elasticsearch in each bulk request.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of documents indexed concurrently, each worker sends its own bulk requests to Elasticsearch.",
+        )
         parser.add_argument(
             "--drop",
             help="Drop the existing search index before reindexing",
@@ -78,7 +71,7 @@ class Command(BaseCommand):
             )
             return
 
-        self.es_client = Elasticsearch(hosts=[settings.ELASTICSEARCH_URL])
+        self.es_client = get_es_client()
         if not self.es_client.ping():
             logger.error(
                 f"Unable to connect to Elasticsearch host defined as {settings.ELASTICSEARCH_URL}."
@@ -132,160 +125,90 @@ class Command(BaseCommand):
             extras["filter_parts"] = options["part_pks"]
             projects = projects.filter(documents__parts__in=options["part_pks"])
 
+        self.chunk_size = options["chunk_size"]
+
         logger.info("\n" + "-" * 50 + "\n")
+        # The documents are shared between the workers, each one reads the lines of a document
+        # and sends its entries to Elasticsearch before taking the next one
+        documents = SimpleQueue()
         for project in projects.distinct():
-            try:
-                self.index_project(project, **extras)
-            except Exception as e:
-                logger.error(f"Failed to index project {project.pk} because: {e}")
+            for document, allowed_users in self.project_documents(project, **extras):
+                documents.put((document, allowed_users))
+
+        workers = max(options["workers"], 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self.index_documents, documents, extras.get("filter_parts"))
+                for _ in range(workers)
+            ]
+        total_inserted = sum(future.result() for future in futures)
+
+        logger.info(
+            f"Inserted {total_inserted} new entries in index {settings.ELASTICSEARCH_COMMON_INDEX}"
+        )
 
-    def index_project(self, project, filter_documents=None, filter_parts=None):
-        logger.info(f"Indexing project {project.name} (PK={project.pk})...")
+    def project_documents(self, project, filter_documents=None, filter_parts=None):
+        logger.info(f"Listing the documents of project {project.name} (PK={project.pk})...")
 
         documents = (
             project.documents.filter(pk__in=filter_documents)
             if filter_documents
             else project.documents.all()
         )
+        try:
+            # Retrieve users that have a read access on the documents of the project
+            allowed_users = retrieve_allowed_users(documents)
+        except Exception as e:
+            logger.error(f"Failed to index project {project.pk} because: {e}")
+            return
+
         for document in documents:
-            logger.info(
-                f" - Processing the document {document.name} (PK={document.pk})..."
-            )
+            yield document, allowed_users
 
-            # Retrieve users that have a read access on this document
-            allowed_users = self.retrieve_allowed_users(project, document)
+    def index_documents(self, documents, filter_parts=None):
+        total_inserted = 0
+        try:
+            while True:
+                try:
+                    document, allowed_users = documents.get_nowait()
+                except Empty:
+                    return total_inserted
 
-            total_inserted = 0
-            parts = (
-                document.parts.filter(pk__in=filter_parts)
-                if filter_parts
-                else document.parts.all()
-            )
-            for part in parts.iterator():
+                logger.info(
+                    f" - Processing the document {document.name} (PK={document.pk})..."
+                )
                 try:
-                    total_inserted += self.ingest_document_part(
-                        project, document, part, allowed_users
-                    )
+                    for ok, info in es_streaming_bulk(
+                        self.es_client,
+                        self.ingest_document(document, allowed_users, filter_parts=filter_parts),
+                        chunk_size=self.chunk_size,
+                        raise_on_error=False,
+                        raise_on_exception=False,
+                    ):
+                        if ok:
+                            total_inserted += 1
+                        else:
+                            logger.error(f"Failed to index an entry: {info}")
                 except Exception as e:
                     logger.exception(
-                        f"Failed to index part {part.pk} on project {project.pk} because: {e}"
+                        f"Failed to index document {document.pk} on project {document.project_id} because: {e}"
                     )
-
-            logger.info(
-                f"   Inserted {total_inserted} new entries in index {settings.ELASTICSEARCH_COMMON_INDEX}\n"
-            )
-
-        logger.info(
-            f"Project {project.name} (PK={project.pk}) was successfully indexed"
+        finally:
+            # Each worker thread has its own database connection
+            connection.close()
+
+    def ingest_document(self, document, allowed_users, filter_parts=None):
+        parts = (
+            document.parts.filter(pk__in=filter_parts)
+            if filter_parts
+            else document.parts.all()
         )
-        logger.info("\n" + "-" * 50 + "\n")
-
-    def ingest_document_part(self, project, document, part, allowed_users):
-        thumbnailer = get_thumbnailer(part.image)
-        try:
-            thumbnail = thumbnailer.get_thumbnail(
-                settings.THUMBNAIL_ALIASES[""]["large"], generate=False
-            )
-            assert thumbnail
-        except Exception:
-            thumbnail = part.image
-            pass
+        parts = parts.select_related("document").in_bulk()
 
-        # Factors to scale line bboxes if necessary
-        scale_factors = [
-            thumbnail.width / part.image.width,
-            thumbnail.height / part.image.height,
-        ] * 2
-
-        to_insert = []
-        # Iterate on all DocumentPart regions and also on None to retrieve lines that aren't associated to one
-        for block in [*part.blocks.all().order_by("order"), None]:
-            if block:
-                lines = block.lines.all()
-            else:
-                lines = part.lines.filter(block__isnull=True)
-
-            # Reset the context "cache" for each region to avoid connecting lines from different regions
-            previous_contents = {}
-            previous_index = {}
-            for line in lines.prefetch_related(
-                Prefetch(
-                    "transcriptions",
-                    queryset=LineTranscription.objects.select_related("transcription"),
-                )
-            ).order_by("order"):
-                line_box = line.get_box()
-                bounding_box = None
-                if line_box:
-                    bounding_box = [
-                        ceil(value * factor)
-                        for value, factor in zip(line_box, scale_factors)
-                    ]
-
-                for line_transcription in line.transcriptions.all():
-                    tr_id = line_transcription.transcription.id
-
-                    if previous_index.get(tr_id) is not None:
-                        # Enhance the previous ES document for this Transcription with the content of its next neighbor
-                        to_insert[previous_index[tr_id]][
-                            "context"
-                        ] += f" {line_transcription.content}"
-
-                        to_insert[previous_index[tr_id]][
-                            "context_after"
-                        ] = line_transcription.content
-
-                    # If you change the document structure here, don't forget to update the INDEX_MAPPING constant
-                    to_insert.append(
-                        {
-                            "_index": settings.ELASTICSEARCH_COMMON_INDEX,
-                            "_id": f"{line_transcription.id}",
-                            "project_id": project.id,
-                            "document_id": document.id,
-                            "document_name": document.name,
-                            "document_archived": document.is_archived,
-                            "document_part_id": part.id,
-                            "part_title": part.title,
-                            "image_url": thumbnail.url,
-                            "image_width": thumbnail.width,
-                            "image_height": thumbnail.height,
-                            "transcription_id": tr_id,
-                            "transcription_name": line_transcription.transcription.name,
-                            "line_number": line.order + 1,
-                            "raw_content": line_transcription.content,
-                            # Build the enhanced LineTranscription context by adding the last LineTranscription content for this Transcription
-                            "context_before": previous_contents.get(tr_id),
-                            "context_after": None,
-                            "context": f"{previous_contents[tr_id]} {line_transcription.content}"
-                            if tr_id in previous_contents
-                            else line_transcription.content,
-                            # Rescaling the line bbox to match the thumbnail if necessary
-                            "bounding_box": bounding_box,
-                            "have_access": list(set(allowed_users)),
-                        }
-                    )
-
-                    previous_contents[tr_id] = line_transcription.content
-                    previous_index[tr_id] = len(to_insert) - 1
-
-        to_insert = [entry for entry in to_insert if entry["raw_content"]]
-
-        nb_inserted, _ = es_bulk(self.es_client, to_insert, stats_only=True)
-        return nb_inserted
-
-    def retrieve_allowed_users(self, project, document):
-        shared_with_groups = Group.objects.filter(
-            Q(shared_documents=document) | Q(shared_projects=project)
+        # A single query for the whole document
+        line_transcriptions = ordered_line_transcriptions(
+            LineTranscription.objects.filter(line__document_part__in=list(parts))
         )
-        shared_with_users = list(
-            User.objects.filter(
-                Q(groups__in=shared_with_groups)
-                | Q(shared_documents=document)
-                | Q(shared_projects=project)
-            ).values_list("id", flat=True)
+        yield from line_transcriptions_entries(
+            line_transcriptions.iterator(chunk_size=self.chunk_size), parts, allowed_users
         )
-
-        if document.owner_id:
-            shared_with_users.append(document.owner_id)
-
-        return shared_with_users
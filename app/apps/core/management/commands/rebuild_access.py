@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Document, DocumentAccess, Project, ProjectAccess
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed read accesses of the users on the documents and projects.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of documents or projects refreshed in a single transaction.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, access in ((Document, DocumentAccess), (Project, ProjectAccess)):
+            pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+            for i in range(0, len(pks), batch_size):
+                with transaction.atomic():
+                    access.refresh(pks[i:i + batch_size])
+            self.stdout.write(f'Refreshed the accesses of {len(pks)} {model._meta.verbose_name_plural}.')
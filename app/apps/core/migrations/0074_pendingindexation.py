@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0073_remove_documentpart_bw_backend_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingIndexation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_id', models.IntegerField(unique=True)),
+                ('document_part_id', models.IntegerField(null=True)),
+                ('block_id', models.IntegerField(null=True)),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
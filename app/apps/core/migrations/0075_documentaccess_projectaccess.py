@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_access(apps, schema_editor):
+    # cf DocumentAccess.sources and ProjectAccess.sources, inserted by the database in a single query each
+    Document = apps.get_model('core', 'Document')
+    Project = apps.get_model('core', 'Project')
+    tables = (
+        (Document, 'core_documentaccess', 'document_id', (
+            'owner', 'project__owner', 'project__shared_with_users', 'project__shared_with_groups__user',
+            'shared_with_users', 'shared_with_groups__user',
+        )),
+        (Project, 'core_projectaccess', 'project_id', (
+            'owner', 'shared_with_users', 'shared_with_groups__user',
+            'documents__shared_with_users', 'documents__shared_with_groups__user',
+        )),
+    )
+    with schema_editor.connection.cursor() as cursor:
+        for model, table, column, sources in tables:
+            queries = [
+                model.objects.filter(**{f'{source}__isnull': False}).order_by().values_list(source, 'pk')
+                for source in sources
+            ]
+            sql, params = queries[0].union(*queries[1:]).query.sql_with_params()
+            cursor.execute(f'INSERT INTO {table} (user_id, {column}) {sql}', params)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0074_pendingindexation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accesses', to='core.project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='project_accesses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'project')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accesses', to='core.document')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_accesses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'document')},
+            },
+        ),
+        migrations.RunPython(populate_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:29
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking the writes on the line transcriptions
+    atomic = False
+
+    dependencies = [
+        ('core', '0075_documentaccess_projectaccess'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='linetranscription',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('content', config='simple'), name='core_lt_content_search_idx'),
+        ),
+        # not in the state of the model, so that the tables can be created without pg_trgm
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS core_lt_content_trgm_idx "
+            "ON core_linetranscription USING gin (content gin_trgm_ops)",
+            "DROP INDEX CONCURRENTLY IF EXISTS core_lt_content_trgm_idx",
+        ),
+    ]
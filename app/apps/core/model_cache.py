@@ -0,0 +1,154 @@
+"""
+Process-local cache of deserialized kraken models.
+
+Celery workers process many parts with the same model in a row, loading the
+.mlmodel file from disk for each of them is costly, so loaded models are kept
+in a small LRU cache.
+Entries are keyed by OcrModel pk, revision and file mtime, so that a new
+version or a revert of the model automatically misses the cache even in other
+processes, the process doing the change also drops the stale entries right away.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from kraken.kraken import SEGMENTATION_DEFAULT_MODEL
+from kraken.lib import models as kraken_models
+from kraken.lib import vgsl
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+model_cache_hits = Counter(
+    'escriptorium_kraken_model_cache_hits_total',
+    'Number of kraken models served from the process-local cache.',
+    ['kind'])
+model_cache_misses = Counter(
+    'escriptorium_kraken_model_cache_misses_total',
+    'Number of kraken models loaded from disk.',
+    ['kind'])
+model_cache_evictions = Counter(
+    'escriptorium_kraken_model_cache_evictions_total',
+    'Number of kraken models evicted from the process-local cache.',
+    ['kind'])
+
+KIND_RECOGNITION = 'recognition'
+KIND_SEGMENTATION = 'segmentation'
+
+
+class ModelCache:
+    """
+    Thread safe LRU cache bounded by a number of entries and by the
+    (estimated) memory footprint of the models it holds.
+    The footprint of a model is estimated by the size of its file.
+    """
+
+    def __init__(self, max_entries=None, max_memory=None):
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self._entries = OrderedDict()  # key -> (model, size, kind)
+        self._lock = threading.Lock()
+
+    @property
+    def memory(self):
+        return sum(size for _, size, _ in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, loader, size=0, kind=KIND_RECOGNITION):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                model_cache_hits.labels(kind=kind).inc()
+                return self._entries[key][0]
+
+        model_cache_misses.labels(kind=kind).inc()
+        model = loader()
+
+        with self._lock:
+            self._entries[key] = (model, size, kind)
+            self._entries.move_to_end(key)
+            self._evict()
+        return model
+
+    def _evict(self):
+        # always keep the most recently used entry, even if it is too large on its own
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_memory is not None and self.memory > self.max_memory)):
+            key, (_, _, kind) = self._entries.popitem(last=False)
+            model_cache_evictions.labels(kind=kind).inc()
+            logger.debug('Evicted kraken model %s from cache.', key)
+
+    def invalidate(self, pk):
+        """
+        Drops all the cached revisions of the given OcrModel pk.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == pk]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = ModelCache(
+    max_entries=getattr(settings, 'KRAKEN_MODEL_CACHE_SIZE', 4),
+    max_memory=getattr(settings, 'KRAKEN_MODEL_CACHE_MAX_MEMORY', 1024) * 1024 * 1024)
+
+
+def _enabled():
+    return getattr(settings, 'KRAKEN_MODEL_CACHE_SIZE', 4) > 0
+
+
+def _file_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, 0
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load(ocr_model, path, loader, kind):
+    if not _enabled():
+        model_cache_misses.labels(kind=kind).inc()
+        return loader(path)
+
+    mtime, size = _file_key(path)
+    if ocr_model is not None:
+        key = (ocr_model.pk, ocr_model.revision.hex, mtime)
+    else:
+        key = (None, path, mtime)
+    return cache.get(key, lambda: loader(path), size=size, kind=kind)
+
+
+def load_recognition_model(ocr_model):
+    """
+    Returns the kraken recognition model of the given OcrModel.
+    """
+    return _load(ocr_model, ocr_model.file.path,
+                 kraken_models.load_any, KIND_RECOGNITION)
+
+
+def load_segmentation_model(ocr_model=None):
+    """
+    Returns the kraken segmentation model of the given OcrModel
+    or kraken's default segmentation model.
+    """
+    if ocr_model is not None:
+        path = ocr_model.file.path
+    else:
+        path = SEGMENTATION_DEFAULT_MODEL
+    return _load(ocr_model, path,
+                 vgsl.TorchVGSLModel.load_model, KIND_SEGMENTATION)
+
+
+def invalidate(ocr_model_pk):
+    cache.invalidate(ocr_model_pk)
@@ -1,14 +1,12 @@
-import functools
-import itertools
 import json
 import logging
-import math
 import os
 import re
 import shutil
 import subprocess
 import time
 import uuid
+from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime
 from glob import glob
@@ -16,18 +14,25 @@ from os import makedirs, path
 from statistics import mean
 
 import numpy as np
+import pyvips
 from celery import chain
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.core import checks
+from django.core.cache import cache
 from django.core.files.uploadedfile import File
 from django.core.validators import FileExtensionValidator
 from django.db import models, transaction
-from django.db.models import Avg, JSONField, Prefetch, Q, Sum
+from django.db.models import Avg, F, JSONField, Prefetch, Q, Sum
+from django.db.models.constants import LOOKUP_SEP
 from django.db.models.functions import Coalesce, Length
-from django.db.models.signals import pre_delete
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.forms import ValidationError
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
@@ -35,27 +40,31 @@ from django_prometheus.models import ExportModelOperationsMixin
 from easy_thumbnails.files import get_thumbnailer
 from kraken import blla, rpred
 from kraken.containers import BaselineLine, Segmentation
-from kraken.kraken import SEGMENTATION_DEFAULT_MODEL
-from kraken.lib import models as kraken_models
-from kraken.lib import vgsl
 from kraken.lib.segmentation import calculate_polygonal_environment
-from ordered_model.models import OrderedModel, OrderedModelManager
+from ordered_model.models import OrderedModel, OrderedModelManager, OrderedModelQuerySet
 from PIL import Image
-from shapely import affinity
+from shapely import STRtree, affinity
 from shapely.geometry import LineString, Polygon
 from skimage.measure import approximate_polygon
 from sklearn import preprocessing
 from sklearn.cluster import DBSCAN
 
+from core import model_cache
+from core.search import PSQL_SEARCH_CONFIG, invalidate_search_results
 from core.tasks import (
     align,
     convert,
+    delete_search_entries,
     generate_part_thumbnails,
+    generate_part_tiles,
     lossless_compression,
+    schedule_search_indexing,
     segment,
     segtrain,
     train,
     transcribe,
+    transcribe_parts,
+    update_search_documents,
 )
 from core.utils import ColorField
 from core.validators import JSONSchemaValidator
@@ -76,6 +85,10 @@ class AlreadyProcessingException(Exception):
     pass
 
 
+class ProcessCanceledException(Exception):
+    pass
+
+
 class CascadeUpdate():
     """
     This base class allows to update the updated_at date of parent models on save of this model
@@ -426,17 +439,8 @@ class ProjectManager(models.Manager):
         )
 
     def for_user_read(self, user):
-        # return the list of VIEWABLE projects
-        # Note: Monitor this query
-        return self.filter(
-            Q(owner=user)
-            | Q(shared_with_users=user)
-            | Q(shared_with_groups__user=user)
-            | (
-                Q(documents__shared_with_users=user)
-                | Q(documents__shared_with_groups__user=user)
-            )
-        ).distinct()
+        # return the list of VIEWABLE projects, cf ProjectAccess
+        return self.filter(accesses__user=user)
 
 
 class Project(ExportModelOperationsMixin("Project"), models.Model):
@@ -472,6 +476,13 @@ class Project(ExportModelOperationsMixin("Project"), models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # cf refresh_project_access signal receiver
+        instance._access_owner_id = instance.__dict__.get("owner_id")
+        return instance
+
     def make_slug(self):
         slug = slugify(self.name, allow_unicode=True)
         # check unicity
@@ -489,17 +500,11 @@ class Project(ExportModelOperationsMixin("Project"), models.Model):
 
 class DocumentManager(models.Manager):
     def for_user(self, user):
+        # cf DocumentAccess
         return (
-            Document.objects.filter(
-                Q(owner=user)
-                | Q(project__owner=user)
-                | Q(project__shared_with_users=user)
-                | Q(project__shared_with_groups__user=user)
-                | (Q(shared_with_users=user) | Q(shared_with_groups__user=user))
-            )
+            Document.objects.filter(accesses__user=user)
             .exclude(workflow_state=Document.WORKFLOW_STATE_ARCHIVED)
             .select_related("owner")
-            .distinct()
         )
 
 
@@ -607,6 +612,27 @@ class Document(ExportModelOperationsMixin("Document"), CascadeUpdate, models.Mod
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # cf update_search_document signal receiver
+        instance._indexed_values = cls.indexed_values(instance)
+        # cf refresh_document_access signal receiver
+        instance._access_values = cls.access_values(instance)
+        # cf recount_document_disk_usage signal receiver
+        instance._counted_owner_id = instance.__dict__.get("owner_id")
+        return instance
+
+    @staticmethod
+    def indexed_values(instance):
+        # values of the document copied in its search index entries
+        return tuple(instance.__dict__.get(field) for field in ("name", "workflow_state", "project_id"))
+
+    @staticmethod
+    def access_values(instance):
+        # values of the document giving a read access on it
+        return tuple(instance.__dict__.get(field) for field in ("owner_id", "project_id"))
+
     def save(self, *args, **kwargs):
         created = not self.pk
         res = super().save(*args, **kwargs)
@@ -860,6 +886,75 @@ class Document(ExportModelOperationsMixin("Document"), CascadeUpdate, models.Mod
             **kwargs,
         )
 
+    def busy_parts(self, parts):
+        """
+        Returns the pks of the parts that are being converted, segmented, aligned or which last
+        segmentation, transcription or alignment is still queued or running, like DocumentPart.workflow
+        does it for a single part but in one query.
+        """
+        busy = {part.pk for part in parts
+                if part.workflow_state in (DocumentPart.WORKFLOW_STATE_CONVERTING,
+                                           DocumentPart.WORKFLOW_STATE_SEGMENTING,
+                                           DocumentPart.WORKFLOW_STATE_ALIGNING)}
+        last_states = {}
+        for part_pk, method, state in (TaskReport.objects
+                                       .filter(document_part__in=parts,
+                                               method__in=["core.tasks.segment", "core.tasks.transcribe", "core.tasks.align"])
+                                       .order_by('pk')
+                                       .values_list('document_part_id', 'method', 'workflow_state')):
+            last_states[part_pk, method] = state
+        busy.update(part_pk for (part_pk, method), state in last_states.items()
+                    if state in (TaskReport.WORKFLOW_STATE_QUEUED, TaskReport.WORKFLOW_STATE_STARTED))
+        return busy
+
+    def queue_transcription(self, parts, model, transcription, user=None, task_group=None):
+        """
+        Transcribes the given parts by chunks of TRANSCRIBE_PARTS_CHUNK_SIZE parts,
+        each chunk being processed by a single celery task sharing the loaded model
+        and the user checks.
+        A queued TaskReport is still created for each part, its task_id is the id of
+        the chunk task suffixed by the part pk so that parts can be canceled individually.
+        Parts with a task still pending are skipped.
+        """
+        chunk_size = getattr(settings, 'TRANSCRIBE_PARTS_CHUNK_SIZE', 50)
+        parts = list(parts)
+        # parts already queued or being processed are not transcribed twice at the same time
+        busy = self.busy_parts(parts)
+        if busy and user:
+            user.notify(_("%d parts are already being processed, they will not be transcribed.") % len(busy),
+                        id="transcription-warning", level='warning')
+        parts = [part for part in parts if part.pk not in busy]
+        for i in range(0, len(parts), chunk_size):
+            chunk = parts[i:i + chunk_size]
+            sig = transcribe_parts.si(document_pk=self.pk,
+                                      part_pks=[part.pk for part in chunk],
+                                      model_pk=model.pk,
+                                      transcription_pk=transcription.pk,
+                                      user_pk=user and user.pk or None,
+                                      task_group_pk=task_group and task_group.pk or None)
+            task_id = sig.freeze().id
+            if user:
+                TaskReport.objects.bulk_create([
+                    TaskReport(user=user,
+                               group=task_group,
+                               label='Transcribe in %s' % self.name,
+                               document=self,
+                               document_part=part,
+                               ocr_model=model,
+                               task_id='%s:%d' % (task_id, part.pk),
+                               method='core.tasks.transcribe')
+                    for part in chunk
+                ])
+            for part in chunk:
+                send_event('document', self.pk, 'part:workflow', {
+                    'id': part.pk,
+                    'process': 'transcribe',
+                    'status': 'pending',
+                    'task_id': task_id,
+                    'data': {}
+                })
+            sig.delay()
+
     def cancel_alignment(self, revoke_task=True, username=None):
         """Cancel the alignment task; adapted from OcrModel"""
         task_id = None
@@ -887,11 +982,331 @@ class Document(ExportModelOperationsMixin("Document"), CascadeUpdate, models.Mod
         DocumentPart.objects.bulk_update(parts, ["workflow_state"])
 
 
+class AccessTable(models.Model):
+    """
+    A precomputed (user, object) read access, so that the visibility of the objects
+    is answered by a single indexed join instead of OR-ing all the ways to share them.
+    The rows are refreshed by the signal receivers when an owner, a share or the members
+    of a group change, the rebuild_access command recomputes them all.
+    """
+    # the field pointing to the object and the ways a user can read it
+    object_field = None
+    sources = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def granted(cls, pks):
+        # the (user, object) pairs of the objects in a single query
+        objects = cls._meta.get_field(cls.object_field).related_model.objects.filter(pk__in=pks).order_by()
+        queries = [
+            objects.filter(**{f"{source}__isnull": False}).values_list(source, "pk")
+            for source in cls.sources
+        ]
+        return queries[0].union(*queries[1:])
+
+    @classmethod
+    def refresh(cls, pks):
+        """
+        Brings the rows of the objects in line with their owner and shares.
+        """
+        pks = list(pks)
+        if not pks:
+            return
+        granted = set(cls.granted(pks))
+        existing = {}
+        for pk, user_id, object_id in cls.objects.filter(
+            **{f"{cls.object_field}__in": pks}
+        ).values_list("pk", "user_id", f"{cls.object_field}_id"):
+            existing[(user_id, object_id)] = pk
+
+        stale = {pair: pk for pair, pk in existing.items() if pair not in granted}
+        if stale:
+            cls.objects.filter(pk__in=stale.values()).delete()
+        new = [pair for pair in granted if pair not in existing]
+        cls.objects.bulk_create(
+            [cls(**{"user_id": user_id, f"{cls.object_field}_id": object_id}) for user_id, object_id in new],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        invalidate_search_results(user_ids=[user_id for user_id, _ in [*stale, *new]])
+
+
+class DocumentAccess(AccessTable):
+    # cf DocumentManager.for_user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="document_accesses")
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="accesses")
+
+    object_field = "document"
+    sources = (
+        "owner",
+        "project__owner",
+        "project__shared_with_users",
+        "project__shared_with_groups__user",
+        "shared_with_users",
+        "shared_with_groups__user",
+    )
+
+    class Meta:
+        unique_together = (("user", "document"),)
+
+
+class ProjectAccess(AccessTable):
+    # cf ProjectManager.for_user_read
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="project_accesses")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="accesses")
+
+    object_field = "project"
+    sources = (
+        "owner",
+        "shared_with_users",
+        "shared_with_groups__user",
+        "documents__shared_with_users",
+        "documents__shared_with_groups__user",
+    )
+
+    class Meta:
+        unique_together = (("user", "project"),)
+
+
+def avg_line_height(origins):
+    """
+    Returns the average line height of a group of lines (usually a block) from the origin points
+    of its lines, taking into account a number of columns devised by clustering the x of the origins.
+    Key parameters of the algorithm:
+    x_cluster: tolerance used to gather lines in a column
+    line_height_decrease: scaling factor to avoid over gathering of lines
+    """
+    x_cluster, line_height_decrease = 0.1, 0.8
+
+    # Devise the number of columns by performing DBSCAN clustering on x coordinate of line origins
+    x_origins = origins[:, 0].reshape(-1, 1)
+    x_scaled = preprocessing.MinMaxScaler().fit_transform(x_origins)
+    labels = DBSCAN(eps=x_cluster).fit(x_scaled).labels_
+
+    # Compute the average line size based on the guessed number of columns,
+    # and keep the min of the averages line heights of the columns
+    y_origins = origins[:, 1]
+    line_heights = []
+    for label in np.unique(labels):
+        y_origins_column = y_origins[labels == label]
+        line_heights.append(
+            (y_origins_column.max() - y_origins_column.min()) / y_origins_column.size)
+    return min(line_heights) * line_height_decrease
+
+
+def _rows(y_origins, avg_height):
+    """
+    Returns a row index for each y, lines are in the same row
+    when they are less than avg_height apart vertically.
+    """
+    order = np.argsort(y_origins, kind="stable")
+    rows = np.empty(len(y_origins), dtype=int)
+    rows[order] = np.concatenate(([0], np.cumsum(np.diff(y_origins[order]) >= avg_height)))
+    return rows
+
+
+def sort_lines(lines, origin_box, read_direction):
+    """
+    Returns the given lines sorted in reading order.
+    Blocks are sorted by the distance of their origin point (the point of the box closest to origin_box)
+    to origin_box. The lines of a block are gathered in rows when their origins are vertically closer
+    than the average line height of the block, rows are read from top to bottom and the lines of a row
+    by distance to origin_box.
+    Lines outside of any block are gathered in rows the same way and each row is placed
+    among the blocks according to its distance to origin_box.
+    Lines with an invalid geometry are put at the end.
+    Everything is computed on numpy arrays, the origin points are computed only once.
+    """
+    origin = np.asarray(origin_box, dtype=float)
+    n = len(lines)
+
+    def poly_origin_pt(shape):
+        pts = np.asarray(shape, dtype=float).reshape(-1, 2)
+        return pts[np.argmin(np.hypot(*(pts - origin).T))]
+
+    # origin points of the lines and of their block
+    line_origins = np.full((n, 2), np.nan)
+    block_origins = {}
+    for i, line in enumerate(lines):
+        try:
+            if line.baseline:
+                line_origins[i] = line.baseline[
+                    -1 if read_direction == Document.READ_DIRECTION_RTL else 0
+                ]
+            elif line.mask:
+                line_origins[i] = poly_origin_pt(line.mask)
+        except (TypeError, ValueError, IndexError):  # invalid line
+            pass
+        if line.block_id and line.block_id not in block_origins:
+            try:
+                block_origins[line.block_id] = poly_origin_pt(line.block.box)
+            except (TypeError, ValueError, IndexError):  # invalid block
+                block_origins[line.block_id] = np.full(2, np.nan)
+
+    line_dists = np.hypot(*(line_origins - origin).T)
+    valid = ~np.isnan(line_dists)
+    block_ids = np.array([line.block_id or 0 for line in lines])
+
+    groups = np.zeros(n, dtype=int)
+    group_dists = np.full(n, np.inf)
+    rows = np.zeros(n, dtype=int)
+
+    for group, block_id in enumerate(np.unique(block_ids), start=1):
+        idx = np.flatnonzero((block_ids == block_id) & valid)
+        if not len(idx):
+            continue
+        block_rows = _rows(line_origins[idx, 1], avg_line_height(line_origins[idx]))
+        if block_id:
+            groups[idx] = group
+            group_dists[idx] = np.hypot(*(block_origins[block_id] - origin))
+            rows[idx] = block_rows
+        else:
+            # orphan lines, every row is its own group, placed by its closest line
+            for row in np.unique(block_rows):
+                row_idx = idx[block_rows == row]
+                groups[row_idx] = -(row + 1)
+                group_dists[row_idx] = line_dists[row_idx].min()
+
+    group_dists[np.isnan(group_dists)] = np.inf
+    # np.lexsort sorts by the last key first
+    order = np.lexsort((np.arange(n), np.nan_to_num(line_dists), rows, groups, group_dists, ~valid))
+    return [lines[i] for i in order]
+
+
+def resolve_typologies(valid_types, names):
+    """
+    Returns a dict of typologies by name from a valid types relation of a Document
+    (valid_block_types, valid_line_types..), creating the missing ones in a single pass.
+    """
+    names = set(names)
+    typologies = {}
+    # Note: there should not be duplicates if the modelisation was alright
+    # but for now we hack by picking the first one
+    for typo in valid_types.filter(name__in=[name for name in names if name is not None]):
+        typologies.setdefault(typo.name, typo)
+    for name in names - typologies.keys():
+        typologies[name], created = valid_types.get_or_create(name=name)
+    return typologies
+
+
+def region_finder(regions):
+    """
+    Builds a spatial index of the boxes of the given regions and returns a function
+    giving the first region (in the given order) containing a point, or None.
+    """
+    regions = list(regions)
+    tree = STRtree([Polygon(region.box) for region in regions])
+
+    def find_region(point):
+        # the tree returns the indexes of all the boxes containing the point
+        matches = tree.query(point, predicate="within")
+        return regions[matches.min()] if len(matches) else None
+
+    return find_region
+
+
+def png_save_options():
+    options = {"compression": getattr(settings, "PNG_COMPRESSION_LEVEL", 6)}
+    if getattr(settings, "IMAGE_STRIP_METADATA", False):
+        # strip is deprecated since libvips 8.15, replaced by the flags of the metadata to keep (none here)
+        if pyvips.at_least_libvips(8, 15):
+            options["keep"] = 0
+        else:
+            options["strip"] = True
+    return options
+
+
+def convert_to_png(src, dest, backend=None):
+    """
+    Converts the image file src to a png file dest.
+    With the 'vips' backend (the default, see IMAGE_PROCESSING_BACKEND) the image is streamed
+    in process by pyvips, with bounded memory usage,
+    ImageMagick's convert is used if pyvips fails or with the 'subprocess' backend.
+    """
+    backend = backend or getattr(settings, "IMAGE_PROCESSING_BACKEND", "vips")
+    if backend == "vips":
+        try:
+            image = pyvips.Image.new_from_file(src, access="sequential")
+            image.pngsave(dest, **png_save_options())
+            return
+        except pyvips.error.Error as e:
+            logger.warning("pyvips failed to convert %s, falling back to convert: %s", src, e)
+
+    error = subprocess.check_call(["convert", src, dest])
+    if error:
+        raise RuntimeError("Error trying to convert file(%s) to png." % src)
+
+
+def compress_png(src, dest, backend=None):
+    """
+    Losslessly recompresses the png file src to dest,
+    with pyvips or with pngcrush as a fallback (see convert_to_png).
+    """
+    backend = backend or getattr(settings, "IMAGE_PROCESSING_BACKEND", "vips")
+    if backend == "vips":
+        try:
+            image = pyvips.Image.new_from_file(src, access="sequential")
+            image.pngsave(dest, **png_save_options())
+            return
+        except pyvips.error.Error as e:
+            logger.warning("pyvips failed to compress %s, falling back to pngcrush: %s", src, e)
+
+    subprocess.check_call(["pngcrush", "-q", src, dest])
+
+
 def document_images_path(instance, filename):
     return "documents/{0}/{1}".format(instance.document.pk, filename)
 
 
-class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, OrderedModel):
+class DiskUsageMixin:
+    """
+    The size of the file of the instance (DISK_USAGE_FIELD) is counted in the disk_usage
+    of the user it belongs to, found by the DISK_USAGE_OWNER_FIELD lookup from the instance,
+    cf users.User.disk_usage and the signal receivers at the end of this module.
+    """
+
+    DISK_USAGE_FIELD = None
+    DISK_USAGE_OWNER_FIELD = None
+
+    @classmethod
+    def check(cls, **kwargs):
+        errors = super().check(**kwargs)
+        if not (cls.DISK_USAGE_FIELD and cls.DISK_USAGE_OWNER_FIELD):
+            errors.append(checks.Error(
+                "DiskUsageMixin models must set DISK_USAGE_FIELD and DISK_USAGE_OWNER_FIELD.",
+                obj=cls,
+                id="core.E001",
+            ))
+        return errors
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the size already counted and who for, deferred fields are not in __dict__
+        instance._counted_size = instance.__dict__.get(cls.DISK_USAGE_FIELD)
+        instance._counted_owner = instance.__dict__.get(cls.disk_usage_owner_key().attname)
+        return instance
+
+    @classmethod
+    def disk_usage_owner_key(cls):
+        # the field of the instance leading to its owner
+        return cls._meta.get_field(cls.DISK_USAGE_OWNER_FIELD.split(LOOKUP_SEP)[0])
+
+    def disk_usage_owner(self, key=None):
+        # queryset of the user the file is counted for,
+        # or was counted for if key is a previous value of the disk_usage_owner_key field
+        field = self.disk_usage_owner_key()
+        if key is None:
+            key = getattr(self, field.attname)
+        lookup = self.DISK_USAGE_OWNER_FIELD.split(LOOKUP_SEP, 1)[1:]
+        if not lookup:
+            return User.objects.filter(pk=key)
+        return User.objects.filter(pk__in=field.related_model.objects.filter(pk=key).values(lookup[0]))
+
+
+class DocumentPart(ExportModelOperationsMixin("DocumentPart"), DiskUsageMixin, CascadeUpdate, OrderedModel):
     """
     Represents a physical part of a larger document that is usually a page
     """
@@ -944,6 +1359,9 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
     transcription_progress = models.PositiveSmallIntegerField(default=0)
 
     cascade_to = 'document'
+    DISK_USAGE_FIELD = 'image_file_size'
+    DISK_USAGE_OWNER_FIELD = 'document__owner'
+    TILES_URI_CACHE_KEY = "tiles-uri:{}"
 
     class Meta(OrderedModel.Meta):
         pass
@@ -1000,119 +1418,17 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
             0,
         ]
 
-        def distance(x, y):
-            return math.sqrt(sum([(a - b) ** 2 for a, b in zip(x, y)]))
-
-        def poly_origin_pt(shape):
-            return min(shape, key=lambda pt: distance(pt, origin_box))
-
-        def baseline_origin_pt(baseline_, read_direction_):
-            return baseline_[
-                -1 if read_direction_ == Document.READ_DIRECTION_RTL else 0
-            ]
-
-        def line_origin_pt(line_, read_direction_):
-            return (
-                baseline_origin_pt(line_.baseline, read_direction_)
-                if line_.baseline
-                else poly_origin_pt(line_.mask)
-            )
-
-        def line_block_pk(line_):
-            return line_.block.pk if line_.block else 0
-
-        def avg_line_height_column(y_origins_np, line_labels):
-            """ "Return the min of the averages line heights of the columns"""
-            labels = np.unique(line_labels)
-            line_heights_list = []
-            for label in labels:
-                y_origins_column = y_origins_np[line_labels == label]
-                column_height = (
-                    y_origins_column.max() - y_origins_column.min()
-                ) / y_origins_column.size
-                line_heights_list.append(column_height)
-            return min(line_heights_list)
-
-        def avg_line_height_block(lines_in_block, read_direction_):
-            """Returns the average line height in the block taking into account devising number of columns
-            based on x lines origins clustering. Key parameters of the algorithm:
-            x_cluster: tolerance used to gather lines in a column
-            line_height_decrease: scaling factor to avoid over gathering of lines"""
-            x_cluster, line_height_decrease = 0.1, 0.8
-
-            origins_np = np.array(
-                list(map(lambda line: line_origin_pt(line, read_direction_), lines_in_block))
-            )
-
-            # Devise the number of columns by performing DBSCAN clustering on x coordinate of line origins
-            x_origins_np = origins_np[:, 0].reshape(-1, 1)
-            scaler = preprocessing.MinMaxScaler()
-            scaler.fit(x_origins_np)
-            x_scaled = scaler.transform(x_origins_np)
-            clustering = DBSCAN(eps=x_cluster)
-            clustering.fit(x_scaled)
-
-            # Compute the average line size based on the guessed number of columns
-            y_origins_np = origins_np[:, 1]
-            return (
-                avg_line_height_column(y_origins_np, clustering.labels_)
-                * line_height_decrease
-            )
-
-        def avg_lines_heights_dict(lines, read_direction_):
-            """Returns a dictionary with block.pk (or 0 if None) as keys and average lines height
-            in the block as values"""
-            sorted_by_block = sorted(lines, key=line_block_pk)
-            organized_by_block = itertools.groupby(sorted_by_block, key=line_block_pk)
-
-            avg_heights = {}
-            for block_pk, lines_in_block in organized_by_block:
-                avg_heights[block_pk] = avg_line_height_block(
-                    lines_in_block, read_direction_
-                )
-            return avg_heights
-
         # fetch all lines and regroup them by block
-        qs = self.lines.select_related("block").all()
-        ls = list(qs)
+        ls = list(self.lines.select_related("block").all())
         if len(ls) == 0:
             return
 
-        dict_avg_heights = avg_lines_heights_dict(ls, read_direction)
-
-        def cmp_lines(a, b):
-            # cache origin pts for efficiency
-            if not hasattr(a, "origin_pt"):
-                a.origin_pt = line_origin_pt(a, read_direction)
-            if not hasattr(b, "origin_pt"):
-                b.origin_pt = line_origin_pt(b, read_direction)
-
-            try:
-                if a.block != b.block:
-                    pt1 = poly_origin_pt(a.block.box) if a.block else a.origin_pt
-                    pt2 = poly_origin_pt(b.block.box) if b.block else b.origin_pt
-
-                    # when comparing blocks we can use the distance
-                    return distance(pt1, origin_box) - distance(pt2, origin_box)
-                else:
-                    pt1 = a.origin_pt
-                    pt2 = b.origin_pt
-
-                    # # 2 lines more or less on the same level
-                    avg_height = dict_avg_heights[line_block_pk(a)]
-                    if abs(pt1[1] - pt2[1]) < avg_height:
-                        return distance(pt1, origin_box) - distance(pt2, origin_box)
-                return pt1[1] - pt2[1]
-            except TypeError:  # invalid line
-                return 0
-
-        # sort depending on the distance to the origin
-        ls.sort(key=functools.cmp_to_key(lambda a, b: cmp_lines(a, b)))
-        # one query / line, super gory
-        for order, line in enumerate(ls):
+        updated = []
+        for order, line in enumerate(sort_lines(ls, origin_box, read_direction)):
             if line.order != order:
                 line.order = order
-                line.save()
+                updated.append(line)
+        Line.objects.bulk_update(updated, ["order"], batch_size=1000)
 
     def save(self, *args, **kwargs):
         new = self.pk is None
@@ -1174,6 +1490,7 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
             "core.tasks.convert",
             "core.tasks.lossless_compression",
             "core.tasks.generate_part_thumbnails",
+            "core.tasks.generate_part_tiles",
         ]
         if self.workflow_state == self.WORKFLOW_STATE_SEGMENTING:
             self.workflow_state = self.WORKFLOW_STATE_CONVERTED
@@ -1247,9 +1564,7 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         filename, extension = os.path.splitext(old_name)
         if extension != ".png":
             new_name = filename + ".png"
-            error = subprocess.check_call(["convert", old_name, new_name])
-            if error:
-                raise RuntimeError("Error trying to convert file(%s) to png.")
+            convert_to_png(old_name, new_name)
 
             self.image = new_name.split(settings.MEDIA_ROOT)[1][1:]
             os.remove(old_name)
@@ -1263,21 +1578,100 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         if not getattr(settings, "COMPRESS_ENABLE", True):
             return
         filename, extension = os.path.splitext(self.image.file.name)
-        if extension != "png":
+        if extension != ".png":
             return
         opti_name = filename + "_opti.png"
         try:
-            subprocess.check_call(["pngcrush", "-q", self.image.file.name, opti_name])
+            compress_png(self.image.file.name, opti_name)
         except Exception as e:
             # Note: let it fail it's fine
             logger.exception("png optimization failed for %s." % filename)
             if settings.DEBUG:
                 raise e
         else:
+            if os.path.getsize(opti_name) >= os.path.getsize(self.image.file.name):
+                # e.g. a palette or 1-bit image saved again with 8-bit channels
+                os.remove(opti_name)
+                return
             os.rename(opti_name, self.image.file.name)
             self.image_file_size = self.image.size
             self.save()
 
+    def tiles_base(self):
+        # path (relative to MEDIA_ROOT) of the tile pyramids of the image without their version
+        dirname, basename = os.path.split(self.image.name)
+        return os.path.join(dirname, "tiles", os.path.splitext(basename)[0])
+
+    @property
+    def tiles_path(self):
+        """
+        Path (relative to MEDIA_ROOT) of the deep zoom tile pyramid of the image, without extension.
+        It depends on the image name and modification time so that a rotated or cropped image
+        gets new tiles at a new url.
+        """
+        return "%s_v%x" % (self.tiles_base(), os.stat(self.image.path).st_mtime_ns)
+
+    @property
+    def tiles_uri(self):
+        """
+        Url of the .dzi descriptor of the tile pyramid of the image, None if it wasn't generated
+        for the current version of the image.
+        """
+        if not self.image:
+            return None
+        # cached, it is serialized with every part of a document
+        key = self.TILES_URI_CACHE_KEY.format(self.pk)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == self.image.name:
+            return cached[1]
+        try:
+            dzi = self.tiles_path + ".dzi"
+        except FileNotFoundError:
+            return None
+        uri = self.image.storage.url(dzi) if self.image.storage.exists(dzi) else None
+        cache.set(key, (self.image.name, uri))
+        return uri
+
+    def make_tiles(self):
+        """
+        Builds a Deep Zoom (DZI) tile pyramid of the image with pyvips,
+        so that clients can only fetch the visible part of the image at a given zoom level.
+        Like the thumbnails, the tiles are not counted in the disk usage of the owner,
+        they are a cache of the image that depends on the settings of the instance.
+        """
+        if not getattr(settings, "TILES_ENABLE", False):
+            return
+        self.delete_tiles()
+        base = os.path.join(settings.MEDIA_ROOT, self.tiles_path)
+        makedirs(os.path.dirname(base), exist_ok=True)
+        image = pyvips.Image.new_from_file(self.image.path, access="sequential")
+        image.dzsave(base,
+                     layout="dz",
+                     tile_size=getattr(settings, "TILES_SIZE", 256),
+                     overlap=getattr(settings, "TILES_OVERLAP", 1),
+                     suffix=getattr(settings, "TILES_FORMAT", ".jpg[Q=90]"))
+        cache.delete(self.TILES_URI_CACHE_KEY.format(self.pk))
+
+    def delete_tiles(self):
+        # deletes the tiles of every version of the image
+        if not self.image:
+            return
+        cache.delete(self.TILES_URI_CACHE_KEY.format(self.pk))
+        dirname, stem = os.path.split(os.path.join(settings.MEDIA_ROOT, self.tiles_base()))
+        # only the versions of this image, not the ones of page_v2.png when this one is page.png
+        versions = re.compile(re.escape(stem) + r"_v[0-9a-f]+(\.dzi|_files)")
+        try:
+            names = os.listdir(dirname)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if versions.fullmatch(name):
+                tiles = os.path.join(dirname, name)
+                if os.path.isdir(tiles):
+                    shutil.rmtree(tiles, ignore_errors=True)
+                else:
+                    os.remove(tiles)
+
     def segment(
         self,
         steps=None,
@@ -1292,11 +1686,7 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         self.workflow_state = self.WORKFLOW_STATE_SEGMENTING
         self.save()
 
-        if model:
-            model_path = model.file.path
-        else:
-            model_path = SEGMENTATION_DEFAULT_MODEL
-        model_ = vgsl.TorchVGSLModel.load_model(model_path)
+        model_ = model_cache.load_segmentation_model(model)
 
         # TODO: check model_type [None, 'recognition', 'segmentation']
         #    &  seg_type [None, 'bbox', 'baselines']
@@ -1320,23 +1710,25 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
             res = blla.segment(im, **options)
 
             if steps in ["regions", "both"]:
+                typologies = resolve_typologies(self.document.valid_block_types,
+                                                res.regions.keys())
+                blocks = []
                 for region_type, regions in res.regions.items():
-                    try:
-                        typo, created = self.document.valid_block_types.get_or_create(
-                            name=region_type)
-                    except BlockType.MultipleObjectsReturned:
-                        # Note: this should not happen if the modelisation was alright
-                        # but for now we hack
-                        typo = self.document.valid_block_types.filter(name=region_type)[0]
                     for region in regions:
-                        Block.objects.create(
+                        block = Block(
                             document_part=self,
-                            typology=typo,
+                            typology=typologies[region_type],
                             box=region.boundary,
                         )
+                        block.make_external_id()
+                        blocks.append(block)
+                Block.objects.bulk_create(blocks, batch_size=1000)
 
-            regions = self.blocks.all()
             if steps in ["lines", "both"]:
+                typologies = resolve_typologies(self.document.valid_line_types,
+                                                {line.tags.get("type") for line in res.lines})
+                find_region = region_finder(self.blocks.all())
+                lines = []
                 for line in res.lines:
                     mask = line.boundary if line.boundary is not None else None
                     baseline = line.baseline
@@ -1344,23 +1736,16 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
                     # calculate if the center of the line is contained in one of the region
                     # (pick the first one that matches)
                     center = LineString(baseline).interpolate(0.5, normalized=True)
-                    region = next(
-                        (r for r in regions if Polygon(r.box).contains(center)), None
-                    )
-                    try:
-                        typo, created = self.document.valid_line_types.get_or_create(
-                            name=line.tags.get("type"))
-                    except LineType.MultipleObjectsReturned:
-                        # Note: this should not happen if the modelisation was alright
-                        # but for now we hack
-                        typo = self.document.valid_line_types.filter(name=line.tags.get("type"))[0]
-                    Line.objects.create(
+                    line_ = Line(
                         document_part=self,
-                        typology=typo,
-                        block=region,
+                        typology=typologies[line.tags.get("type")],
+                        block=find_region(center),
                         baseline=baseline,
                         mask=mask,
                     )
+                    line_.make_external_id()
+                    lines.append(line_)
+                Line.objects.bulk_create(lines, batch_size=1000)
 
         im.close()
 
@@ -1368,10 +1753,25 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         self.save()
         self.recalculate_ordering(read_direction=read_direction)
 
-    def transcribe(self, model, transcription, text_direction=None, user=None):
-        model_ = kraken_models.load_any(model.file.path)
+    def transcribe(self, model, transcription, text_direction=None, user=None, batch_size=None,
+                   kraken_model=None, is_canceled=None):
+        """
+        Recognizes the lines of this part with the given model.
+        Lines are sent to kraken by chunks of batch_size lines sharing the same
+        Segmentation, which avoids setting up a new rpred pass for every line.
+        batch_size defaults to settings.KRAKEN_RECOGNITION_BATCH_SIZE,
+        0 (or None) recognizes all the lines of the part in a single pass.
+        kraken_model allows to pass an already loaded model.
+        is_canceled is called before each batch, if it returns True ProcessCanceledException
+        is raised and nothing is saved.
+        """
+        model_ = kraken_model or model_cache.load_recognition_model(model)
+
+        if batch_size is None:
+            batch_size = getattr(settings, 'KRAKEN_RECOGNITION_BATCH_SIZE', 0)
 
-        lines = self.lines.all()
+        # bypass lines without baseline
+        lines = [line for line in self.lines.all() if line.baseline]
         text_direction = (
             text_direction
             or (self.document.main_script and self.document.main_script.text_direction)
@@ -1385,21 +1785,24 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         else:
             reorder = 'L'
 
+        if batch_size:
+            batches = [lines[i:i + batch_size] for i in range(0, len(lines), batch_size)]
+        else:
+            batches = [lines] if lines else []
+
+        predictions = []
         with Image.open(self.image.file.name) as im:
-            line_confidences = []
-            for line in lines:
-                if not line.baseline:
-                    # bypass lines without baseline
-                    continue
-                else:
-                    bll = BaselineLine(id='foo',
-                                       baseline=line.baseline,
-                                       boundary=line.mask)
-                    seg = Segmentation(type='baselines',
-                                       imagename='/dummy.png',
-                                       text_direction=text_direction,
-                                       script_detection=False,
-                                       lines=[bll])
+            for batch in batches:
+                if is_canceled and is_canceled():
+                    raise ProcessCanceledException
+                seg = Segmentation(type='baselines',
+                                   imagename='/dummy.png',
+                                   text_direction=text_direction,
+                                   script_detection=False,
+                                   lines=[BaselineLine(id=str(line.pk),
+                                                       baseline=line.baseline,
+                                                       boundary=line.mask)
+                                          for line in batch])
 
                 it = rpred.rpred(
                     model_,
@@ -1408,30 +1811,15 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
                     pad=16,
                     bidi_reordering=reorder
                 )
-                lt, created = LineTranscription.objects.get_or_create(
-                    line=line, transcription=transcription
-                )
 
-                if not created:
-                    lt.new_version()
-
-                lt.version_author = user and user.username or ''
-                lt.version_source = 'kraken:' + model.name
-
-                for pred in it:
-                    lt.content = pred.prediction
-                    lt.graphs = [{
-                        'c': letter,
-                        'poly': poly,
-                        'confidence': float(confidence)
-                    } for letter, poly, confidence in zip(
-                        pred.prediction, pred.cuts, pred.confidences)]
-                if lt.graphs:
-                    line_avg_confidence = mean([graph['confidence'] for graph in lt.graphs if "confidence" in graph])
-                    lt.avg_confidence = line_avg_confidence
-                    line_confidences.append(line_avg_confidence)
-
-                lt.save()
+                # rpred yields exactly one record per line, in the segmentation order
+                predictions.extend(zip(batch, it))
+
+        line_confidences = self.save_predictions(
+            predictions, transcription,
+            version_author=user and user.username or '',
+            version_source='kraken:' + model.name)
+
         if line_confidences:
             # calculate and set all avg confidence values on models
             avg_line_confidence = mean(line_confidences)
@@ -1443,18 +1831,65 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         self.calculate_progress()
         self.save()
 
-        # overall avg recalculations; may use DB aggregation so run after self.save()
-        if line_confidences and not created:
-            # if new line_confidences have been added to existing transcription,
-            # then recalculate average confidence across the transcription
+        # overall avg recalculation, once per part; uses DB aggregation so run after the bulk writes
+        if line_confidences:
             lines_with_confidence = transcription.linetranscription_set.filter(avg_confidence__isnull=False)
             transcription.avg_confidence = lines_with_confidence.aggregate(avg=Avg("avg_confidence")).get("avg")
             transcription.save()
-        elif line_confidences:
-            # if this is a new transcription, its avg confidence will be the avg of lines
-            # transcribed here
-            transcription.avg_confidence = avg_line_confidence
-            transcription.save()
+
+    def save_predictions(self, predictions, transcription, version_author='', version_source=None):
+        """
+        Persists a list of (line, kraken record) in the given transcription.
+        Existing LineTranscriptions are fetched in a single query and versioned in memory,
+        then everything is written with one bulk_create and one bulk_update.
+        Returns the list of the average confidences of the lines.
+        """
+        existing = {
+            lt.line_id: lt
+            for lt in LineTranscription.objects.filter(
+                line__in=[line for line, pred in predictions],
+                transcription=transcription)
+        }
+
+        to_create, to_update = [], []
+        line_confidences = []
+        for line, pred in predictions:
+            lt = existing.get(line.pk)
+            if lt is None:
+                lt = LineTranscription(line=line, transcription=transcription)
+                to_create.append(lt)
+            else:
+                lt.new_version()
+                to_update.append(lt)
+
+            lt.version_author = version_author
+            if version_source:
+                lt.version_source = version_source
+
+            lt.content = pred.prediction
+            lt.graphs = [{
+                'c': letter,
+                'poly': poly,
+                'confidence': float(confidence)
+            } for letter, poly, confidence in zip(
+                pred.prediction, pred.cuts, pred.confidences)]
+            if lt.graphs:
+                line_avg_confidence = mean([graph['confidence'] for graph in lt.graphs if "confidence" in graph])
+                lt.avg_confidence = line_avg_confidence
+                line_confidences.append(line_avg_confidence)
+
+        with transaction.atomic():
+            LineTranscription.objects.bulk_create(to_create, batch_size=1000)
+            LineTranscription.objects.bulk_update(
+                to_update,
+                ['content', 'graphs', 'avg_confidence',
+                 'revision', 'versions', 'version_author', 'version_source',
+                 'version_created_at', 'version_updated_at'],
+                batch_size=1000)
+            PendingIndexation.enqueue([line.pk for line, pred in predictions])
+            invalidate_search_results([transcription.pk])
+
+        return line_confidences
 
     def chain_tasks(self, *tasks):
         chain(*tasks).delay()
@@ -1467,11 +1902,15 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         if task_name == 'convert' or self.workflow_state < self.WORKFLOW_STATE_CONVERTED:
             sig = convert.si(instance_pk=self.pk, **kwargs)
 
+            post_tasks = [lossless_compression.si(instance_pk=self.pk, **kwargs)]
             if getattr(settings, 'THUMBNAIL_ENABLE', True):
-                sig.link(chain(lossless_compression.si(instance_pk=self.pk, **kwargs),
-                               generate_part_thumbnails.si(instance_pk=self.pk, **kwargs)))
+                post_tasks.append(generate_part_thumbnails.si(instance_pk=self.pk, **kwargs))
+            if getattr(settings, 'TILES_ENABLE', False):
+                post_tasks.append(generate_part_tiles.si(instance_pk=self.pk, **kwargs))
+            if len(post_tasks) > 1:
+                sig.link(chain(*post_tasks))
             else:
-                sig.link(lossless_compression.si(instance_pk=self.pk, **kwargs))
+                sig.link(post_tasks[0])
             tasks.append(sig)
 
         if (task_name == 'segment'):
@@ -1496,34 +1935,51 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
         return tasks
 
     def make_masks(self, only=None):
+        """
+        Computes the masks of the lines of this part (or only the given line pks) from their baselines.
+        Lines of the same block share the same context (all the other baselines and the block box)
+        so they are polygonized by kraken in a single call,
+        the image is only resized and its features computed once per block instead of once per line.
+        """
         im = Image.open(self.image).convert("L")
-        lines = list(self.lines.filter(baseline__isnull=False))
+        lines = list(self.lines.filter(baseline__isnull=False).select_related("block"))
         to_calc = [line for line in lines if (only and line.pk in only) or (only is None)]
 
-        for line in to_calc:
-            context = [line_.baseline for line_ in lines if line_.pk != line.pk]
-            if line.block:
-                poly = line.block.box
-                poly.append(line.block.box[0])  # close it
-                context.append(poly)
-
-            if self.document.line_offset == Document.LINE_OFFSET_TOPLINE:
-                topline = True
-            elif self.document.line_offset == Document.LINE_OFFSET_CENTERLINE:
-                topline = None
-            else:
-                topline = False
+        if self.document.line_offset == Document.LINE_OFFSET_TOPLINE:
+            topline = True
+        elif self.document.line_offset == Document.LINE_OFFSET_CENTERLINE:
+            topline = None
+        else:
+            topline = False
 
-            mask = calculate_polygonal_environment(
-                im, [line.baseline], suppl_obj=context, scale=(1200, 0), topline=topline
+        by_block = {}
+        for line in to_calc:
+            by_block.setdefault(line.block_id, []).append(line)
+
+        updated = []
+        for block_lines in by_block.values():
+            pks = {line.pk for line in block_lines}
+            context = [line_.baseline for line_ in lines if line_.pk not in pks]
+            block = block_lines[0].block
+            if block:
+                context.append(block.box + [block.box[0]])  # close it
+
+            masks = calculate_polygonal_environment(
+                im,
+                [line.baseline for line in block_lines],
+                suppl_obj=context,
+                scale=(1200, 0),
+                topline=topline,
             )
-            if mask[0]:
-                if len(mask[0]) > 50:
-                    line.mask = approximate_polygon(np.array(mask[0]), 2).tolist()
-                else:
-                    line.mask = mask[0]
-                line.save()
-
+            for line, mask in zip(block_lines, masks):
+                if mask:
+                    if len(mask) > 50:
+                        line.mask = approximate_polygon(np.array(mask), 2).tolist()
+                    else:
+                        line.mask = mask
+                    updated.append(line)
+
+        Line.objects.bulk_update(updated, ["mask"], batch_size=1000)
         return to_calc
 
     def rotate(self, angle, user=None):
@@ -1565,6 +2021,8 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
             # Note: self.image.file.name (full path) != self.image.name (relative path)
             rim.save(update_name(self.image.file.name))
             rim.close()
+            # the tiles depend on the image name
+            self.delete_tiles()
             # save the updated file name in db
             self.image = update_name(self.image.name)
 
@@ -1575,6 +2033,7 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
             settings.THUMBNAIL_ALIASES[""]["large"]
         )
         generate_part_thumbnails.delay(instance_pk=self.pk)
+        generate_part_tiles.delay(instance_pk=self.pk)
 
         # rotate lines
         for line in self.lines.all():
@@ -1620,6 +2079,8 @@ class DocumentPart(ExportModelOperationsMixin("DocumentPart"), CascadeUpdate, Or
             cim = im.crop((x1, y1, x2, y2))
             cim.save(self.image.file.name)
             cim.close()
+        self.delete_tiles()
+        generate_part_tiles.delay(instance_pk=self.pk)
 
         for line in self.lines.all():
             if line.baseline:
@@ -1749,7 +2210,24 @@ class Block(ExportModelOperationsMixin("Block"), OrderedModel, CascadeUpdate, mo
         return super().save(*args, **kwargs)
 
 
-class LineManager(OrderedModelManager):
+class LineQuerySet(OrderedModelQuerySet):
+    def delete(self):
+        # the deleted lines are enqueued once by region instead of once each, cf unindex_line
+        regions, document_ids = defaultdict(list), set()
+        for pk, document_part_id, block_id, document_id in self.values_list(
+            "pk", "document_part_id", "block_id", "document_part__document_id"
+        ):
+            regions[document_part_id, block_id].append(pk)
+            document_ids.add(document_id)
+
+        result = super().delete()
+        for (document_part_id, block_id), pks in regions.items():
+            PendingIndexation.enqueue(pks, document_part_id=document_part_id, block_id=block_id)
+        invalidate_search_results(document_ids=document_ids)
+        return result
+
+
+class LineManager(OrderedModelManager.from_queryset(LineQuerySet)):
     def prefetch_transcription(self, transcription):
         return (self.get_queryset().order_by('order')
                 .prefetch_related(
@@ -1934,11 +2412,56 @@ class LineTranscription(
 
     class Meta:
         unique_together = ["line", "transcription"]
+        indexes = [
+            # cf core.search, the expression has to be the same as the searched one
+            GinIndex(SearchVector("content", config=PSQL_SEARCH_CONFIG), name="core_lt_content_search_idx"),
+            # the trigram index of the regex search (core_lt_content_trgm_idx) needs the pg_trgm
+            # extension, it is only created by the migration 0076
+        ]
 
     @property
     def text(self):
         return re.sub("<[^<]+?>", "", self.content)
 
+    def delete(self, *args, **kwargs):
+        # not a post_delete signal receiver, line transcriptions would no longer be fast deleted
+        res = super().delete(*args, **kwargs)
+        PendingIndexation.enqueue([self.line_id])
+        invalidate_search_results([self.transcription_id])
+        return res
+
+
+class PendingIndexation(models.Model):
+    """
+    A line whose search index entries need to be built again, with the ones of its neighbours,
+    cf core.indexing. The lines are not foreign keys since they may have been deleted,
+    the region of a deleted line is kept instead.
+    """
+    line_id = models.IntegerField(unique=True)
+    document_part_id = models.IntegerField(null=True)
+    block_id = models.IntegerField(null=True)
+    queued_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def enqueue(cls, line_ids, document_part_id=None, block_id=None):
+        """
+        Enqueues the lines for the indexing task, enqueuing a line already in the queue
+        only moves it back, so that it is indexed once.
+        """
+        if settings.DISABLE_ELASTICSEARCH:
+            return
+
+        queued_at = timezone.now()
+        cls.objects.bulk_create(
+            [cls(line_id=line_id, document_part_id=document_part_id, block_id=block_id, queued_at=queued_at)
+             for line_id in set(line_ids) if line_id],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["line_id"],
+            update_fields=["document_part_id", "block_id", "queued_at"],
+        )
+        transaction.on_commit(schedule_search_indexing)
+
 
 def models_path(instance, filename):
     # Note: we want a separate directory by model because
@@ -1948,7 +2471,7 @@ def models_path(instance, filename):
     return "models/%s/%s%s" % (hash, slugify(fn), ext)
 
 
-class OcrModel(ExportModelOperationsMixin("OcrModel"), Versioned, models.Model):
+class OcrModel(ExportModelOperationsMixin("OcrModel"), DiskUsageMixin, Versioned, models.Model):
     name = models.CharField(max_length=256)
     file = models.FileField(
         upload_to=models_path,
@@ -1989,6 +2512,9 @@ class OcrModel(ExportModelOperationsMixin("OcrModel"), Versioned, models.Model):
 
     parent = models.ForeignKey("self", blank=True, null=True, on_delete=models.SET_NULL)
 
+    DISK_USAGE_FIELD = 'file_size'
+    DISK_USAGE_OWNER_FIELD = 'owner'
+
     class Meta:
         ordering = ["-version_updated_at"]
         permissions = (("can_train", "Can train models"),)
@@ -2059,6 +2585,10 @@ class OcrModel(ExportModelOperationsMixin("OcrModel"), Versioned, models.Model):
         kwargs["file"] = kwargs.get("file", self.file.name)
         return super().pack(**kwargs)
 
+    def new_version(self, *args, **kwargs):
+        super().new_version(*args, **kwargs)
+        model_cache.invalidate(self.pk)
+
     def revert(self, revision):
         # we want the file to be swapped but the filename to stay the same
         for version in self.versions:
@@ -2075,6 +2605,7 @@ class OcrModel(ExportModelOperationsMixin("OcrModel"), Versioned, models.Model):
         os.rename(target_filename, current_filename)
         os.rename(tmp_filename, target_filename)
         super().revert(revision)
+        model_cache.invalidate(self.pk)
 
     def delete_revision(self, revision):
         for version in self.versions:
@@ -2161,3 +2692,227 @@ class TextualWitness(models.Model):
 def delete_thumbnails(sender, instance, using, **kwargs):
     thumbnailer = get_thumbnailer(instance.image)
     thumbnailer.delete()
+    instance.delete_tiles()
+
+
+@receiver(post_save, sender=DocumentPart, dispatch_uid="part_disk_usage_save_signal")
+@receiver(post_save, sender=OcrModel, dispatch_uid="model_disk_usage_save_signal")
+def count_disk_usage(sender, instance, update_fields=None, **kwargs):
+    size = instance.__dict__.get(sender.DISK_USAGE_FIELD)
+    owner_field = sender.disk_usage_owner_key()
+    if size is None or (update_fields is not None and not {
+        sender.DISK_USAGE_FIELD, owner_field.name, owner_field.attname
+    } & set(update_fields)):
+        # neither the size nor the owner were saved
+        return
+
+    counted_size = getattr(instance, '_counted_size', None) or 0
+    owner = getattr(instance, owner_field.attname)
+    counted_owner = getattr(instance, '_counted_owner', owner)
+    if counted_owner != owner:
+        # the file moved to another owner
+        if counted_size:
+            instance.disk_usage_owner(counted_owner).update(disk_usage=F('disk_usage') - counted_size)
+        counted_size = 0
+    delta = size - counted_size
+    if delta:
+        instance.disk_usage_owner().update(disk_usage=F('disk_usage') + delta)
+    instance._counted_size = size
+    instance._counted_owner = owner
+
+
+@receiver(post_delete, sender=DocumentPart, dispatch_uid="part_disk_usage_delete_signal")
+@receiver(post_delete, sender=OcrModel, dispatch_uid="model_disk_usage_delete_signal")
+def uncount_disk_usage(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Document):
+        # the whole document is deleted, cf uncount_document_disk_usage
+        return
+    size = instance.__dict__.get(sender.DISK_USAGE_FIELD)
+    if size:
+        instance.disk_usage_owner().update(disk_usage=F('disk_usage') - size)
+
+
+@receiver(pre_delete, sender=Document, dispatch_uid="document_disk_usage_delete_signal")
+def uncount_document_disk_usage(sender, instance, origin=None, **kwargs):
+    # a single update instead of one per part
+    if origin is instance and instance.owner_id:
+        size = instance.parts.aggregate(Sum('image_file_size'))['image_file_size__sum'] or 0
+        if size:
+            User.objects.filter(pk=instance.owner_id).update(disk_usage=F('disk_usage') - size)
+
+
+@receiver(post_save, sender=Document, dispatch_uid="document_disk_usage_owner_signal")
+def recount_document_disk_usage(sender, instance, created=False, **kwargs):
+    owner_id = instance.__dict__.get("owner_id")
+    counted_owner_id = getattr(instance, "_counted_owner_id", owner_id)
+    if not created and counted_owner_id != owner_id:
+        # the images of its parts are moved to the new owner
+        size = instance.parts.aggregate(Sum('image_file_size'))['image_file_size__sum'] or 0
+        if size:
+            User.objects.filter(pk=counted_owner_id).update(disk_usage=F('disk_usage') - size)
+            User.objects.filter(pk=owner_id).update(disk_usage=F('disk_usage') + size)
+    instance._counted_owner_id = owner_id
+
+
+@receiver(post_save, sender=LineTranscription, dispatch_uid="line_transcription_index_signal")
+def index_line_transcription(sender, instance, **kwargs):
+    PendingIndexation.enqueue([instance.line_id])
+    invalidate_search_results([instance.transcription_id])
+
+
+@receiver(post_delete, sender=Line, dispatch_uid="line_unindex_signal")
+def unindex_line(sender, instance, origin=None, **kwargs):
+    # the entries of whole parts and documents are deleted at once,
+    # the lines of bulk deletions are enqueued by LineQuerySet.delete
+    if not isinstance(origin, (DocumentPart, Document, LineQuerySet)):
+        PendingIndexation.enqueue([instance.pk], document_part_id=instance.document_part_id, block_id=instance.block_id)
+        invalidate_search_results(document_ids=[instance.document_part.document_id])
+
+
+@receiver(post_delete, sender=Document, dispatch_uid="document_unindex_signal")
+@receiver(post_delete, sender=DocumentPart, dispatch_uid="part_unindex_signal")
+@receiver(post_delete, sender=Transcription, dispatch_uid="transcription_unindex_signal")
+def unindex_entries(sender, instance, origin=None, **kwargs):
+    if sender is not Document and isinstance(origin, Document):
+        return
+    if sender is not Document:
+        # the cached results of a deleted document are invalidated with its accesses
+        invalidate_search_results(document_ids=[instance.document_id])
+    if settings.DISABLE_ELASTICSEARCH:
+        return
+    field = {Document: "document_id", DocumentPart: "document_part_id", Transcription: "transcription_id"}[sender]
+    transaction.on_commit(lambda: delete_search_entries.delay(field=field, values=[instance.pk]))
+
+
+def update_search_documents_on_commit(document_pks):
+    document_pks = list(document_pks)
+    if not settings.DISABLE_ELASTICSEARCH and document_pks:
+        transaction.on_commit(lambda: update_search_documents.delay(document_pks=document_pks))
+
+
+@receiver(post_save, sender=Document, dispatch_uid="document_index_signal")
+def update_search_document(sender, instance, created=False, **kwargs):
+    indexed_values = Document.indexed_values(instance)
+    if not created and indexed_values != getattr(instance, "_indexed_values", None):
+        update_search_documents_on_commit([instance.pk])
+    instance._indexed_values = indexed_values
+
+
+def m2m_related(sender, instance, model, pk_set):
+    """
+    Returns the pks of the objects on both sides of a change of a m2m relation, by model,
+    the objects removed by a clearing are only known before it (pre_clear).
+    """
+    if pk_set is None:
+        source, target = sorted(
+            (field for field in sender._meta.fields if field.related_model),
+            key=lambda field: field.related_model is not type(instance)
+        )
+        pk_set = set(sender.objects.filter(**{source.name: instance.pk}).values_list(target.attname, flat=True))
+    return {type(instance): [instance.pk], model: pk_set}
+
+
+def shared_documents(related):
+    # the documents whose read access depends on the objects returned by m2m_related()
+    if Document in related:
+        return Document.objects.filter(pk__in=related[Document])
+    elif Project in related:
+        return Document.objects.filter(project__in=related[Project])
+    groups = related[Group]
+    return Document.objects.filter(Q(shared_with_groups__in=groups) | Q(project__shared_with_groups__in=groups))
+
+
+def shared_projects(related):
+    # the projects whose read access depends on the objects returned by m2m_related()
+    if Document in related:
+        return Project.objects.filter(documents__in=related[Document])
+    elif Project in related:
+        return Project.objects.filter(pk__in=related[Project])
+    groups = related[Group]
+    return Project.objects.filter(Q(shared_with_groups__in=groups) | Q(documents__shared_with_groups__in=groups))
+
+
+@receiver(m2m_changed, sender=Document.shared_with_users.through, dispatch_uid="document_users_index_signal")
+@receiver(m2m_changed, sender=Document.shared_with_groups.through, dispatch_uid="document_groups_index_signal")
+@receiver(m2m_changed, sender=Project.shared_with_users.through, dispatch_uid="project_users_index_signal")
+@receiver(m2m_changed, sender=Project.shared_with_groups.through, dispatch_uid="project_groups_index_signal")
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid="user_groups_index_signal")
+def update_search_access(sender, instance, action, model, pk_set, **kwargs):
+    """
+    Updates the read access of the entries of the documents concerned by a sharing,
+    or by a change of members of a group they are shared with.
+    """
+    if settings.DISABLE_ELASTICSEARCH or action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    documents = shared_documents(m2m_related(sender, instance, model, pk_set))
+    update_search_documents_on_commit(documents.values_list("pk", flat=True).distinct())
+
+
+def refresh_access(documents, projects):
+    DocumentAccess.refresh(documents.values_list("pk", flat=True).distinct())
+    ProjectAccess.refresh(projects.values_list("pk", flat=True).distinct())
+
+
+@receiver(m2m_changed, sender=Document.shared_with_users.through, dispatch_uid="document_users_access_signal")
+@receiver(m2m_changed, sender=Document.shared_with_groups.through, dispatch_uid="document_groups_access_signal")
+@receiver(m2m_changed, sender=Project.shared_with_users.through, dispatch_uid="project_users_access_signal")
+@receiver(m2m_changed, sender=Project.shared_with_groups.through, dispatch_uid="project_groups_access_signal")
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid="user_groups_access_signal")
+def refresh_shared_access(sender, instance, action, model, pk_set, **kwargs):
+    if action == "pre_clear":
+        # refreshed once the relation is cleared
+        instance._cleared_related = m2m_related(sender, instance, model, pk_set)
+    elif action == "post_clear":
+        related = instance.__dict__.pop("_cleared_related")
+        refresh_access(shared_documents(related), shared_projects(related))
+    elif action in ("post_add", "post_remove") and pk_set:
+        related = m2m_related(sender, instance, model, pk_set)
+        refresh_access(shared_documents(related), shared_projects(related))
+
+
+@receiver(post_save, sender=Document, dispatch_uid="document_access_signal")
+def refresh_document_access(sender, instance, created=False, **kwargs):
+    access_values = Document.access_values(instance)
+    previous = getattr(instance, "_access_values", None)
+    if created or access_values != previous:
+        DocumentAccess.refresh([instance.pk])
+        if not created and (previous is None or previous[1] != instance.project_id):
+            # its shares are moved to another project, the previous one is unknown
+            # if the instance wasn't loaded from the database (loaddata, pk given by hand)
+            ProjectAccess.refresh({previous and previous[1], instance.project_id} - {None})
+    instance._access_values = access_values
+
+
+@receiver(post_delete, sender=Document, dispatch_uid="document_access_delete_signal")
+def refresh_deleted_document_access(sender, instance, origin=None, **kwargs):
+    # the rows of the document are deleted in cascade, but it may have given access to its project
+    if not isinstance(origin, Project):
+        ProjectAccess.refresh([instance.project_id])
+
+
+@receiver(post_save, sender=Project, dispatch_uid="project_access_signal")
+def refresh_project_access(sender, instance, created=False, **kwargs):
+    owner_id = instance.__dict__.get("owner_id")
+    if created or owner_id != getattr(instance, "_access_owner_id", None):
+        ProjectAccess.refresh([instance.pk])
+        if not created:
+            DocumentAccess.refresh(instance.documents.values_list("pk", flat=True))
+    instance._access_owner_id = owner_id
+
+
+@receiver(pre_delete, sender=Group, dispatch_uid="group_access_delete_signal")
+def collect_group_access(sender, instance, **kwargs):
+    # its shares are deleted in cascade without m2m_changed signals
+    related = {Group: [instance.pk]}
+    instance._shared_access = (
+        list(shared_documents(related).values_list("pk", flat=True).distinct()),
+        list(shared_projects(related).values_list("pk", flat=True).distinct()),
+    )
+
+
+@receiver(post_delete, sender=Group, dispatch_uid="group_access_delete_signal")
+def refresh_group_access(sender, instance, **kwargs):
+    documents, projects = instance.__dict__.pop("_shared_access", ([], []))
+    DocumentAccess.refresh(documents)
+    ProjectAccess.refresh(projects)
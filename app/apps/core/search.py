@@ -1,17 +1,84 @@
+import json
 import re
+from hashlib import sha1
 from urllib.parse import unquote_plus
+from uuid import uuid4
 
 from django.conf import settings
-from django.contrib.postgres.search import SearchHeadline, SearchQuery
-from django.db.models import CharField, F, Func, Value
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchVector
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import CharField, F, Func, Q, Value
 from elasticsearch import Elasticsearch
 
 EXTRACT_EXACT_TERMS_REGEXP = '"[^"]+"'
 WORD_BY_WORD_SEARCH_MODE = "word-by-word"
 REGEX_SEARCH_MODE = "regex"
+# The text search configuration of the GIN index on LineTranscription.content,
+# without stemming since the documents are in any language
+PSQL_SEARCH_CONFIG = "simple"
+SEARCH_VERSION_KEY = "search-version:{}"
 
 
-def search_content_es(current_page, page_size, user_id, terms, projects=None, documents=None, transcriptions=None):
+def invalidate_search_results(transcription_ids=(), user_ids=(), document_ids=()):
+    """
+    Gives new versions to the users who can read the transcriptions or the documents whose
+    content changed and to the users whose read access changed once the transaction is
+    committed, so that their cached search results are no longer used.
+    """
+    transcription_ids = {pk for pk in transcription_ids if pk}
+    document_ids = {pk for pk in document_ids if pk}
+    user_ids = {pk for pk in user_ids if pk}
+    if not (transcription_ids or document_ids or user_ids):
+        return
+
+    def bump_versions():
+        from core.models import DocumentAccess
+
+        users = set(user_ids)
+        if transcription_ids or document_ids:
+            users.update(DocumentAccess.objects.filter(
+                Q(document__in=document_ids) | Q(document__transcriptions__in=transcription_ids)
+            ).values_list("user_id", flat=True))
+        version = uuid4().hex
+        cache.set_many({SEARCH_VERSION_KEY.format(pk): version for pk in users}, timeout=None)
+
+    transaction.on_commit(bump_versions)
+
+
+class SearchCache:
+    """
+    The results and the page cursors of a search, cached for SEARCH_CACHE_TIMEOUT seconds.
+    The key is made of the search parameters and the version of the user,
+    cf invalidate_search_results.
+    """
+
+    def __init__(self, user, project_id=None, document_id=None, transcription_id=None, **params):
+        version = cache.get(SEARCH_VERSION_KEY.format(user.pk))
+        scope = {"project": project_id, "document": document_id, "transcription": transcription_id}
+        digest = sha1(json.dumps(
+            [user.pk, scope, params, version], sort_keys=True, default=str,
+        ).encode()).hexdigest()
+        self.key = f"search:{digest}"
+        self.timeout = getattr(settings, "SEARCH_CACHE_TIMEOUT", 600)
+
+    def get(self, name):
+        return cache.get(f"{self.key}:{name}")
+
+    def set(self, name, value):
+        cache.set(f"{self.key}:{name}", value, timeout=self.timeout)
+
+
+def normalize_terms(terms):
+    # the spaces between the terms don't change the results of a word search
+    return " ".join(terms.split())
+
+
+def search_content_es(current_page, page_size, user_id, terms, projects=None, documents=None, transcriptions=None, search_after=None):
+    """
+    Returns a page of hits, the hits after the sort values of search_after if given,
+    which doesn't have the cost of skipping the previous pages of the deep ones.
+    """
     es_client = Elasticsearch(hosts=[settings.ELASTICSEARCH_URL])
 
     cleaned_terms = re.escape(terms)
@@ -24,9 +91,14 @@ def search_content_es(current_page, page_size, user_id, terms, projects=None, do
         terms_fuzzy = [terms]
 
     body = {
-        "from": (current_page - 1) * page_size,
+        "from": 0 if search_after else (current_page - 1) * page_size,
         "size": page_size,
-        "sort": ["_score"],
+        # an entry is unique by line and transcription
+        "sort": [
+            "_score",
+            {"line_id": {"order": "asc", "unmapped_type": "long"}},
+            {"transcription_id": {"order": "asc", "unmapped_type": "long"}},
+        ],
         "query": {
             "bool": {
                 "must": [
@@ -71,6 +143,9 @@ def search_content_es(current_page, page_size, user_id, terms, projects=None, do
     if transcriptions:
         body["query"]["bool"]["must"].append({"terms": {"transcription_id": transcriptions}})
 
+    if search_after:
+        body["search_after"] = search_after
+
     return es_client.search(index=settings.ELASTICSEARCH_COMMON_INDEX, body=body)
 
 
@@ -104,14 +179,17 @@ def get_filtered_queryset(user, project_id, document_id, transcription_id, part_
 
 
 def search_content_psql_word(terms, user, highlight_class, project_id=None, document_id=None, transcription_id=None, part_id=None):
-    search_query = SearchQuery(terms)
+    search_query = SearchQuery(terms, config=PSQL_SEARCH_CONFIG)
     return (
         get_filtered_queryset(user, project_id, document_id, transcription_id, part_id)
-        .filter(content__search=search_query)
+        # same expression as the GIN index of LineTranscription
+        .alias(search_vector=SearchVector("content", config=PSQL_SEARCH_CONFIG))
+        .filter(search_vector=search_query)
         .annotate(
             highlighted_content=SearchHeadline(
                 "content",
                 search_query,
+                config=PSQL_SEARCH_CONFIG,
                 start_sel=f'<strong class="{highlight_class}">',
                 stop_sel="</strong>",
             )
@@ -122,6 +200,7 @@ def search_content_psql_word(terms, user, highlight_class, project_id=None, docu
 def search_content_psql_regex(terms, user, highlight_class, project_id=None, document_id=None, transcription_id=None, part_id=None):
     return (
         get_filtered_queryset(user, project_id, document_id, transcription_id, part_id)
+        # uses the trigram index of LineTranscription
         .filter(content__regex=terms)
         .annotate(
             highlighted_content=Func(
@@ -136,13 +215,100 @@ def search_content_psql_regex(terms, user, highlight_class, project_id=None, doc
     )
 
 
-def build_highlighted_replacement_psql(mode, find_terms, replace_term, highlighted_content):
-    if not replace_term:
-        return None
-
-    extra = {}
+def replacement_pattern(mode, find_terms, replace_term):
+    """
+    Returns the pattern, the replacement and the flags of the PostgreSQL regexp_replace()
+    replacing the matches highlighted by the search functions.
+    """
     if mode == WORD_BY_WORD_SEARCH_MODE:
-        replace_term = replace_term.replace('\\', r'\\')
-        extra = {"flags": re.IGNORECASE}
+        # whole words, case insensitive like the 'simple' text search configuration
+        words = "|".join(re.escape(word) for word in find_terms.split())
+        return r"\m(%s)\M" % words, replace_term.replace("\\", r"\\"), "gi"
+    return find_terms, replace_term, "g"
+
+
+def replacement_preview(mode, find_terms, replace_term, highlight_class):
+    """
+    Returns the expression of the content with its replacements highlighted,
+    made by the same regexp_replace() as replace_content_psql.
+    """
+    pattern, replacement, flags = replacement_pattern(mode, find_terms, replace_term)
+    return Func(
+        F("content"),
+        Value(pattern),
+        Value(f'<strong class="{highlight_class}">{replacement}</strong>'),
+        Value(flags),
+        function="REGEXP_REPLACE",
+        output_field=CharField(),
+    )
+
 
-    return re.sub(r'<strong class="text-danger">%s</strong>' % find_terms, r'<strong class="text-success">%s</strong>' % replace_term, highlighted_content, **extra)
+def check_regex(pattern):
+    """
+    Raises a DataError if PostgreSQL doesn't accept the regular expression,
+    its syntax isn't the one of python.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT '' ~ %s", [pattern])
+
+
+def replace_content_psql(search_results, mode, find_terms, replace_term, author):
+    """
+    Replaces the content of the line transcriptions of search_results with a single UPDATE,
+    that also pushes their previous state to their versions, cf Versioned.new_version.
+    Returns the (line_id, transcription_id) of the updated line transcriptions and the pks
+    of the ones left unchanged since their new content would be too long for the column.
+    """
+    from core.models import LineTranscription
+
+    pattern, replacement, flags = replacement_pattern(mode, find_terms, replace_term)
+    max_length = LineTranscription._meta.get_field("content").max_length
+    matches, params = search_results.values("pk").query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT lt.id FROM core_linetranscription AS lt
+            WHERE lt.id IN ({matches})
+            AND char_length(regexp_replace(lt.content, %s, %s, %s)) > %s
+            ORDER BY lt.id
+            """,
+            [*params, pattern, replacement, flags, max_length],
+        )
+        too_long = [pk for pk, in cursor.fetchall()]
+
+        cursor.execute(
+            f"""
+            UPDATE core_linetranscription AS lt SET
+                content = replaced.content,
+                versions = jsonb_build_array(jsonb_build_object(
+                    'revision', replace(lt.revision::text, '-', ''),
+                    'source', lt.version_source,
+                    'author', lt.version_author,
+                    'created_at', to_jsonb(lt.version_created_at),
+                    'updated_at', to_jsonb(lt.version_updated_at),
+                    'data', jsonb_build_object(
+                        'content', lt.content, 'graphs', lt.graphs, 'avg_confidence', lt.avg_confidence
+                    )
+                )) || (
+                    SELECT COALESCE(jsonb_agg(version ORDER BY position), '[]'::jsonb)
+                    FROM jsonb_array_elements(lt.versions) WITH ORDINALITY AS previous(version, position)
+                    WHERE position < %s
+                ),
+                revision = gen_random_uuid(),
+                version_author = %s,
+                version_source = %s,
+                version_created_at = now(),
+                version_updated_at = now()
+            FROM (
+                SELECT id, regexp_replace(content, %s, %s, %s) AS content
+                FROM core_linetranscription WHERE id IN ({matches})
+            ) AS replaced
+            WHERE lt.id = replaced.id
+            AND replaced.content <> lt.content
+            AND char_length(replaced.content) <= %s
+            RETURNING lt.line_id, lt.transcription_id
+            """,
+            [LineTranscription.version_history_max_length, author, settings.VERSIONING_DEFAULT_SOURCE,
+             pattern, replacement, flags, *params, max_length],
+        )
+        return cursor.fetchall(), too_long
@@ -13,11 +13,13 @@ from celery import shared_task
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import F, Q
-from django.utils.html import strip_tags
+from django.core.cache import cache
+from django.db import DataError
+from django.db.models import F, Max, Min, Q
 from django.utils.text import slugify
 from django.utils.translation import gettext as _
 from easy_thumbnails.files import get_thumbnailer
+from elasticsearch import exceptions as es_exceptions
 from kraken.containers import BaselineLine, Region, Segmentation
 from kraken.kraken import SEGMENTATION_DEFAULT_MODEL
 from kraken.lib.arrow_dataset import build_binary_dataset
@@ -25,10 +27,11 @@ from kraken.lib.default_specs import RECOGNITION_HYPER_PARAMS, SEGMENTATION_HYPE
 from kraken.lib.train import KrakenTrainer, RecognitionModel, SegmentationModel
 from lightning.pytorch.callbacks import Callback
 
+from core import indexing
 from core.search import (
     REGEX_SEARCH_MODE,
-    WORD_BY_WORD_SEARCH_MODE,
-    build_highlighted_replacement_psql,
+    invalidate_search_results,
+    replace_content_psql,
     search_content_psql_regex,
     search_content_psql_word,
 )
@@ -64,6 +67,25 @@ def generate_part_thumbnails(instance_pk=None, user_pk=None, **kwargs):
     return aliases
 
 
+@shared_task(autoretry_for=(MemoryError,), default_retry_delay=60)
+def generate_part_tiles(instance_pk=None, user_pk=None, **kwargs):
+    if not getattr(settings, 'TILES_ENABLE', False):
+        return
+
+    try:
+        DocumentPart = apps.get_model('core', 'DocumentPart')
+        part = DocumentPart.objects.get(pk=instance_pk)
+    except DocumentPart.DoesNotExist:
+        logger.error('Trying to generate tiles of non-existent DocumentPart : %d', instance_pk)
+        return
+
+    part.make_tiles()
+    send_event('document', part.document.pk, "part:tiles", {
+        "id": part.pk,
+        "uri": part.tiles_uri
+    })
+
+
 @shared_task(autoretry_for=(MemoryError,), default_retry_delay=3 * 60)
 def convert(instance_pk=None, user_pk=None, **kwargs):
     if user_pk:
@@ -603,7 +625,8 @@ def forced_align(instance_pk=None, model_pk=None, transcription_pk=None,
                  part_pk=None, user_pk=None, **kwargs):
 
     from kraken.align import forced_align as kraken_forced_align
-    from kraken.lib import models as kraken_models
+
+    from core.model_cache import load_recognition_model
 
     OcrModel = apps.get_model('core', 'OcrModel')
     DocumentPart = apps.get_model('core', 'DocumentPart')
@@ -611,7 +634,7 @@ def forced_align(instance_pk=None, model_pk=None, transcription_pk=None,
     LineTranscription = apps.get_model('core', 'LineTranscription')
 
     ocrmodel = OcrModel.objects.get(pk=model_pk)
-    model = kraken_models.load_any(ocrmodel.file.path)
+    model = load_recognition_model(ocrmodel)
     transcription = Transcription.objects.get(pk=transcription_pk)
 
     part = DocumentPart.objects.get(pk=instance_pk)
@@ -704,6 +727,123 @@ def transcribe(instance_pk=None, model_pk=None, user_pk=None,
                         level='success')
 
 
+@shared_task(bind=True, autoretry_for=(MemoryError,), default_retry_delay=10 * 60)
+def transcribe_parts(task, document_pk=None, part_pks=None, model_pk=None, user_pk=None,
+                     transcription_pk=None, task_group_pk=None, **kwargs):
+    """
+    Transcribes a chunk of parts of a document in a single worker invocation,
+    the model is loaded and the user quotas are checked once for the whole chunk.
+    Each part keeps its own TaskReport (see Document.queue_transcription) and part:workflow events.
+    """
+    from core.model_cache import load_recognition_model
+    from core.models import ProcessCanceledException
+    from reporting.models import TASK_FINAL_STATES
+
+    DocumentPart = apps.get_model('core', 'DocumentPart')
+    OcrModel = apps.get_model('core', 'OcrModel')
+    Transcription = apps.get_model('core', 'Transcription')
+    TaskReport = apps.get_model('reporting', 'TaskReport')
+
+    reports = {
+        report.document_part_id: report
+        for report in TaskReport.objects.filter(
+            task_id__in=['%s:%d' % (task.request.id, pk) for pk in part_pks])
+    }
+
+    def update_part_state(part, status, reason=None):
+        data = {'id': part.pk,
+                'process': 'transcribe',
+                'status': status,
+                'task_id': task.request.id,
+                'data': {}}
+        if reason:
+            data['reason'] = reason
+        send_event('document', document_pk, 'part:workflow', data)
+
+    parts = DocumentPart.objects.filter(pk__in=part_pks).select_related('document__main_script')
+
+    try:
+        if user_pk:
+            try:
+                user = User.objects.get(pk=user_pk)
+                # If quotas are enforced, assert that the user still has free CPU minutes
+                if not settings.DISABLE_QUOTAS and user.cpu_minutes_limit() is not None:
+                    assert user.has_free_cpu_minutes(), f"User {user.id} doesn't have any CPU minutes left"
+            except User.DoesNotExist:
+                user = None
+        else:
+            user = None
+
+        model = OcrModel.objects.get(pk=model_pk)
+        transcription = Transcription.objects.get(pk=transcription_pk)
+        kraken_model = load_recognition_model(model)
+    except Exception as e:
+        for part in parts:
+            if part.pk in reports:
+                reports[part.pk].error(str(e))
+            update_part_state(part, 'error')
+        logger.exception(e)
+        raise e
+
+    processed = 0
+    errors = 0
+    for part in parts:
+        report = reports.get(part.pk)
+        if report:
+            report.refresh_from_db()
+            if report.workflow_state in TASK_FINAL_STATES:
+                # canceled while the chunk was queued
+                continue
+            report.start()
+        update_part_state(part, 'ongoing')
+
+        def is_canceled(report=report):
+            if report is None:
+                return False
+            report.refresh_from_db(fields=['workflow_state'])
+            return report.workflow_state == report.WORKFLOW_STATE_CANCELED
+
+        processed += 1
+        try:
+            part.transcribe(model, transcription, user=user, kraken_model=kraken_model,
+                            is_canceled=is_canceled)
+        except ProcessCanceledException:
+            # canceled while being transcribed, nothing was saved
+            processed -= 1
+            part.workflow_state = part.WORKFLOW_STATE_SEGMENTED
+            part.save()
+            update_part_state(part, 'canceled')
+        except Exception as e:
+            errors += 1
+            logger.exception(e)
+            part.workflow_state = part.WORKFLOW_STATE_SEGMENTED
+            part.save()
+            if report:
+                report.error(f'Failed to transcribe the part {part.pk}: {e}')
+            update_part_state(part, 'error')
+        else:
+            if report:
+                report.refresh_from_db()
+                if report.workflow_state not in TASK_FINAL_STATES:
+                    report.end()
+            update_part_state(part, 'done')
+
+        if report:
+            report.calc_cpu_cost()
+
+    if user:
+        if errors:
+            user.notify(_("Something went wrong during the transcription!"),
+                        id="transcription-error", level='danger')
+        else:
+            user.notify(_("Transcription done!"),
+                        id="transcription-success",
+                        level='success')
+
+    if errors and errors == processed:
+        raise Exception(f'Failed to transcribe the {errors} parts of the chunk, see their reports')
+
+
 @shared_task(bind=True, autoretry_for=(MemoryError,), default_retry_delay=10 * 60)
 def align(
     task,
@@ -790,7 +930,7 @@ def align(
 def replace_line_transcriptions_text(
     task, mode, find_terms, replace_term, project_pk=None, document_pk=None, transcription_pk=None, part_pk=None, user_pk=None, **kwargs
 ):
-    LineTranscription = apps.get_model('core', 'LineTranscription')
+    PendingIndexation = apps.get_model('core', 'PendingIndexation')
 
     # Get the associated TaskReport
     TaskReport = apps.get_model('reporting', 'TaskReport')
@@ -814,38 +954,77 @@ def replace_line_transcriptions_text(
         part_id=part_pk,
     )
 
-    if mode == WORD_BY_WORD_SEARCH_MODE:
-        find_terms = '|'.join(find_terms.split(' '))
-
-    # Apply the replacement on the found line transcriptions
-    total = search_results.count()
+    # Apply the replacement in the database, by ranges of primary keys
+    chunk_size = getattr(settings, 'FIND_AND_REPLACE_CHUNK_SIZE', 10000)
+    total = 0
     errors = 0
-    updated = []
-    for result in search_results.iterator(chunk_size=5000):
+    try:
+        bounds = search_results.aggregate(start=Min('pk'), end=Max('pk'))
+    except DataError as e:
+        errors += 1
+        report.append(f'Failed to search for the line transcriptions to update: {e}', logger_fct=logger.error)
+        bounds = {'start': None, 'end': None}
+
+    for start in range(bounds['start'] or 0, (bounds['end'] or -1) + 1, chunk_size):
         try:
-            report.append(f'Applying the replacement on the transcription from the line {result.line}', logger_fct=logger.info)
-            # Replace on the highlighted content and then remove the highlighting tags
-            result.content = strip_tags(build_highlighted_replacement_psql(mode, find_terms, replace_term, result.highlighted_content))
-        except Exception as e:
+            updated, too_long = replace_content_psql(
+                search_results.filter(pk__gte=start, pk__lt=start + chunk_size),
+                mode, find_terms, replace_term, user.username,
+            )
+        except DataError as e:
             errors += 1
-            report.append(f'Failed to apply the replacement on the transcription from the line {result.line}: {e}', logger_fct=logger.error)
+            report.append(f'Failed to apply the replacement on the line transcriptions {start} to {start + chunk_size - 1}: {e}', logger_fct=logger.error)
             continue
 
-        updated.append(result)
+        if too_long:
+            errors += 1
+            report.append(f'The replacement was not applied on the line transcriptions {", ".join(map(str, too_long))}, their content would be too long.', logger_fct=logger.error)
 
-        # Once we have 1000 line transcriptions to update, we do it and clear the list
-        if len(updated) >= 1000:
-            LineTranscription.objects.bulk_update(updated, fields=['content'])
-            updated = []
+        total += len(updated)
+        PendingIndexation.enqueue([line_id for line_id, _ in updated])
+        invalidate_search_results([transcription_id for _, transcription_id in updated])
 
-    # We don't forget to update the remaining line transcriptions
-    if updated:
-        LineTranscription.objects.bulk_update(updated, fields=['content'])
+    report.append(f'Replacement applied on {total} line transcriptions.', logger_fct=logger.info)
 
     # Alert the user
-    if total and errors == total:
+    if errors and not total:
         user.notify(_('All replacements failed'), links=[{'text': 'Report', 'src': report.uri}], id='find-replace-error', level='danger')
     elif errors:
         user.notify(_('Replacements applied with some errors'), links=[{'text': 'Report', 'src': report.uri}], id='find-replace-warning', level='warning')
     else:
         user.notify(_('Replacements applied!'), links=[{'text': 'Report', 'src': report.uri}], id='find-replace-success', level='success')
+
+
+def schedule_search_indexing():
+    # A single run of the consumer for all the lines enqueued in the next SEARCH_INDEXING_DELAY seconds
+    delay = getattr(settings, 'SEARCH_INDEXING_DELAY', 10)
+    if cache.add('search-indexing-scheduled', True, timeout=delay):
+        index_pending_lines.apply_async(countdown=delay)
+
+
+@shared_task(autoretry_for=(MemoryError, es_exceptions.ConnectionError), default_retry_delay=60)
+def index_pending_lines(**kwargs):
+    if settings.DISABLE_ELASTICSEARCH:
+        return
+
+    total = indexing.index_pending_lines(
+        indexing.get_es_client(),
+        batch_size=getattr(settings, 'SEARCH_INDEXING_BATCH_SIZE', 1000)
+    )
+    logger.info(f'Reindexed {total} lines in {settings.ELASTICSEARCH_COMMON_INDEX}')
+
+
+@shared_task(autoretry_for=(MemoryError, es_exceptions.ConnectionError), default_retry_delay=60)
+def update_search_documents(document_pks=None, **kwargs):
+    if settings.DISABLE_ELASTICSEARCH or not document_pks:
+        return
+
+    indexing.update_documents(indexing.get_es_client(), document_pks)
+
+
+@shared_task(autoretry_for=(MemoryError, es_exceptions.ConnectionError), default_retry_delay=60)
+def delete_search_entries(field=None, values=None, **kwargs):
+    if settings.DISABLE_ELASTICSEARCH or not values:
+        return
+
+    indexing.delete_entries(indexing.get_es_client(), field, values)
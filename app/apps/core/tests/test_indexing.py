@@ -0,0 +1,156 @@
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import override_settings
+
+from core.indexing import INDEX_MAPPING, part_fields
+from core.models import Line, LineTranscription, PendingIndexation
+from core.tests.factory import CoreFactoryTestCase
+
+
+@override_settings(DISABLE_ELASTICSEARCH=False)
+class IncrementalIndexingTestCase(CoreFactoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.es_client = mock.Mock()
+        self.indexed = []
+
+        def bulk(client, actions, **kwargs):
+            self.indexed = list(actions)
+            return len(self.indexed), 0
+
+        patchers = [
+            mock.patch('core.indexing.get_es_client', return_value=self.es_client),
+            mock.patch('core.indexing.es_bulk', side_effect=bulk),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.part = self.factory.make_part()
+        self.transcription = self.factory.make_transcription(document=self.part.document)
+        self.factory.make_content(self.part, amount=3, transcription=self.transcription)
+
+    def test_update_line_transcription(self):
+        lts = list(LineTranscription.objects.filter(line__document_part=self.part).order_by('line__order'))
+        lts[1].content = 'changed'
+        lts[1].save()
+
+        # the neighbours are reindexed with the new context
+        entries = {entry['_id']: entry for entry in self.indexed}
+        self.assertEqual(entries[str(lts[0].pk)]['context_after'], 'changed')
+        self.assertEqual(entries[str(lts[1].pk)]['raw_content'], 'changed')
+        self.assertEqual(entries[str(lts[2].pk)]['context_before'], 'changed')
+        self.assertEqual(entries[str(lts[1].pk)]['have_access'], [self.part.document.owner.pk])
+        self.assertFalse(PendingIndexation.objects.exists())
+
+    def test_delete_line(self):
+        lts = list(LineTranscription.objects.filter(line__document_part=self.part).order_by('line__order'))
+        lts[1].line.delete()
+
+        entries = {entry['_id']: entry for entry in self.indexed}
+        self.assertEqual(list(entries), [str(lts[0].pk), str(lts[2].pk)])
+        self.assertEqual(entries[str(lts[0].pk)]['context_after'], lts[2].content)
+        query = self.es_client.delete_by_query.call_args.kwargs['body']['query']['bool']
+        self.assertEqual(query['filter'], [{'terms': {'line_id': [lts[1].line_id]}}])
+
+    def test_bulk_delete_lines(self):
+        lines = list(self.part.lines.order_by('order')[:2])
+        with mock.patch.object(PendingIndexation, 'enqueue') as enqueue:
+            self.part.lines.filter(pk__in=[line.pk for line in lines]).delete()
+
+        # a single enqueuing for the region instead of one by line
+        enqueue.assert_called_once()
+        self.assertCountEqual(enqueue.call_args.args[0], [line.pk for line in lines])
+        self.assertEqual(enqueue.call_args.kwargs, {'document_part_id': self.part.pk, 'block_id': lines[0].block_id})
+
+    def test_share(self):
+        user = self.factory.make_user()
+        self.part.document.shared_with_users.add(user)
+
+        script = self.es_client.update_by_query.call_args.kwargs['body']['script']
+        self.assertCountEqual(script['params']['have_access'], [self.part.document.owner.pk, user.pk])
+
+
+@override_settings(DISABLE_ELASTICSEARCH=False)
+class IndexCommandTestCase(CoreFactoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.indexed = []
+
+        def streaming_bulk(client, actions, **kwargs):
+            for action in actions:
+                self.indexed.append(action)
+                yield True, {}
+
+        indices = mock.Mock()
+        indices.get_mapping.return_value = {
+            settings.ELASTICSEARCH_COMMON_INDEX: {"mappings": INDEX_MAPPING}
+        }
+        patchers = [
+            # the incremental indexing of the fixture
+            mock.patch('core.indexing.get_es_client'),
+            mock.patch('core.indexing.es_bulk', return_value=(0, 0)),
+            mock.patch('core.management.commands.index.get_es_client'),
+            mock.patch('core.management.commands.index.IndicesClient', return_value=indices),
+            mock.patch('core.management.commands.index.es_streaming_bulk', side_effect=streaming_bulk),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_entries(self):
+        part = self.factory.make_part()
+        transcription = self.factory.make_transcription(document=part.document)
+        # lines without a region, before the ones of the region in the reading order
+        for order, content in enumerate(['first orphan', 'second orphan']):
+            line = Line.objects.create(document_part=part, baseline=[[0, 0], [10, 0]], order=order)
+            LineTranscription.objects.create(line=line, transcription=transcription, content=content)
+        self.factory.make_content(part, amount=3, transcription=transcription)
+        user = self.factory.make_user()
+        part.document.shared_with_users.add(user)
+        other_part = self.factory.make_part()
+        self.factory.make_content(other_part, amount=2)
+
+        call_command('index', document_pks=[part.document.pk], workers=2)
+
+        lts = list(
+            LineTranscription.objects.filter(line__document_part=part, line__block__isnull=False)
+            .order_by('line__order')
+        )
+        self.assertEqual(
+            [entry['raw_content'] for entry in self.indexed],
+            [lt.content for lt in lts] + ['first orphan', 'second orphan']
+        )
+        entries = {entry['_id']: entry for entry in self.indexed}
+        self.assertEqual(entries[str(lts[1].pk)]['context'], f'{lts[0].content} {lts[1].content} {lts[2].content}')
+        self.assertEqual(entries[str(lts[1].pk)]['context_before'], lts[0].content)
+        self.assertEqual(entries[str(lts[1].pk)]['context_after'], lts[2].content)
+        # the context doesn't connect the lines of the region to the ones without a region
+        self.assertEqual(entries[str(lts[2].pk)]['context_after'], None)
+        self.assertEqual(self.indexed[3]['context_before'], None)
+        self.assertEqual(self.indexed[3]['context'], 'first orphan second orphan')
+        for entry in self.indexed:
+            self.assertEqual(entry['document_id'], part.document.pk)
+            self.assertCountEqual(entry['have_access'], [part.document.owner.pk, user.pk])
+
+    def test_failing_part(self):
+        parts = [self.factory.make_part(), self.factory.make_part()]
+        document = parts[0].document
+        parts[1].document = document
+        parts[1].save()
+        transcription = self.factory.make_transcription(document=document)
+        for part in parts:
+            self.factory.make_content(part, amount=2, transcription=transcription)
+
+        def failing_part_fields(part, allowed_users):
+            if part.pk == parts[0].pk:
+                raise OSError('missing image')
+            return part_fields(part, allowed_users)
+
+        with mock.patch('core.indexing.part_fields', side_effect=failing_part_fields):
+            call_command('index', document_pks=[document.pk])
+
+        self.assertEqual({entry['document_part_id'] for entry in self.indexed}, {parts[1].pk})
+        self.assertEqual(len(self.indexed), 2)
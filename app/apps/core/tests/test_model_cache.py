@@ -0,0 +1,44 @@
+from unittest.mock import Mock
+
+from django.test import SimpleTestCase
+
+from core.model_cache import ModelCache
+
+
+class ModelCacheTestCase(SimpleTestCase):
+    def test_hit(self):
+        cache = ModelCache(max_entries=2)
+        loader = Mock(return_value='model')
+        self.assertEqual(cache.get((1, 'a', 0), loader), 'model')
+        self.assertEqual(cache.get((1, 'a', 0), loader), 'model')
+        self.assertEqual(loader.call_count, 1)
+
+    def test_lru_eviction(self):
+        cache = ModelCache(max_entries=2)
+        cache.get((1, 'a', 0), lambda: 'm1')
+        cache.get((2, 'a', 0), lambda: 'm2')
+        cache.get((1, 'a', 0), lambda: 'm1')  # touch 1
+        cache.get((3, 'a', 0), lambda: 'm3')
+        self.assertIn((1, 'a', 0), cache)
+        self.assertNotIn((2, 'a', 0), cache)
+        self.assertIn((3, 'a', 0), cache)
+
+    def test_memory_eviction(self):
+        cache = ModelCache(max_memory=100)
+        cache.get((1, 'a', 0), lambda: 'm1', size=60)
+        cache.get((2, 'a', 0), lambda: 'm2', size=60)
+        self.assertEqual(len(cache), 1)
+        self.assertIn((2, 'a', 0), cache)
+        # an entry larger than the limit is still kept until the next one
+        cache.get((3, 'a', 0), lambda: 'm3', size=200)
+        self.assertEqual(len(cache), 1)
+        self.assertIn((3, 'a', 0), cache)
+
+    def test_invalidate(self):
+        cache = ModelCache()
+        cache.get((1, 'a', 0), lambda: 'm1')
+        cache.get((1, 'b', 0), lambda: 'm1b')
+        cache.get((2, 'a', 0), lambda: 'm2')
+        cache.invalidate(1)
+        self.assertEqual(len(cache), 1)
+        self.assertIn((2, 'a', 0), cache)
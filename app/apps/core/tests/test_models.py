@@ -1,13 +1,31 @@
+import functools
 import json
+import math
 import os
+import random
 import subprocess
+from io import BytesIO
 from shutil import copyfile
+from types import SimpleNamespace
 from unittest.mock import patch
 
+import numpy as np
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-
-from core.models import LineTranscription, Transcription
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image, ImageDraw
+from shapely.geometry import LineString, Polygon
+
+from core.models import (
+    Document,
+    LineTranscription,
+    Transcription,
+    avg_line_height,
+    png_save_options,
+    region_finder,
+    sort_lines,
+)
 from core.tests.factory import CoreFactoryTestCase
 
 
@@ -524,3 +542,196 @@ class DocumentPartTestCase(CoreFactoryTestCase):
             f"{self.outdir}-1.json",
             f"{self.outdir}-1",
         ])
+
+
+class DocumentPartImageTestCase(CoreFactoryTestCase):
+    def make_image(self, mode, name):
+        file = BytesIO()
+        image = Image.new(mode, size=(400, 400), color=1)
+        ImageDraw.Draw(image).rectangle([50, 50, 300, 120], fill=0)
+        image.save(file, 'png', optimize=True)
+        return SimpleUploadedFile(name=name, content=file.getvalue(), content_type='image/png')
+
+    def test_compress_never_grows(self):
+        # saved again with 8-bit channels, a 1-bit image would be several times bigger
+        part = self.factory.make_part(image=self.make_image('1', 'bw.png'))
+        size = os.path.getsize(part.image.path)
+        part.compress()
+        part.refresh_from_db()
+        self.assertEqual(os.path.getsize(part.image.path), size)
+        self.assertFalse(os.path.exists(os.path.splitext(part.image.path)[0] + '_opti.png'))
+        with Image.open(part.image.path) as image:
+            self.assertEqual(image.mode, '1')
+
+    @override_settings(PNG_COMPRESSION_LEVEL=9, IMAGE_STRIP_METADATA=True)
+    def test_png_save_options(self):
+        with patch('core.models.pyvips.at_least_libvips', return_value=True):
+            self.assertEqual(png_save_options(), {'compression': 9, 'keep': 0})
+        with patch('core.models.pyvips.at_least_libvips', return_value=False):
+            self.assertEqual(png_save_options(), {'compression': 9, 'strip': True})
+        with override_settings(IMAGE_STRIP_METADATA=False):
+            self.assertEqual(png_save_options(), {'compression': 9})
+
+    @override_settings(TILES_ENABLE=True, TILES_SIZE=64)
+    def test_tiles(self):
+        part = self.factory.make_part()
+        self.assertIsNone(part.tiles_uri)
+
+        part.make_tiles()
+        uri = part.tiles_uri
+        self.assertTrue(uri.startswith(settings.MEDIA_URL) and uri.endswith('.dzi'))
+        dzi = os.path.join(settings.MEDIA_ROOT, part.tiles_path + '.dzi')
+        with open(dzi) as f:
+            self.assertIn('TileSize="64"', f.read())
+        self.assertTrue(os.listdir(os.path.join(settings.MEDIA_ROOT, part.tiles_path + '_files')))
+
+        # the cropped image gets new tiles at a new url
+        with patch('core.tasks.send_event') as send_event:
+            part.crop(0, 0, 30, 30)
+        self.assertNotEqual(part.tiles_uri, uri)
+        send_event.assert_called_once_with('document', part.document.pk, 'part:tiles', {
+            'id': part.pk, 'uri': part.tiles_uri
+        })
+        self.assertFalse(os.path.exists(dzi))
+
+        part.delete_tiles()
+        self.assertIsNone(part.tiles_uri)
+
+    @override_settings(TILES_ENABLE=True, TILES_SIZE=64)
+    def test_delete_tiles_of_sibling_image(self):
+        part = self.factory.make_part()
+        stem = os.path.splitext(os.path.basename(part.image.name))[0]
+        # page.png and page_v2.png have their tiles in the same directory
+        sibling = self.factory.make_part(document=part.document,
+                                         image=self.make_image('RGB', stem + '_v2.png'))
+        part.make_tiles()
+        sibling.make_tiles()
+
+        part.delete_tiles()
+        self.assertIsNone(part.tiles_uri)
+        self.assertIsNotNone(sibling.tiles_uri)
+
+    @override_settings(TILES_ENABLE=True, TILES_SIZE=64,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_tiles_uri_cache(self):
+        part = self.factory.make_part()
+        part.make_tiles()
+        uri = part.tiles_uri
+        with patch('os.stat') as stat:
+            self.assertEqual(part.tiles_uri, uri)
+        stat.assert_not_called()
+
+        part.delete_tiles()
+        self.assertIsNone(part.tiles_uri)
+
+
+def polygon_box(x0, y0, x1, y1, n_points=100):
+    """A rectangle described by n_points points, like the regions found by the segmenter."""
+    side = n_points // 4
+    return ([[x0 + (x1 - x0) * i // side, y0] for i in range(side)]
+            + [[x1, y0 + (y1 - y0) * i // side] for i in range(side)]
+            + [[x1 - (x1 - x0) * i // side, y1] for i in range(side)]
+            + [[x0, y1 - (y1 - y0) * i // side] for i in range(side)])
+
+
+def make_page(n_blocks=4, lines_per_block=60, line_height=40, block_width=500):
+    """
+    Builds a fake page of n_blocks columns of lines (in random order),
+    with the attributes of Line and Block used by the ordering.
+    """
+    lines = []
+    for b in range(n_blocks):
+        x0 = b * (block_width + 50)
+        height = lines_per_block * line_height
+        block = SimpleNamespace(pk=b + 1, box=polygon_box(x0, 0, x0 + block_width, height))
+        for i in range(lines_per_block):
+            y = i * line_height + 30
+            lines.append(SimpleNamespace(
+                pk=len(lines) + 1,
+                block=block,
+                block_id=block.pk,
+                baseline=[[x0 + 5 + (i % 3), y], [x0 + block_width - 5, y + 2]],
+                mask=None))
+    random.Random(42).shuffle(lines)
+    return lines
+
+
+def make_dense_layout(n_cols=20, n_rows=20, lines_per_region=3, size=200):
+    """
+    Builds a newspaper like grid of n_cols * n_rows regions
+    with a few baselines in each of them.
+    """
+    regions, baselines = [], []
+    for r in range(n_rows):
+        for c in range(n_cols):
+            x0, y0 = c * size, r * size
+            regions.append(SimpleNamespace(pk=len(regions) + 1,
+                                           box=polygon_box(x0, y0, x0 + size - 10, y0 + size - 10, n_points=40)))
+            for i in range(lines_per_region):
+                y = y0 + 30 + i * 50
+                baselines.append([[x0 + 10, y], [x0 + size - 30, y]])
+    return regions, baselines
+
+
+def legacy_sort_lines(lines, origin_box, read_direction):
+    """The comparator based sort used before sort_lines."""
+    lines = [SimpleNamespace(**vars(line)) for line in lines]  # don't keep the cached origin_pt
+
+    def distance(x, y):
+        return math.sqrt(sum([(a - b) ** 2 for a, b in zip(x, y)]))
+
+    def poly_origin_pt(shape):
+        return min(shape, key=lambda pt: distance(pt, origin_box))
+
+    def line_origin_pt(line_):
+        return (line_.baseline[-1 if read_direction == Document.READ_DIRECTION_RTL else 0]
+                if line_.baseline else poly_origin_pt(line_.mask))
+
+    avg_heights = {}
+    for line in lines:
+        avg_heights.setdefault(line.block.pk, []).append(line_origin_pt(line))
+    avg_heights = {pk: avg_line_height(np.array(origins)) for pk, origins in avg_heights.items()}
+
+    def cmp_lines(a, b):
+        if not hasattr(a, "origin_pt"):
+            a.origin_pt = line_origin_pt(a)
+        if not hasattr(b, "origin_pt"):
+            b.origin_pt = line_origin_pt(b)
+        if a.block != b.block:
+            pt1 = poly_origin_pt(a.block.box) if a.block else a.origin_pt
+            pt2 = poly_origin_pt(b.block.box) if b.block else b.origin_pt
+            return distance(pt1, origin_box) - distance(pt2, origin_box)
+        else:
+            pt1 = a.origin_pt
+            pt2 = b.origin_pt
+            if abs(pt1[1] - pt2[1]) < avg_heights[a.block.pk]:
+                return distance(pt1, origin_box) - distance(pt2, origin_box)
+        return pt1[1] - pt2[1]
+
+    return sorted(lines, key=functools.cmp_to_key(cmp_lines))
+
+
+class LineOrderingTestCase(SimpleTestCase):
+    """
+    The vectorized sort_lines and the spatial index of region_finder
+    give the same results as the implementations they replaced.
+    """
+
+    def test_sort_lines(self):
+        for n_blocks, lines_per_block in [(1, 50), (4, 30)]:
+            lines = make_page(n_blocks=n_blocks, lines_per_block=lines_per_block)
+            for read_direction in [Document.READ_DIRECTION_LTR, Document.READ_DIRECTION_RTL]:
+                self.assertEqual(
+                    [line.pk for line in sort_lines(lines, [0, 0], read_direction)],
+                    [line.pk for line in legacy_sort_lines(lines, [0, 0], read_direction)])
+
+    def test_region_finder(self):
+        regions, baselines = make_dense_layout(n_cols=5, n_rows=5)
+        centers = [LineString(baseline).interpolate(0.5, normalized=True) for baseline in baselines]
+        # and a point outside of all the regions
+        centers.append(LineString([[-100, -100], [-50, -100]]).interpolate(0.5, normalized=True))
+
+        find_region = region_finder(regions)
+        self.assertEqual(
+            [find_region(center) for center in centers],
+            [next((r for r in regions if Polygon(r.box).contains(center)), None) for center in centers])
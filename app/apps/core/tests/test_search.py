@@ -0,0 +1,146 @@
+from unittest.mock import patch
+
+from django.db import DataError
+from django.test import override_settings
+from django.urls import reverse
+
+from core.forms import FindAndReplaceForm, SearchForm
+from core.models import LineTranscription
+from core.search import (
+    REGEX_SEARCH_MODE,
+    invalidate_search_results,
+    search_content_psql_regex,
+    search_content_psql_word,
+)
+from core.tests.factory import CoreFactoryTestCase
+
+
+class PsqlSearchTestCase(CoreFactoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.part = self.factory.make_part()
+        self.user = self.part.document.owner
+        self.transcription = self.factory.make_transcription(document=self.part.document)
+        self.factory.make_content(self.part, amount=3, transcription=self.transcription)
+        self.lts = list(LineTranscription.objects.filter(transcription=self.transcription).order_by('line__order'))
+        for lt, content in zip(self.lts, ['Lorem ipsum dolor', 'ipsum Ipsa', 'sit amet']):
+            lt.content = content
+        LineTranscription.objects.bulk_update(self.lts, ['content'])
+
+    def test_word(self):
+        results = search_content_psql_word('ipsum', self.user, 'match', transcription_id=self.transcription.pk)
+        self.assertCountEqual([lt.pk for lt in results], [self.lts[0].pk, self.lts[1].pk])
+        highlighted = {lt.pk: lt.highlighted_content for lt in results}
+        self.assertEqual(highlighted[self.lts[1].pk], '<strong class="match">ipsum</strong> Ipsa')
+
+    def test_regex(self):
+        results = search_content_psql_regex('Ips.', self.user, 'match', transcription_id=self.transcription.pk)
+        self.assertEqual([lt.highlighted_content for lt in results], ['ipsum <strong class="match">Ipsa</strong>'])
+
+    def test_find_and_replace_invalid_regex(self):
+        # python named groups are not valid postgresql regular expressions
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse('find-replace'), {
+            'mode': REGEX_SEARCH_MODE,
+            'query': '(?P<a>ipsum)',
+            'project': self.part.document.project.pk,
+        })
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('You must enter a valid regex pattern', str(resp.context['form'].errors['query']))
+
+    def test_find_and_replace_failing_search(self):
+        self.client.force_login(self.user)
+        with patch.object(FindAndReplaceForm, 'search_page', side_effect=DataError('invalid regular expression')):
+            resp = self.client.get(reverse('find-replace'), {
+                'mode': REGEX_SEARCH_MODE,
+                'query': 'ipsum',
+                'project': self.part.document.project.pk,
+            })
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Something went wrong while searching', str(resp.context['form'].non_field_errors()))
+
+    def test_replacement_preview(self):
+        # postgresql syntax, \m is the start of a word
+        form = FindAndReplaceForm({
+            'mode': REGEX_SEARCH_MODE,
+            'query': r'\mip(s)',
+            'replacement': r'I\1',
+            'project': self.part.document.project.pk,
+            'document': self.part.document.pk,
+            'transcription': self.transcription.pk,
+        }, user=self.user)
+        self.assertTrue(form.is_valid(), form.errors)
+        page, total = form.search_page(1, 5)
+        self.assertEqual([lt.replacement_preview for lt in page], [
+            'Lorem <strong class="text-success">Is</strong>um dolor',
+            '<strong class="text-success">Is</strong>um Ipsa',
+        ])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached_pages(self):
+        form = FindAndReplaceForm({
+            'query': 'ipsum',
+            'project': self.part.document.project.pk,
+            'document': self.part.document.pk,
+            'transcription': self.transcription.pk,
+        }, user=self.user)
+        self.assertTrue(form.is_valid(), form.errors)
+        page, total = form.search_page(1, 1)
+        self.assertEqual((page, total), ([self.lts[0]], 2))
+        with self.assertNumQueries(1):
+            # only the page after the cursor
+            page, total = form.search_page(2, 1)
+        self.assertEqual((page, total), ([self.lts[1]], 2))
+
+        self.lts[0].content = 'sit amet'
+        self.lts[0].save()
+        page, total = form.search_page(1, 1)
+        self.assertEqual((page, total), ([self.lts[1]], 1))
+
+        self.lts[1].line.delete()
+        page, total = form.search_page(1, 1)
+        self.assertEqual((page, total), ([], 0))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ElasticsearchSearchTestCase(CoreFactoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.factory.make_user()
+
+        def search(index, body):
+            start = len(self.es_client.search.call_args_list) * 10
+            return {'hits': {'total': {'value': 100}, 'hits': [
+                {'_id': str(start + i), 'sort': [1.0, start + i, 1]} for i in range(body['size'])
+            ]}}
+
+        self.es_client = patch('core.search.Elasticsearch').start().return_value
+        self.es_client.search.side_effect = search
+        self.addCleanup(patch.stopall)
+
+    def test_cached_pages(self):
+        form = SearchForm({'query': 'ipsum  dolor'}, user=self.user)
+        self.assertTrue(form.is_valid(), form.errors)
+        first_page = form.search(1, 2)
+        body = self.es_client.search.call_args.kwargs['body']
+        self.assertEqual(body['from'], 0)
+        self.assertNotIn('search_after', body)
+
+        # the second page starts after the last hit of the first one
+        form.search(2, 2)
+        body = self.es_client.search.call_args.kwargs['body']
+        self.assertEqual(body['from'], 0)
+        self.assertEqual(body['search_after'], first_page['hits']['hits'][-1]['sort'])
+
+        self.assertEqual(form.search(1, 2), first_page)
+        self.assertEqual(self.es_client.search.call_count, 2)
+
+        # a new version of the user misses the cached pages and cursors
+        invalidate_search_results(user_ids=[self.user.pk])
+        new_first_page = form.search(1, 2)
+        self.assertNotEqual(new_first_page, first_page)
+        form.search(2, 2)
+        self.assertEqual(self.es_client.search.call_count, 4)
+        body = self.es_client.search.call_args.kwargs['body']
+        self.assertEqual(body['from'], 0)
+        self.assertEqual(body['search_after'], new_first_page['hits']['hits'][-1]['sort'])
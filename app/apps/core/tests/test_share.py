@@ -79,6 +79,35 @@ class DocumentShareTestCase(TestCase):
         self.assertEqual(resp.status_code, 404)
         self.assertEqual(self.doc.shared_with_groups.count(), 0)
 
+    def test_access_follows_changes(self):
+        project = self.doc.project
+        project.shared_with_groups.add(self.group)
+        self.assertIn(self.doc, Document.objects.for_user(self.target_group))
+        self.assertIn(project, Project.objects.for_user_read(self.target_group))
+
+        self.target_group.groups.clear()
+        self.assertNotIn(self.doc, Document.objects.for_user(self.target_group))
+        self.assertNotIn(project, Project.objects.for_user_read(self.target_group))
+
+        project.owner = self.target_user
+        project.save()
+        self.assertIn(self.doc, Document.objects.for_user(self.target_user))
+
+        self.doc.shared_with_users.add(self.target_group)
+        self.assertIn(project, Project.objects.for_user_read(self.target_group))
+        self.doc.delete()
+        self.assertNotIn(project, Project.objects.for_user_read(self.target_group))
+
+    def test_access_of_document_not_loaded_from_db(self):
+        # as done by loaddata, the previous values of the document are unknown
+        self.doc.shared_with_users.add(self.target_user)
+        project = Project.objects.create(name='other', owner=self.owner)
+        doc = Document(**{field.attname: getattr(self.doc, field.attname)
+                          for field in Document._meta.concrete_fields})
+        doc.project = project
+        doc.save()
+        self.assertIn(project, Project.objects.for_user_read(self.target_user))
+
 
 class PerformanceShareTestCase(TestCase):
     def setUp(self):
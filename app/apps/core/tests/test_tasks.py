@@ -1,11 +1,20 @@
 import unittest
 from unittest.mock import patch
 
+from django.test import override_settings
 from django.urls import reverse
 
-from core.models import Document, Line
-from core.tasks import align
+from core.models import (
+    Document,
+    DocumentPart,
+    Line,
+    LineTranscription,
+    ProcessCanceledException,
+)
+from core.search import REGEX_SEARCH_MODE, WORD_BY_WORD_SEARCH_MODE
+from core.tasks import align, replace_line_transcriptions_text, transcribe_parts
 from core.tests.factory import CoreFactoryTestCase
+from reporting.models import TaskReport
 
 # DO NOT REMOVE THIS IMPORT, it will break a lot of tests
 # It is used to trigger Celery signals when running tests
@@ -138,6 +147,140 @@ class TasksTestCase(CoreFactoryTestCase):
     def test_train_existing_segmentation_model(self):
         pass
 
+    def make_transcribe_chunk(self):
+        self.part = self.factory.make_part()
+        self.parts = [self.part] + [self.factory.make_part(document=self.part.document) for i in range(2)]
+        self.model = self.factory.make_model(self.part.document)
+        self.transcription = self.factory.make_transcription(document=self.part.document)
+        self.user = self.part.document.owner
+        patchers = [
+            patch('core.model_cache.load_recognition_model'),
+            patch.object(DocumentPart, 'transcribe', autospec=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return DocumentPart.transcribe
+
+    def transcribe_chunk(self, canceled=()):
+        # the reports are created by Document.queue_transcription
+        TaskReport.objects.bulk_create([
+            TaskReport(user=self.user, label='test', document_part=part, task_id=f'chunk:{part.pk}',
+                       workflow_state=TaskReport.WORKFLOW_STATE_CANCELED if part in canceled else TaskReport.WORKFLOW_STATE_QUEUED)
+            for part in self.parts
+        ])
+        return transcribe_parts.apply(kwargs={
+            'document_pk': self.part.document.pk,
+            'part_pks': [part.pk for part in self.parts],
+            'model_pk': self.model.pk,
+            'transcription_pk': self.transcription.pk,
+            'user_pk': self.user.pk,
+        }, task_id='chunk')
+
+    def part_reports(self):
+        return {
+            report.document_part_id: report
+            for report in TaskReport.objects.filter(document_part__in=self.parts)
+        }
+
+    @override_settings(TRANSCRIBE_PARTS_CHUNK_SIZE=2)
+    def test_queue_transcription_chunks(self):
+        transcribe = self.make_transcribe_chunk()
+        self.part.document.queue_transcription(self.parts, self.model, self.transcription, user=self.user)
+
+        self.assertCountEqual([call.args[0] for call in transcribe.call_args_list], self.parts)
+        reports = self.part_reports().values()
+        self.assertEqual({report.workflow_state for report in reports}, {TaskReport.WORKFLOW_STATE_DONE})
+        # a chunk of 2 parts and a chunk of 1 part
+        chunks = [report.celery_task_id for report in reports]
+        self.assertEqual(sorted(chunks.count(chunk) for chunk in set(chunks)), [1, 2])
+
+    def test_transcribe_chunk_skips_canceled_parts(self):
+        transcribe = self.make_transcribe_chunk()
+        self.transcribe_chunk(canceled=[self.parts[1]])
+
+        self.assertEqual([call.args[0] for call in transcribe.call_args_list], [self.parts[0], self.parts[2]])
+        reports = self.part_reports()
+        self.assertEqual(reports[self.parts[1].pk].workflow_state, TaskReport.WORKFLOW_STATE_CANCELED)
+        self.assertEqual(reports[self.parts[2].pk].workflow_state, TaskReport.WORKFLOW_STATE_DONE)
+
+    @override_settings(TRANSCRIBE_PARTS_CHUNK_SIZE=3)
+    def test_queue_transcription_skips_busy_parts(self):
+        transcribe = self.make_transcribe_chunk()
+        TaskReport.objects.create(user=self.user, label='test', document_part=self.parts[0],
+                                  method='core.tasks.transcribe', workflow_state=TaskReport.WORKFLOW_STATE_STARTED)
+        self.part.document.queue_transcription(self.parts, self.model, self.transcription, user=self.user)
+
+        self.assertEqual([call.args[0] for call in transcribe.call_args_list], self.parts[1:])
+
+    @patch('escriptorium.celery.app.control.revoke')
+    def test_transcribe_chunk_cancel_running_part(self, mock_revoke):
+        transcribe = self.make_transcribe_chunk()
+
+        def cancel_while_transcribing(part, *args, is_canceled=None, **kwargs):
+            if part.pk == self.parts[1].pk:
+                TaskReport.objects.get(document_part=part).cancel(self.user.username)
+                if is_canceled():
+                    raise ProcessCanceledException
+
+        transcribe.side_effect = cancel_while_transcribing
+        self.transcribe_chunk()
+
+        # the other parts of the chunk are still transcribed
+        mock_revoke.assert_not_called()
+        reports = self.part_reports()
+        self.assertEqual(reports[self.parts[0].pk].workflow_state, TaskReport.WORKFLOW_STATE_DONE)
+        self.assertEqual(reports[self.parts[1].pk].workflow_state, TaskReport.WORKFLOW_STATE_CANCELED)
+        self.assertEqual(reports[self.parts[2].pk].workflow_state, TaskReport.WORKFLOW_STATE_DONE)
+
+    def test_transcribe_chunk_failures(self):
+        transcribe = self.make_transcribe_chunk()
+        transcribe.side_effect = lambda part, *args, **kwargs: part.pk == self.parts[1].pk and 1 / 0
+        self.transcribe_chunk()
+
+        reports = self.part_reports()
+        self.assertEqual(reports[self.parts[0].pk].workflow_state, TaskReport.WORKFLOW_STATE_DONE)
+        self.assertEqual(reports[self.parts[1].pk].workflow_state, TaskReport.WORKFLOW_STATE_ERROR)
+        self.assertIn('division by zero', reports[self.parts[1].pk].messages)
+
+    def test_transcribe_chunk_fails_if_every_part_fails(self):
+        transcribe = self.make_transcribe_chunk()
+        transcribe.side_effect = ZeroDivisionError
+        with self.assertRaises(Exception):
+            self.transcribe_chunk()
+        self.assertEqual({report.workflow_state for report in self.part_reports().values()},
+                         {TaskReport.WORKFLOW_STATE_ERROR})
+
+    @override_settings(FIND_AND_REPLACE_CHUNK_SIZE=2)
+    def test_replace_line_transcriptions_text(self):
+        part = self.factory.make_part()
+        transcription = self.factory.make_transcription(document=part.document)
+        self.factory.make_content(part, amount=3, transcription=transcription)
+        lts = list(LineTranscription.objects.filter(transcription=transcription).order_by('line__order'))
+        for lt, content in zip(lts, ['Lorem ipsum dolor', 'Ipsum ipsa', 'sit amet']):
+            lt.content = content
+        LineTranscription.objects.bulk_update(lts, ['content'])
+        user = part.document.owner
+
+        replace_line_transcriptions_text.delay(WORD_BY_WORD_SEARCH_MODE, 'ipsum', 'foo', transcription_pk=transcription.pk, user_pk=user.pk)
+        replace_line_transcriptions_text.delay(REGEX_SEARCH_MODE, 'o(l)o', r'\1\1', transcription_pk=transcription.pk, user_pk=user.pk)
+
+        for lt in lts:
+            lt.refresh_from_db()
+        self.assertEqual([lt.content for lt in lts], ['Lorem foo dllr', 'foo ipsa', 'sit amet'])
+        self.assertEqual([version['data']['content'] for version in lts[0].versions], ['Lorem foo dolor', 'Lorem ipsum dolor'])
+        self.assertEqual(lts[0].version_author, user.username)
+        self.assertEqual(lts[0].history[1].content, 'Lorem ipsum dolor')
+        self.assertEqual(lts[2].versions, [])
+
+        # the content column would overflow, only the other lines are replaced
+        replace_line_transcriptions_text.delay(REGEX_SEARCH_MODE, 'dllr|amet', 'x' * 2041, transcription_pk=transcription.pk, user_pk=user.pk)
+        for lt in lts:
+            lt.refresh_from_db()
+        self.assertEqual([lt.content for lt in lts], ['Lorem foo dllr', 'foo ipsa', 'sit ' + 'x' * 2041])
+        report = TaskReport.objects.filter(method='core.tasks.replace_line_transcriptions_text').latest('pk')
+        self.assertIn(f'line transcriptions {lts[0].pk}, their content would be too long', report.messages)
+
     def test_align_task(self):
         """Unit tests for document alignment task"""
         # should log error on bad DocumentPart PK
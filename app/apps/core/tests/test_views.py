@@ -51,7 +51,7 @@ class DocumentTestCase(TestCase):
         self.assertEqual(Document.objects.count(), 4)  # 4 created in setup
         self.client.force_login(self.user)
         uri = reverse('document-create', kwargs={'slug': self.project.slug})
-        with self.assertNumQueries(29):
+        with self.assertNumQueries(32):
             resp = self.client.post(uri, {
                 'project': str(self.project.id),
                 'name': 'Test+metadatas',
@@ -62,7 +62,7 @@ from core.models import (
     OcrModelRight,
     Project,
 )
-from core.search import WORD_BY_WORD_SEARCH_MODE, build_highlighted_replacement_psql
+from core.search import WORD_BY_WORD_SEARCH_MODE
 from core.tasks import replace_line_transcriptions_text
 from imports.forms import DocumentOntologyImportForm, ExportForm, ImportForm
 from imports.serializers import OntologyImportSerializer
@@ -256,6 +256,8 @@ class FindAndReplace(BaseSearch):
     form_class = FindAndReplaceForm
     template_name = 'core/search/find_and_replace.html'
     paginate_by = 5
+    # number of results of the search, stays 0 if it fails
+    total = 0
 
     def get_part_image_thumbnail(self, part_image):
         thumbnailer = get_thumbnailer(part_image)
@@ -286,7 +288,7 @@ class FindAndReplace(BaseSearch):
             for value, factor in zip(line_box, scale_factors)
         ]
 
-    def convert_lt_object_to_template(self, mode, find_terms, replace_term, lt_object, thumbnails):
+    def convert_lt_object_to_template(self, lt_object, thumbnails):
         if lt_object.line.document_part_id not in thumbnails:
             try:
                 thumbnail_url, thumbnail_width, thumbnail_height, scale_factors = self.get_part_image_thumbnail(lt_object.line.document_part.image)
@@ -303,7 +305,8 @@ class FindAndReplace(BaseSearch):
             'object': lt_object,
             'context_before': None,
             'context_after': None,
-            'replacement_preview': build_highlighted_replacement_psql(mode, find_terms, replace_term, lt_object.highlighted_content),
+            # cf FindAndReplaceForm.search_page
+            'replacement_preview': getattr(lt_object, 'replacement_preview', None),
             'score': 100,
             'img_url': thumbnails[lt_object.line.document_part_id]['url'],
             'img_w': thumbnails[lt_object.line.document_part_id]['width'],
@@ -316,13 +319,8 @@ class FindAndReplace(BaseSearch):
         return self.form.cleaned_data.get('mode', WORD_BY_WORD_SEARCH_MODE), self.form.cleaned_data['query'], self.form.cleaned_data['replacement']
 
     def get_and_format_results(self, page=None, paginate_by=None):
-        results = self.form.search()
-        mode, find_terms, replace_term = self.get_mandatory_params()
-        if mode == WORD_BY_WORD_SEARCH_MODE:
-            find_terms = '|'.join(find_terms.split(' '))
-
         try:
-            results = list(results)
+            results, self.total = self.form.search_page(page, paginate_by)
         except DataError as e:
             self.form.add_error(None, f'Something went wrong while searching for results - {e}')
             return [], None
@@ -330,11 +328,15 @@ class FindAndReplace(BaseSearch):
         thumbnails = {}
         template_results = []
         for lt_object in results:
-            template_result, thumbnails = self.convert_lt_object_to_template(mode, find_terms, replace_term, lt_object, thumbnails)
+            template_result, thumbnails = self.convert_lt_object_to_template(lt_object, thumbnails)
             template_results.append(template_result)
 
         return template_results, None
 
+    def get_paginator(self, results, paginate_by):
+        # only the results of the page are retrieved
+        return ESPaginator(results, paginate_by, total=self.total)
+
     def get_filters(self):
         return {
             'mode': self.request.GET.get('mode'),
@@ -0,0 +1,176 @@
+"""
+Download of the remote files of the imports (IIIF images, METS pages and layers).
+
+All the requests of an import go through a single pooled session, with at most
+IMPORT_DOWNLOAD_PER_HOST concurrent requests on the same host. When a server
+answers 429 Too Many Requests, every request to that host waits for the time
+given by its Retry-After header and the delay between two requests to the host
+is doubled, it then slowly goes back down as long as the server answers.
+"""
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = [500, 502, 503, 504, 507, 508]
+MAX_RETRY_AFTER = 300  # seconds, don't let a server stall an import forever
+MAX_DELAY = 10  # seconds between two requests to a throttling host
+
+
+class Host:
+    def __init__(self, concurrency):
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.delay = 0
+        self.next_at = 0
+
+
+def retry_after(response, default=1):
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return default
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+class Downloader:
+    def __init__(self, per_host=None, timeout=None, max_size=None, retry_limit=4, verify=True):
+        self.per_host = per_host or getattr(settings, "IMPORT_DOWNLOAD_PER_HOST", 4)
+        self.timeout = timeout or getattr(settings, "IMPORT_DOWNLOAD_TIMEOUT", 30)
+        self.max_size = max_size or getattr(settings, "IMPORT_DOWNLOAD_MAX_SIZE", None)
+        self.retry_limit = retry_limit
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def get_host(self, url):
+        netloc = urlparse(url).netloc
+        with self.lock:
+            if netloc not in self.hosts:
+                self.hosts[netloc] = Host(self.per_host)
+            return self.hosts[netloc]
+
+    def wait_turn(self, host):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, host.next_at)
+            host.next_at = start + host.delay
+        if start > now:
+            time.sleep(start - now)
+
+    def throttled(self, host, seconds):
+        with self.lock:
+            host.delay = min(max(host.delay * 2, 0.1), MAX_DELAY)
+            host.next_at = max(host.next_at, time.monotonic() + seconds)
+
+    def answered(self, host):
+        with self.lock:
+            host.delay = host.delay * 0.9 if host.delay > 0.01 else 0
+
+    def get(self, host, url):
+        """
+        Returns the streamed response of a successful GET request,
+        the caller holds a slot of the host.
+
+        Transient 5XX errors, network errors and timeouts are retried
+        with a little more backoff on each retry, as well as 429 responses
+        once the server allows it. Failure to retrieve the file within the
+        retry limit, or any other unsuccessful response, raises a DownloadError.
+        """
+        from imports.parsers import DownloadError
+
+        current_retry = 0
+        while current_retry < self.retry_limit:
+            current_retry = current_retry + 1
+            self.wait_turn(host)
+            try:
+                response = self.session.get(url, stream=True, timeout=self.timeout)
+                response.raise_for_status()
+                self.answered(host)
+                return response
+
+            except requests.exceptions.HTTPError as http_error:
+                status_code = http_error.response.status_code
+                http_error.response.close()
+                if status_code == 429:
+                    seconds = retry_after(http_error.response)
+                    logger.info("Throttled by %s for %ss", urlparse(url).netloc, seconds)
+                    self.throttled(host, seconds)
+                    continue
+
+                # retry on transient 5XX errors, but keep a record of the retry count
+                if status_code in RETRY_STATUSES:
+                    time.sleep(0.1 * current_retry)
+                    continue
+
+                # We probably got a 4XX error, but whatever it is just raise it
+                raise DownloadError(http_error)
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                # network error or timeout, retry
+                time.sleep(0.1 * current_retry)
+                continue
+
+        # Max retries has been exceeded
+        raise DownloadError(f"After {current_retry} tries, the server still errors out loading: {url}")
+
+    def download(self, url, name=None, accept=None):
+        """
+        Streams the body of url to a temporary file and returns it,
+        the file storage moves it in place instead of copying it when saving a FileField.
+        accept(response) can look at the headers to skip the body, None is returned then.
+        Files bigger than IMPORT_DOWNLOAD_MAX_SIZE raise a DownloadError.
+        """
+        from imports.parsers import DownloadError
+
+        host = self.get_host(url)
+        with host.semaphore:
+            response = self.get(host, url)
+            try:
+                if accept is not None and not accept(response):
+                    return None
+
+                content_type = response.headers.get("content-type", "")
+                fh = TemporaryUploadedFile(name or url.rstrip("/").split("/")[-1], content_type, None, None)
+                try:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        fh.write(chunk)
+                        if self.max_size and fh.tell() > self.max_size:
+                            raise DownloadError(f"{url} is bigger than the maximum size of {self.max_size} bytes")
+                except requests.exceptions.RequestException as e:
+                    fh.close()
+                    raise DownloadError(e)
+                except DownloadError:
+                    fh.close()
+                    raise
+            finally:
+                response.close()
+
+        fh.size = fh.tell()
+        fh.seek(0)
+        return fh
@@ -1,4 +1,5 @@
-import io
+import copy
+import functools
 import logging
 import os
 import zipfile
@@ -12,6 +13,9 @@ from django.core.validators import URLValidator
 from lxml import html
 from PIL import Image
 
+from imports.downloads import Downloader
+from imports.utils import prefetch
+
 logger = logging.getLogger(__name__)
 
 DOCUMENT_METADATA_MAPPING = {
@@ -38,10 +42,23 @@ SUPPORTED_IMAGE_MIMETYPES = ["image/gif", "image/jpeg", "image/png", "image/jp2"
 METSPage = namedtuple('METSPage', ['image', 'sources', 'metadata'], defaults=[None, {}, {}])
 
 
+class DeferredReport:
+    """
+    Keeps the messages of a page resolved in a worker thread,
+    they are added to the task report (saving it) by the importing thread, in page order.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def append(self, text, logger_fct=None):
+        self.messages.append((text, logger_fct))
+
+
 class METSProcessor:
     NAMESPACES = {"mets": "http://www.loc.gov/METS/", "mods": "http://www.loc.gov/mods/v3"}
 
-    def __init__(self, mets_xml, report, archive=None, mets_base_uri=None):
+    def __init__(self, mets_xml, report, archive=None, mets_base_uri=None, downloader=None):
         if mets_xml is not None and mets_xml.tag == '{http://www.openarchives.org/OAI/2.0/}OAI-PMH':
             # The METS XML is the child of a OAI-PMH root tag
             self.mets_xml = mets_xml.find('.//mets:mets', namespaces=self.NAMESPACES)
@@ -49,12 +66,18 @@ class METSProcessor:
             self.mets_xml = mets_xml
         self.report = report
         self.archive = archive
+        # a single handle on the archive for all the files retrieved in it
+        self.zip = archive if isinstance(archive, zipfile.ZipFile) else None
         self.mets_base_uri = mets_base_uri
         self.url_validator = URLValidator()
+        # a single pooled session, shared by the threads resolving the remote pages
+        self.downloader = downloader or (Downloader() if archive is None else None)
+        self.pages_count = 0
 
     def retrieve_in_archive(self, filename):
-        with zipfile.ZipFile(self.archive) as archive:
-            return archive.open(filename)
+        if self.zip is None:
+            self.zip = zipfile.ZipFile(self.archive)
+        return self.zip.open(filename)
 
     def get_document_metadata(self):
         metadata = {}
@@ -198,6 +221,8 @@ class METSProcessor:
         return content_type and content_type.startswith("image/"), content_type
 
     def handle_remote_pointer(self, href, mets_page_image, mets_page_sources, layer_name, layers_count):
+        from imports.parsers import DownloadError
+
         uri = self.build_remote_uri(href)
 
         domain = urlparse(uri).netloc
@@ -205,28 +230,31 @@ class METSProcessor:
             self.report.append(f'The domain of the file URI is not allowed during import. Please contact an administrator to add the following domain to the list: "{domain}".', logger_fct=logger.error)
             return mets_page_image, mets_page_sources, layers_count
 
-        # Downloading the file content
-        try:
-            get_resp = requests.get(uri)
-            is_image, content_type = self.check_is_image(get_resp)
+        name = os.path.basename(uri)
+        if name == 'default.jpg':
+            # Images from IIIF image servers require special handling.
+            # {scheme}://{server}{/prefix}/{identifier}/{region}/{size}/{rotation}/{quality}.{format}
+            scheme_server_prefix, identifier, region, size, rotation, quality_format = uri.rsplit('/', 5)
+            name = identifier + '.jpg'
+
+        is_image = False
 
+        def accept(resp):
+            nonlocal is_image
+            is_image, content_type = self.check_is_image(resp)
             # Pointing towards an image but we already found one for this METS page or its format isn't supported, we can skip it
-            if is_image and (mets_page_image or content_type not in SUPPORTED_IMAGE_MIMETYPES):
-                return mets_page_image, mets_page_sources, layers_count
-
-            get_resp.raise_for_status()
-            content = get_resp.content
-            file = io.BytesIO(content)
-            file.name = os.path.basename(uri)
-            if file.name == 'default.jpg':
-                # Images from IIIF image servers require special handling.
-                # {scheme}://{server}{/prefix}/{identifier}/{region}/{size}/{rotation}/{quality}.{format}
-                scheme_server_prefix, identifier, region, size, rotation, quality_format = uri.rsplit('/', 5)
-                file.name = identifier + '.jpg'
-        except requests.exceptions.RequestException as e:
+            return not (is_image and (mets_page_image or content_type not in SUPPORTED_IMAGE_MIMETYPES))
+
+        # Downloading the file content to a temporary file
+        try:
+            file = self.downloader.download(uri, name=name, accept=accept)
+        except (requests.exceptions.RequestException, DownloadError) as e:
             self.report.append(f"File not found on remote URI {uri}: {e}", logger_fct=logger.error)
             return mets_page_image, mets_page_sources, layers_count
 
+        if file is None:
+            return mets_page_image, mets_page_sources, layers_count
+
         if is_image:
             mets_page_image = file
         else:
@@ -263,25 +291,50 @@ class METSProcessor:
 
         return METSPage(image=mets_page_image, sources=mets_page_sources, metadata=metadata)
 
-    def process(self):
+    def resolve_page(self, page, files):
+        processor = copy.copy(self)
+        processor.report = DeferredReport()
+        try:
+            return processor.process_single_page(page, files), None, processor.report.messages
+        # Catch any exception so that we don't fail when only one page is in error
+        except Exception as e:
+            return None, e, processor.report.messages
+
+    def resolve_pages(self, pages, files):
+        # remote files of the next pages are downloaded while the current one is being imported
+        workers = 1 if self.archive else getattr(settings, "IMPORT_DOWNLOAD_WORKERS", 8)
+        resolved = prefetch(functools.partial(self.resolve_page, files=files), pages, workers)
+        try:
+            for index, future in enumerate(resolved, start=1):
+                mets_page, error, messages = future.result()
+                for text, logger_fct in messages:
+                    self.report.append(text, logger_fct=logger_fct)
+                if error is not None:
+                    self.report.append(f"An exception occurred while processing the page N°{index}: {error}", logger_fct=logger.error)
+                    continue
+
+                yield mets_page
+        finally:
+            resolved.close()
+
+    def iter_process(self):
+        """
+        Same as process() but the pages are resolved as they are consumed,
+        concurrently for remote files.
+        """
         try:
             metadata = self.get_document_metadata()
         except Exception as e:
             self.report.append(f"An exception occurred while retrieving metadata from the METS header: {e}", logger_fct=logger.warning)
             metadata = {}
 
-        mets_pages = []
         files = self.get_files_from_file_sec()
-
         pages = self.get_pages_from_struct_map()
-        for index, page in enumerate(pages, start=1):
-            try:
-                mets_page = self.process_single_page(page, files)
-            # Catch any exception so that we don't fail when only one page is in error
-            except Exception as e:
-                self.report.append(f"An exception occurred while processing the page N°{index}: {e}", logger_fct=logger.error)
-                continue
+        self.pages_count = len(pages)
+        if self.archive is not None and self.zip is None:
+            self.zip = zipfile.ZipFile(self.archive)
+        return self.resolve_pages(pages, files), metadata
 
-            mets_pages.append(mets_page)
-
-        return mets_pages, metadata
+    def process(self):
+        mets_pages, metadata = self.iter_process()
+        return list(mets_pages), metadata
@@ -1,16 +1,17 @@
+import functools
 import json
 import logging
 import os
 import re
-import time
+import shutil
 import uuid
 import zipfile
 from statistics import mean
 
 import pyvips
-import requests
 from django.conf import settings
 from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
 from django.core.validators import get_available_image_extensions
 from django.db import transaction
 from django.forms import ValidationError
@@ -27,9 +28,14 @@ from core.models import (
     Line,
     LineTranscription,
     Metadata,
+    PendingIndexation,
     Transcription,
 )
+from core.search import invalidate_search_results
+from imports.downloads import Downloader
 from imports.mets import METSProcessor
+from imports.schemas import ESCRIPTORIUM_ALTO, SchemaUnavailable, get_schema
+from imports.utils import prefetch
 from users.consumers import send_event
 from versioning.models import NoChangeException
 
@@ -118,6 +124,14 @@ class PdfParser(ParserDocument):
         else:
             return 0
 
+    @staticmethod
+    def rasterize_page(buff, page_nb):
+        page = pyvips.Image.pdfload_buffer(buff,
+                                           page=page_nb,
+                                           dpi=300,
+                                           access='sequential')
+        return page.write_to_buffer('.png')
+
     def parse(self, start_at=0, override=False, user=None):
         assert (
             self.report
@@ -126,18 +140,29 @@ class PdfParser(ParserDocument):
         buff = self.file.read()
         doc = pyvips.Image.pdfload_buffer(buff, n=-1, access='sequential')
         n_pages = doc.get('n-pages')
+        page_nb = start_at
+
+        def has_free_disk_storage():
+            # If quotas are enforced, assert that the user still has free disk storage
+            return settings.DISABLE_QUOTAS or user.has_free_disk_storage()
+
+        def pages_to_render():
+            # no page is rendered once the user ran out of disk storage
+            for nb in range(start_at, n_pages):
+                if not has_free_disk_storage():
+                    return
+                yield nb
+
+        # pages are rendered in threads (libvips releases the GIL) but saved in order
+        pages = prefetch(functools.partial(self.rasterize_page, buff),
+                         pages_to_render(),
+                         getattr(settings, 'PDF_IMPORT_WORKERS', 1))
         try:
-            for page_nb in range(start_at, n_pages):
-                # If quotas are enforced, assert that the user still has free disk storage
-                if not settings.DISABLE_QUOTAS and not user.has_free_disk_storage():
-                    raise DiskQuotaReachedError(
-                        _(f"You ran out of disk storage. {n_pages - page_nb} pages were left to import (over {n_pages - start_at})")
-                    )
+            for future in pages:
+                if not has_free_disk_storage():
+                    break
+                png = future.result()
 
-                page = pyvips.Image.pdfload_buffer(buff,
-                                                   page=page_nb,
-                                                   dpi=300,
-                                                   access='sequential')
                 pdfname = os.path.basename(self.file.name)
                 fname = '%s_page_%d.png' % (pdfname, page_nb + 1)
                 try:
@@ -154,7 +179,7 @@ class PdfParser(ParserDocument):
                     )
 
                 part.image_file_size = 0
-                part.image.save(fname, ContentFile(page.write_to_buffer('.png')))
+                part.image.save(fname, ContentFile(png))
                 part.image_file_size = part.image.size
                 part.source = f"pdf//{pdfname}"
                 part.workflow_state = DocumentPart.WORKFLOW_STATE_CONVERTED
@@ -164,6 +189,11 @@ class PdfParser(ParserDocument):
                 yield part
                 page_nb = page_nb + 1
 
+            if page_nb < n_pages:
+                raise DiskQuotaReachedError(
+                    _(f"You ran out of disk storage. {n_pages - page_nb} pages were left to import (over {n_pages - start_at})")
+                )
+
         except pyvips.error.Error as e:
             self.report.append(
                 _("Parse error in {filename}: {page}: {error}, skipping it.").format(
@@ -171,6 +201,8 @@ class PdfParser(ParserDocument):
                 ),
                 logger_fct=logger.warning,
             )
+        finally:
+            pages.close()
 
     def clean(self):
         # if the import went well we are safe to delete the file
@@ -183,32 +215,62 @@ class ZipParser(ParserDocument):
     """
 
     DEFAULT_NAME = _("Zip Import")
+    CHUNK_SIZE = 1024 * 1024
+
+    @cached_property
+    def archive(self):
+        # a single handle on the archive for the whole import,
+        # opening it reads and checks the central directory
+        return zipfile.ZipFile(self.file)
 
     def validate(self):
+        # the members are not decompressed here (testzip() would decompress everything),
+        # their CRCs are checked while they are copied during the import.
         try:
-            with zipfile.ZipFile(self.file) as zfh:
-                if zfh.testzip() is not None:
-                    raise ParseError(_("File appears to not be a valid zip."))
-                # for i,finfo in enumerate(zfh.infolist()):
-                #     with zfh.open(finfo) as zipedfh:
-                #         parser = make_parser(self.document, zipedfh)
-                #         parser.validate()
+            for finfo in self.archive.infolist():
+                if finfo.flag_bits & 0x1:
+                    raise ParseError(_("Encrypted zip files are not supported."))
+        except ParseError:
+            raise
         except Exception as e:
             logger.exception(e)
             raise ParseError(_("Zip file appears to be corrupted."))
 
     @property
     def total(self):
-        # TODO: we open the file twice on upload
-        with zipfile.ZipFile(self.file) as zfh:
-            return len(zfh.infolist())
+        return len(self.archive.infolist())
+
+    def extract(self, finfo):
+        """
+        Copies a member of the archive by chunks to a temporary file, zipfile checks its CRC
+        once it has been read entirely (raising BadZipFile) so a corrupted member never
+        reaches the storage, which moves the temporary file in place when saving the image.
+        """
+        fh = TemporaryUploadedFile(os.path.basename(finfo.filename), None, finfo.file_size, None)
+        try:
+            with self.archive.open(finfo) as member:
+                shutil.copyfileobj(member, fh, self.CHUNK_SIZE)
+        except BaseException:
+            fh.close()
+            raise
+        fh.seek(0)
+        return fh
+
+    def report_corrupted(self, member, error, user):
+        # bad CRC or truncated member, we let go to try the other ones
+        msg = _("Corrupted file in {filename}: {member}: {error}, skipping it.").format(
+            filename=self.file.name, member=member, error=error
+        )
+        self.report.append(msg, logger_fct=logger.warning)
+        if user:
+            user.notify(msg, id="import:warning", level="warning")
 
     def parse(self, start_at=0, override=False, user=None):
         assert (
             self.report
         ), "A TaskReport instance should be provided while parsing data."
 
-        with zipfile.ZipFile(self.file) as zfh:
+        with self.archive as zfh:
             total = len(zfh.infolist())
             for index, finfo in enumerate(zfh.infolist()):
                 if index < start_at:
@@ -237,7 +299,9 @@ class ZipParser(ParserDocument):
                                     original_filename=filename
                                 )
                             part.image_file_size = 0
-                            part.image.save(filename, ContentFile(zipedfh.read()))
+                            image = self.extract(finfo)
+                            part.image.save(filename, image)
+                            image.close()
                             part.image_file_size = part.image.size
                             part.source = "zip//{0}/{1}".format(
                                 os.path.basename(self.file.name),
@@ -257,6 +321,8 @@ class ZipParser(ParserDocument):
                     except IndexError:
                         # no file extension!?
                         pass
+                    except zipfile.BadZipFile as e:
+                        self.report_corrupted(finfo.filename, e, user)
                     except ParseError as e:
                         # we let go to try other documents
                         msg = _(
@@ -294,7 +360,8 @@ class METSBaseParser():
                 original_filename=filename
             )
         part.image_file_size = 0
-        part.image.save(filename, ContentFile(image.read()))
+        # image is a temporary file (downloaded or extracted), moved in place by the storage
+        part.image.save(filename, image)
         part.image_file_size = part.image.size
         part.source = source
         part.workflow_state = DocumentPart.WORKFLOW_STATE_CONVERTED
@@ -324,18 +391,13 @@ class METSRemoteParser(ParserDocument, METSBaseParser):
     def __init__(self, document, file_handler, report, xml_root, mets_base_uri, transcription_name=None):
         self.mets_file_content = xml_root
         self.mets_base_uri = mets_base_uri
-        self.mets_pages = []
+        # number of files described by the pages processed so far
+        self.files_count = 0
         super().__init__(document, file_handler, report, transcription_name=transcription_name)
 
     @property
     def total(self):
-        total = 0
-        for page in self.mets_pages:
-            if page.image:
-                total += 1
-            if page.sources:
-                total += len(page.sources.keys())
-        return total
+        return self.files_count
 
     def validate(self):
         pass
@@ -345,67 +407,84 @@ class METSRemoteParser(ParserDocument, METSBaseParser):
             self.report
         ), "A TaskReport instance should be provided while parsing data."
 
-        # Retrieving all the pages described by the METS file
-        try:
-            self.mets_pages, metadata = METSProcessor(self.mets_file_content, report=self.report, mets_base_uri=self.mets_base_uri).process()
-        except ParseError:
-            raise
-        except Exception as e:
-            raise ParseError(f"An error occurred during the processing of the remote METS file: {e}")
+        with Downloader() as downloader:
+            # Retrieving the pages described by the METS file, their files are
+            # downloaded concurrently while the previous ones are being imported
+            try:
+                processor = METSProcessor(self.mets_file_content, report=self.report,
+                                          mets_base_uri=self.mets_base_uri, downloader=downloader)
+                mets_pages, metadata = processor.iter_process()
+            except ParseError:
+                raise
+            except Exception as e:
+                raise ParseError(f"An error occurred during the processing of the remote METS file: {e}")
 
-        self.store_document_metadata(metadata)
+            self.store_document_metadata(metadata)
 
-        total = self.total
+            try:
+                yield from self.parse_pages(mets_pages, processor.pages_count, start_at, override, user)
+            finally:
+                mets_pages.close()
+
+    def parse_pages(self, mets_pages, total, start_at, override, user):
         global_index = 0
-        for index, mets_page in enumerate(self.mets_pages):
-            metadata_already_stored = False
+        for index, mets_page in enumerate(mets_pages):
+            self.files_count += (1 if mets_page.image else 0) + len(mets_page.sources.keys())
+            try:
+                metadata_already_stored = False
 
-            if mets_page.image:
-                if global_index < start_at:
-                    global_index += 1 + len(mets_page.sources.keys())
-                    continue
+                if mets_page.image:
+                    if global_index < start_at:
+                        global_index += 1 + len(mets_page.sources.keys())
+                        continue
 
-                filename = mets_page.image.name
-                part = self.parse_image(user, total, index, start_at, filename,
-                                        mets_page.image, self.mets_base_uri)
-                # If we have a page with an image + multiple sources, we don't want to
-                # store the same metadata multiple times and spam the database for nothing
-                if not metadata_already_stored:
-                    self.store_part_metadata(mets_page.metadata, part)
-                    metadata_already_stored = True
-
-            for index, (layer_name, source) in enumerate(mets_page.sources.items()):
-                if global_index < start_at:
-                    global_index += 1 + len(mets_page.sources.keys())
-                    continue
+                    filename = mets_page.image.name
+                    part = self.parse_image(user, total, index, start_at, filename,
+                                            mets_page.image, self.mets_base_uri)
+                    # If we have a page with an image + multiple sources, we don't want to
+                    # store the same metadata multiple times and spam the database for nothing
+                    if not metadata_already_stored:
+                        self.store_part_metadata(mets_page.metadata, part)
+                        metadata_already_stored = True
 
-                filename = source.name
+                for index, (layer_name, source) in enumerate(mets_page.sources.items()):
+                    if global_index < start_at:
+                        global_index += 1 + len(mets_page.sources.keys())
+                        continue
 
-                try:
-                    parser = make_parser(self.document, source,
-                                         name=f"{self.name} | {layer_name}",
-                                         report=self.report,
-                                         # mets_describer=False,
-                                         # mets_base_uri=self.mets_base_uri,
-                                         zip_allowed=False,
-                                         pdf_allowed=False)
-                    # We only want to override for the first imported source if there are multiple ones
-                    for part in parser.parse(override=(override and index == 0), user=user):
-                        # If we have a page with an image + multiple sources, we don't want to
-                        # store the same metadata multiple times and spam the database for nothing
-                        if not metadata_already_stored:
-                            self.store_part_metadata(mets_page.metadata, part)
-                            metadata_already_stored = True
+                    filename = source.name
 
-                        yield part
-                except (ValueError, ParseError) as e:
-                    # We let go to try other sources
-                    msg = _(
-                        "Parse error in {filename}: {xmlfile}: {error}, skipping it."
-                    ).format(filename=self.file.name, xmlfile=filename, error=e.args[0])
-                    self.report.append(msg, logger_fct=logger.warning)
-                    if user:
-                        user.notify(msg, id="import:warning", level="warning")
+                    try:
+                        parser = make_parser(self.document, source,
+                                             name=f"{self.name} | {layer_name}",
+                                             report=self.report,
+                                             # mets_describer=False,
+                                             # mets_base_uri=self.mets_base_uri,
+                                             zip_allowed=False,
+                                             pdf_allowed=False)
+                        # We only want to override for the first imported source if there are multiple ones
+                        for part in parser.parse(override=(override and index == 0), user=user):
+                            # If we have a page with an image + multiple sources, we don't want to
+                            # store the same metadata multiple times and spam the database for nothing
+                            if not metadata_already_stored:
+                                self.store_part_metadata(mets_page.metadata, part)
+                                metadata_already_stored = True
+
+                            yield part
+                    except (ValueError, ParseError) as e:
+                        # We let go to try other sources
+                        msg = _(
+                            "Parse error in {filename}: {xmlfile}: {error}, skipping it."
+                        ).format(filename=self.file.name, xmlfile=filename, error=e.args[0])
+                        self.report.append(msg, logger_fct=logger.warning)
+                        if user:
+                            user.notify(msg, id="import:warning", level="warning")
+            finally:
+                # the downloaded files are temporary files, released as soon as the page is imported
+                if mets_page.image:
+                    mets_page.image.close()
+                for source in mets_page.sources.values():
+                    source.close()
 
 
 class METSZipParser(ZipParser, METSBaseParser):
@@ -416,9 +495,10 @@ class METSZipParser(ZipParser, METSBaseParser):
             self.report
         ), "A TaskReport instance should be provided while parsing data."
 
-        # Searching for the METS file in the archive
-        with zipfile.ZipFile(self.file) as archive:
+        with self.archive as archive:
             total = len(archive.infolist())
+
+            # Searching for the METS file in the archive
             xml_filenames = [filename for filename in archive.namelist() if os.path.splitext(filename)[1][1:] == "xml"]
 
             mets_file_content = None
@@ -435,37 +515,44 @@ class METSZipParser(ZipParser, METSBaseParser):
                         mets_file_content = root
                         break
 
-        # If we didn't find a METS file in the archive after browsing everything, something is wrong
-        if mets_file_content is None:
-            raise ParseError(
-                "Couldn't find the METS file that should be there to define the archive."
-            )
+            # If we didn't find a METS file in the archive after browsing everything, something is wrong
+            if mets_file_content is None:
+                raise ParseError(
+                    "Couldn't find the METS file that should be there to define the archive."
+                )
 
-        # Retrieving all the pages described by the METS file
-        try:
-            mets_pages, metadata = METSProcessor(mets_file_content, report=self.report, archive=self.file).process()
-        except ParseError:
-            raise
-        except Exception as e:
-            raise ParseError(f"An error occurred during the processing of the METS file contained in the archive: {e}")
+            # Retrieving all the pages described by the METS file
+            try:
+                mets_pages, metadata = METSProcessor(mets_file_content, report=self.report, archive=archive).process()
+            except ParseError:
+                raise
+            except Exception as e:
+                raise ParseError(f"An error occurred during the processing of the METS file contained in the archive: {e}")
 
-        self.store_document_metadata(metadata)
+            self.store_document_metadata(metadata)
 
-        with zipfile.ZipFile(self.file) as archive:
-            info_list = [info.filename for info in archive.infolist()]
+            # position of the files in the archive, to resume the import
+            positions = {}
+            for position, info in enumerate(archive.infolist()):
+                positions.setdefault(info.filename, position)
 
             for index, mets_page in enumerate(mets_pages):
                 metadata_already_stored = False
 
                 if mets_page.image:
-                    if info_list.index(mets_page.image) < start_at:
+                    if positions[mets_page.image] < start_at:
                         continue
 
-                    with archive.open(mets_page.image) as zipped_image:
-                        filename = os.path.basename(zipped_image.name)
-                        image_source = "mets//{0}/{1}".format(os.path.basename(self.file.name), filename)
+                    filename = os.path.basename(mets_page.image)
+                    image_source = "mets//{0}/{1}".format(os.path.basename(self.file.name), filename)
+                    try:
+                        image = self.extract(archive.getinfo(mets_page.image))
+                    except zipfile.BadZipFile as e:
+                        self.report_corrupted(mets_page.image, e, user)
+                    else:
                         part = self.parse_image(user, total, index, start_at, filename,
-                                                zipped_image, image_source)
+                                                image, image_source)
+                        image.close()
                         # If we have a page with an image + multiple sources, we don't want to
                         # store the same metadata multiple times and spam the database for nothing
                         if not metadata_already_stored:
@@ -473,7 +560,7 @@ class METSZipParser(ZipParser, METSBaseParser):
                             metadata_already_stored = True
 
                 for index, (layer_name, source) in enumerate(mets_page.sources.items()):
-                    if info_list.index(source) < start_at:
+                    if positions[source] < start_at:
                         continue
 
                     with archive.open(source) as zipped_source:
@@ -490,6 +577,8 @@ class METSZipParser(ZipParser, METSBaseParser):
                                     metadata_already_stored = True
 
                                 yield part
+                        except zipfile.BadZipFile as e:
+                            self.report_corrupted(source, e, user)
                         except (ValueError, ParseError) as e:
                             # We let go to try other sources
                             msg = _(
@@ -510,12 +599,17 @@ class METSZipParser(ZipParser, METSBaseParser):
 
 class XMLParser(ParserDocument):
     ACCEPTED_SCHEMAS = ()
+    # foreign keys are not validated by full_clean() during the import, it would cost a query per object
+    RELATED_FIELDS = ["document_part", "block", "typology"]
 
-    def __init__(self, document, file_handler, report, transcription_name=None, xml_root=None):
+    def __init__(self, document, file_handler, report, transcription_name=None, xml_root=None, streaming=False):
         super().__init__(document,
                          file_handler,
                          transcription_name=transcription_name,
                          report=report)
+        # in streaming mode xml_root only holds the beginning of the file (cf peek_root),
+        # pages are parsed and released one at a time cf iter_pages()
+        self.streaming = streaming
         if xml_root is not None:
             self.root = xml_root
             try:
@@ -537,22 +631,27 @@ class XMLParser(ParserDocument):
         # instance attribute storing all line confidences, for computing the average at the end
         # of the import
         self.all_line_confidences = []
+        # block and line types already fetched during the import
+        self.types_cache = {}
 
     def validate(self):
         if self.schema_location in self.ACCEPTED_SCHEMAS:
             try:
-                response = requests.get(self.schema_location)
-                content = response.content
-                schema_root = etree.XML(content)
-            except requests.exceptions.RequestException as e:
+                # compiled once per process from the local schema registry
+                xmlschema = get_schema(self.schema_location)
+            except SchemaUnavailable as e:
                 logger.exception(e)
                 if self.report:
                     self.report.append("Can't reach validation document %s, %s" % (
                         self.schema_location, OWN_RISK))
             else:
                 try:
-                    xmlschema = etree.XMLSchema(schema_root)
-                    xmlschema.assertValid(self.root)
+                    if self.streaming:
+                        # validates while parsing, without keeping the whole tree in memory
+                        for element in self.iterparse(schema=xmlschema):
+                            pass
+                    else:
+                        xmlschema.assertValid(self.root)
                 except (
                     AttributeError,
                     etree.DocumentInvalid,
@@ -565,12 +664,51 @@ class XMLParser(ParserDocument):
                 self.report.append("Document Schema %s is not in the accepted escriptorium list. Valid schemas are: %s, %s" %
                                    (self.schema_location, self.ACCEPTED_SCHEMAS, OWN_RISK))
 
+    def get_or_create_type(self, valid_types, name):
+        """
+        Same as valid_types.get_or_create(name=name), but each type is only fetched once per import.
+        """
+        key = (valid_types.model, name)
+        if key in self.types_cache:
+            return self.types_cache[key], False
+        typo, created = valid_types.get_or_create(name=name)
+        self.types_cache[key] = typo
+        return typo, created
+
     def get_filename(self, pageTag):
         raise NotImplementedError
 
     def get_pages(self):
         raise NotImplementedError
 
+    @property
+    def page_tag(self):
+        return str(etree.QName(self.root.nsmap.get(None), "Page"))
+
+    def iterparse(self, schema=None):
+        """
+        Yields the page elements of the file while parsing it, the elements that came before
+        a page are released once it has been processed, so that only the root element,
+        the headers and the current page are kept in memory.
+        """
+        self.file.seek(0)
+        page_tag = self.page_tag
+        for event, element in etree.iterparse(self.file, events=("start", "end"), schema=schema):
+            if event == "start":
+                if element.getparent() is None:
+                    self.root = element
+                continue
+            if element.tag == page_tag:
+                yield element
+                element.clear(keep_tail=True)
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    def iter_pages(self):
+        if self.streaming:
+            return self.iterparse()
+        return iter(self.get_pages())
+
     def get_blocks(self, pageTag):
         raise NotImplementedError
 
@@ -592,26 +730,42 @@ class XMLParser(ParserDocument):
     def get_glyphs(self, lineTag):
         raise NotImplementedError
 
-    def make_transcription(self, line, lineTag, content, graphs=None, avg_confidence=None, user=None):
-        try:
-            # lazily creates the Transcription on the fly if need be cf transcription() property
-            lt = LineTranscription.objects.get(
-                transcription=self.transcription, line=line
-            )
-        except LineTranscription.DoesNotExist:
-            lt = LineTranscription(
-                version_source="import",
-                version_author=user and user.username or "",
-                transcription=self.transcription,
-                line=line,
+    def make_transcriptions(self, part, line_transcriptions, user=None):
+        """
+        Stores the imported content of the lines of a part.
+        line_transcriptions is a list of (line, content, graphs, avg_confidence),
+        the existing LineTranscriptions are fetched at once, versioned in memory and written in bulk.
+        """
+        if not line_transcriptions:
+            return
+
+        # lazily creates the Transcription on the fly if need be cf transcription() property
+        existing = {
+            lt.line_id: lt
+            for lt in LineTranscription.objects.filter(
+                transcription=self.transcription, line__document_part=part
             )
-        else:
-            try:
-                lt.new_version(author=user and user.username,
-                               source='import')  # save current content in history
-            except NoChangeException:
-                pass
-        finally:
+        }
+        to_create, to_update = {}, {}
+        for line, content, graphs, avg_confidence in line_transcriptions:
+            lt = existing.get(line.pk)
+            if lt is None:
+                lt = LineTranscription(
+                    version_source="import",
+                    version_author=user and user.username or "",
+                    transcription=self.transcription,
+                    line=line,
+                )
+                existing[line.pk] = to_create[line.pk] = lt
+            else:
+                try:
+                    lt.new_version(author=user and user.username,
+                                   source='import')  # save current content in history
+                except NoChangeException:
+                    pass
+                if lt.pk:
+                    to_update[lt.pk] = lt
+
             lt.content = content
             if avg_confidence:
                 lt.avg_confidence = avg_confidence
@@ -619,24 +773,34 @@ class XMLParser(ParserDocument):
             if graphs:
                 lt.graphs = graphs
 
-            lt.save()
-
-            # update the avg confidence across the whole transcription
-            if self.all_line_confidences:
-                lt.transcription.avg_confidence = mean(self.all_line_confidences)
-            lt.transcription.save()
+        LineTranscription.objects.bulk_create(to_create.values(), batch_size=1000)
+        LineTranscription.objects.bulk_update(
+            to_update.values(),
+            ['content', 'graphs', 'avg_confidence',
+             'revision', 'versions', 'version_author', 'version_source',
+             'version_created_at', 'version_updated_at'],
+            batch_size=1000)
+        PendingIndexation.enqueue([lt.line_id for lt in [*to_create.values(), *to_update.values()]])
+        invalidate_search_results([lt.transcription_id for lt in [*to_create.values(), *to_update.values()]])
+
+        # update the avg confidence across the whole transcription
+        if self.all_line_confidences:
+            self.transcription.avg_confidence = mean(self.all_line_confidences)
+        self.transcription.save()
 
     def parse(self, start_at=0, override=False, user=None):
         assert (
             self.report
         ), "A TaskReport instance should be provided while parsing data."
 
-        pages = self.get_pages()
-        n_pages = len(pages)
+        n_pages = 0
         n_blocks = 0
         n_lines = 0
+        # parts yielded, the import resumes after the ones imported by a previous run
+        n_imported = 0
 
-        for pageTag in pages:
+        for pageTag in self.iter_pages():
+            n_pages += 1
             # find the filename to match with existing images
             filename = self.get_filename(pageTag)
             try:
@@ -650,11 +814,26 @@ class XMLParser(ParserDocument):
                     )
                 )
             else:
+                if n_imported < start_at:
+                    n_imported += 1
+                    continue
+
                 # if something fails, revert everything for this document part
                 with transaction.atomic():
                     if override:
                         part.lines.all().delete()
                         part.blocks.all().delete()
+                        blocks_by_id, lines_by_id = {}, {}
+                    else:
+                        # existing blocks and lines are matched in memory by their external id
+                        blocks_by_id = {block.external_id: block for block in part.blocks.all()}
+                        lines_by_id = {line.external_id: line for line in part.lines.all()}
+
+                    # everything is validated in memory then written in bulk
+                    blocks_to_create, blocks_to_update = [], {}
+                    lines_to_create, lines_to_update = [], {}
+                    # (line, content, graphs, avg_confidence) stored once the lines are created
+                    line_transcriptions = []
 
                     # list to store all computed avg confidences for lines on this document part
                     part_line_confidences = []
@@ -666,9 +845,9 @@ class XMLParser(ParserDocument):
 
                     for block_id, blockTag in blocks:
                         if block_id and not block_id.startswith("eSc_dummyblock_"):
-                            try:
-                                block = Block.objects.get(document_part=part, external_id=block_id)
-                            except Block.DoesNotExist:
+                            block = blocks_by_id.get(block_id)
+                            new_block = block is None
+                            if new_block:
                                 # not found, create it then
                                 block = Block(document_part=part, external_id=block_id)
                             try:
@@ -677,7 +856,7 @@ class XMLParser(ParserDocument):
                                 block = None
                             else:
                                 try:
-                                    block.full_clean()
+                                    block.full_clean(exclude=self.RELATED_FIELDS, validate_unique=False)
                                 except ValidationError as e:
                                     self.report.append(
                                         _(
@@ -688,8 +867,14 @@ class XMLParser(ParserDocument):
                                             error=e,
                                         )
                                     )
+                                    if new_block:
+                                        block = None
                                 else:
-                                    block.save()
+                                    if new_block:
+                                        blocks_to_create.append(block)
+                                        blocks_by_id[block_id] = block
+                                    elif block.pk:
+                                        blocks_to_update[block.pk] = block
                         else:
                             block = None
 
@@ -697,21 +882,15 @@ class XMLParser(ParserDocument):
                         n_lines += len(lines)
 
                         for line_id, lineTag in lines:
-                            if line_id:
-                                try:
-                                    line = Line.objects.get(document_part=part, external_id=line_id)
-                                except Line.DoesNotExist:
-                                    line = None
-                            else:
-                                line = None
-
-                            if line is None:
+                            line = lines_by_id.get(line_id) if line_id else None
+                            new_line = line is None
+                            if new_line:
                                 # not found, create it then
                                 line = Line(document_part=part, block=block, external_id=line_id)
 
                             self.update_line(line, lineTag)
                             try:
-                                line.full_clean()
+                                line.full_clean(exclude=self.RELATED_FIELDS, validate_unique=False)
                             except ValidationError as e:
                                 self.report.append(
                                     _(
@@ -723,18 +902,35 @@ class XMLParser(ParserDocument):
                                         error=e,
                                     )
                                 )
+                                if new_line:
+                                    line = None
                             else:
-                                line.save()
+                                if new_line:
+                                    if line.external_id is None:
+                                        line.make_external_id()
+                                    lines_to_create.append(line)
+                                    if line_id:
+                                        lines_by_id[line_id] = line
+                                elif line.pk:
+                                    lines_to_update[line.pk] = line
 
-                            # needs to be done after line is created!
                             tc = self.get_transcription_content(lineTag)
                             gs = self.get_graphs(lineTag)
                             ac = self.get_avg_confidence(lineTag)
                             if ac:
                                 self.all_line_confidences.append(ac)
                                 part_line_confidences.append(ac)
-                            if tc:
-                                self.make_transcription(line, lineTag, tc, graphs=gs, avg_confidence=ac, user=user)
+                            if tc and line is not None:
+                                line_transcriptions.append((line, tc, gs, ac))
+
+                    Block.objects.bulk_create(blocks_to_create, batch_size=1000)
+                    Block.objects.bulk_update(blocks_to_update.values(), ["box", "typology"], batch_size=1000)
+                    # the new lines get the pk of their new block here
+                    Line.objects.bulk_create(lines_to_create, batch_size=1000)
+                    Line.objects.bulk_update(lines_to_update.values(), ["baseline", "mask", "typology"],
+                                             batch_size=1000)
+                    # needs to be done after lines are created!
+                    self.make_transcriptions(part, line_transcriptions, user=user)
 
                     if part_line_confidences:
                         # if applicable, store max avg confidence / best transcription on document part
@@ -744,12 +940,13 @@ class XMLParser(ParserDocument):
 
                 logger.info("Uncompressed and parsed %s (%i page(s), %i block(s), %i line(s))" % (self.file.name, n_pages, n_blocks, n_lines))
                 part.calculate_progress()
+                n_imported += 1
                 yield part
 
 
 class AltoParser(XMLParser):
     DEFAULT_NAME = _("Default ALTO Import")
-    escriptorium_alto = "https://gitlab.inria.fr/scripta/escriptorium/-/raw/develop/app/escriptorium/static/alto-4-1-baselines.xsd"
+    escriptorium_alto = ESCRIPTORIUM_ALTO
 
     ACCEPTED_SCHEMAS = (
         "http://www.loc.gov/standards/alto/v4/alto.xsd",
@@ -811,7 +1008,7 @@ The ALTO file should contain a Description/sourceImageInformation/fileName tag f
             type_ = None
 
         if type_:
-            typo, created = self.document.valid_block_types.get_or_create(name=type_)
+            typo, created = self.get_or_create_type(self.document.valid_block_types, type_)
             block.typology = typo
             if created:
                 self.report.append(
@@ -875,7 +1072,7 @@ The ALTO file should contain a Description/sourceImageInformation/fileName tag f
             type_ = None
 
         if type_:
-            typo, created = self.document.valid_line_types.get_or_create(name=type_)
+            typo, created = self.get_or_create_type(self.document.valid_line_types, type_)
             line.typology = typo
             if created:
                 self.report.append(
@@ -917,6 +1114,8 @@ class PagexmlParser(XMLParser):
     @property
     def total(self):
         # PAGE file can contain multiple parts
+        if self.streaming:
+            return sum(1 for page in self.iterparse())
         if not self.root:
             self.root = etree.parse(self.file).getroot()
         return len(self.root.findall("Page", self.root.nsmap))
@@ -956,7 +1155,7 @@ The PAGE file should contain an attribute imageFilename in Page tag for matching
                     type_ = match.groups()[0]
 
         if type_:
-            typo, created = self.document.valid_block_types.get_or_create(name=type_)
+            typo, created = self.get_or_create_type(self.document.valid_block_types, type_)
             block.typology = typo
             if created:
                 self.report.append(
@@ -994,7 +1193,7 @@ The PAGE file should contain an attribute imageFilename in Page tag for matching
                     type_ = match.groups()[0]
 
         if type_:
-            typo, created = self.document.valid_line_types.get_or_create(name=type_)
+            typo, created = self.get_or_create_type(self.document.valid_line_types, type_)
             line.typology = typo
             if created:
                 self.report.append(
@@ -1075,51 +1274,24 @@ class IIIFManifestParser(ParserDocument):
         return len(self.canvases)
 
     @staticmethod
-    def get_image(url: str, retry_limit: int = 4) -> requests.Response:
-        """Retrieve a iiif image from a iiif server
-
-        This method will retry on certain 5XX errors, network and timeout.
-        It will only retry a fixed number of times (default 3),
-        and it backs off a little more on each retry. Failure to retrieve
-        the image within the retry limit will result in a DownloadError
-        being raised. All other unsuccessful requests will raise a
-        DownloadError as well.
-        """
-
-        current_retry = 0
-        while current_retry < retry_limit:
-            current_retry = current_retry + 1
-            time.sleep(0.1 * current_retry)  # avoid being throttled; add a little backoff
-            try:
-                response = requests.get(url, stream=True, verify=False, timeout=10)
-                response.raise_for_status()
-                return response
-
-            except requests.exceptions.HTTPError as http_error:
-                # retry on transient 5XX errors, but keep a record of the retry count
-                if http_error.response.status_code in [500, 502, 503, 504, 507, 508]:
-                    continue
-
-                if http_error.response.status_code == 429:
-                    # the server might tell us when we are free to go, if not let's wait 1s
-                    sleep_time = http_error.response.headers.get('Retry-After', 1)
-                    time.sleep(sleep_time)
-                    continue
-
-                # We probably got a 4XX error, but whatever it is just raise it
-                raise DownloadError(http_error)
-
-            except requests.exceptions.ConnectionError:
-                # network error, retry
-                continue
-
-            except requests.exceptions.Timeout:
-                # timeout, retry
-                continue
-
-        # Max retries has been exceeded
-        raise DownloadError(f"After {current_retry} tries, the server still errors out loading"
-                            f": {url}")
+    def canvas_image(canvas):
+        resource = canvas["images"][0]["resource"]
+        uri_template = "{image}/{region}/{size}/{rotation}/{quality}.{format}"
+        url = uri_template.format(
+            image=resource["service"]["@id"],
+            region="full",
+            size=getattr(settings, "IIIF_IMPORT_QUALITY", "full"),
+            rotation=0,
+            quality="default",
+            format="jpg",
+        )  # we could gain some time by fetching png, but it's not implemented everywhere.
+        # TODO, we should probably grab the iiif image manifest, it will tell
+        # us important things about the supported file types and the available sizing.
+        return resource, url
+
+    def fetch_canvas(self, downloader, canvas):
+        resource, url = self.canvas_image(canvas)
+        return downloader.download(url)
 
     def parse(self, start_at=0, override=False, user=None):
         assert (
@@ -1138,65 +1310,63 @@ class IIIFManifestParser(ParserDocument):
             pass
 
         total = len(self.canvases)
-        for i, canvas in enumerate(self.canvases):
-            if i < start_at:
-                continue
-
-            # If quotas are enforced, assert that the user still has free disk storage
-            if not settings.DISABLE_QUOTAS and not user.has_free_disk_storage():
-                raise DiskQuotaReachedError(
-                    _(f"You ran out of disk storage. {total - i} canvases were left to import (over {total - start_at})")
-                )
-
+        canvases = self.canvases[start_at:]
+        # images are downloaded concurrently, at most IMPORT_DOWNLOAD_PER_HOST at a time
+        # from the same server, while the parts are created in order
+        with Downloader(verify=False) as downloader:
+            images = prefetch(functools.partial(self.fetch_canvas, downloader),
+                              canvases,
+                              getattr(settings, "IMPORT_DOWNLOAD_WORKERS", 8))
             try:
-                resource = canvas["images"][0]["resource"]
-                uri_template = "{image}/{region}/{size}/{rotation}/{quality}.{format}"
-                url = uri_template.format(
-                    image=resource["service"]["@id"],
-                    region="full",
-                    size=getattr(settings, "IIIF_IMPORT_QUALITY", "full"),
-                    rotation=0,
-                    quality="default",
-                    format="jpg",
-                )  # we could gain some time by fetching png, but it's not implemented everywhere.
-                # TODO, we should probably grab the iiif image manifest, it will tell
-                # us important things about the supported file types and the available sizing.
-                r = self.get_image(url)
+                for i, (canvas, future) in enumerate(zip(canvases, images), start=start_at):
+                    # If quotas are enforced, assert that the user still has free disk storage
+                    if not settings.DISABLE_QUOTAS and not user.has_free_disk_storage():
+                        raise DiskQuotaReachedError(
+                            _(f"You ran out of disk storage. {total - i} canvases were left to import (over {total - start_at})")
+                        )
 
-                try:
-                    part = DocumentPart.objects.filter(
-                        document=self.document,
-                        source=url)[0]
-                except IndexError:
-                    # we do not use DoesNotExist because documents could have
-                    # duplicate image names at some point.
-                    part = DocumentPart(
-                        document=self.document,
-                        source=url)
-                if "label" in resource:
-                    part.name = resource["label"]
-                # iiif file names are always default.jpg or close to
-                name = "%d_%s_%s" % (i, uuid.uuid4().hex[:5], url.split("/")[-1])
-                part.original_filename = name
-                part.image_file_size = 0
-                part.image.save(name, ContentFile(r.content), save=False)
-                part.image_file_size = part.image.size
-                part.save()
-                self.post_process_image(part)
+                    url = None
+                    try:
+                        resource, url = self.canvas_image(canvas)
+                        image = future.result()
 
-                yield part
-                time.sleep(0.1)  # avoid being throttled
+                        try:
+                            part = DocumentPart.objects.filter(
+                                document=self.document,
+                                source=url)[0]
+                        except IndexError:
+                            # we do not use DoesNotExist because documents could have
+                            # duplicate image names at some point.
+                            part = DocumentPart(
+                                document=self.document,
+                                source=url)
+                        if "label" in resource:
+                            part.name = resource["label"]
+                        # iiif file names are always default.jpg or close to
+                        name = "%d_%s_%s" % (i, uuid.uuid4().hex[:5], url.split("/")[-1])
+                        part.original_filename = name
+                        part.image_file_size = 0
+                        # the downloaded file is moved in place by the storage
+                        part.image.save(name, image, save=False)
+                        image.close()
+                        part.image_file_size = part.image.size
+                        part.save()
+                        self.post_process_image(part)
 
-            except (KeyError, IndexError, DownloadError) as e:
-                self.report.append(
-                    _("Error while fetching {filename}: {error}").format(
-                        filename=name, error=e
-                    )
-                )
-                if isinstance(e, DownloadError):
-                    error_msg = f"Could not download image: {url}"
-                    user.notify(error_msg, level="warning", id="import:warning")
-                    self.report.append(error_msg)
+                        yield part
+
+                    except (KeyError, IndexError, DownloadError) as e:
+                        self.report.append(
+                            _("Error while fetching {filename}: {error}").format(
+                                filename=url or i + 1, error=e
+                            )
+                        )
+                        if isinstance(e, DownloadError):
+                            error_msg = f"Could not download image: {url}"
+                            user.notify(error_msg, level="warning", id="import:warning")
+                            self.report.append(error_msg)
+            finally:
+                images.close()
 
 
 class TranskribusPageXmlParser(PagexmlParser):
@@ -1225,12 +1395,32 @@ class TranskribusPageXmlParser(PagexmlParser):
             raise ParseError(msg)
 
 
+def peek_root(file_handler):
+    """
+    Parses an xml file up to its first Page element and returns the (partial) root element,
+    holding the namespaces and headers of the file.
+    """
+    root = None
+    for event, element in etree.iterparse(file_handler, events=("start",)):
+        if root is None:
+            root = element
+        elif etree.QName(element).localname == "Page":
+            break
+    file_handler.seek(0)
+    return root
+
+
 def make_parser(document, file_handler, name=None, report=None, zip_allowed=True, pdf_allowed=True, mets_describer=False, mets_base_uri=None):
     # TODO: not great to rely on file name extension
     ext = os.path.splitext(file_handler.name)[1][1:]
     if ext in XML_EXTENSIONS:
+        # very large files (multi pages PAGE exports for example) are parsed one page at a time
+        streaming = getattr(file_handler, "size", 0) > getattr(settings, "XML_IMPORT_STREAMING_SIZE", 50 * 1024 * 1024)
         try:
-            root = etree.parse(file_handler).getroot()
+            if streaming:
+                root = peek_root(file_handler)
+            else:
+                root = etree.parse(file_handler).getroot()
         except etree.XMLSyntaxError as e:
             raise ParseError(e.msg)
         try:
@@ -1247,18 +1437,20 @@ def make_parser(document, file_handler, name=None, report=None, zip_allowed=True
         #     return AbbyyParser(root, name=name)
         if "alto" in schema.lower():
             return AltoParser(
-                document, file_handler, report, transcription_name=name, xml_root=root
+                document, file_handler, report, transcription_name=name, xml_root=root, streaming=streaming
             )
         elif "PAGE" in schema:
             if b"Transkribus" in etree.tostring(root):
                 return TranskribusPageXmlParser(
-                    document, file_handler, report, transcription_name=name, xml_root=root
+                    document, file_handler, report, transcription_name=name, xml_root=root, streaming=streaming
                 )
             else:
                 return PagexmlParser(
-                    document, file_handler, report, transcription_name=name, xml_root=root
+                    document, file_handler, report, transcription_name=name, xml_root=root, streaming=streaming
                 )
         elif METSProcessor.NAMESPACES["mets"] in schemas:
+            if streaming:
+                root = etree.parse(file_handler).getroot()
             return METSRemoteParser(document, file_handler, report, root, mets_base_uri, transcription_name=name)
 
         else:
@@ -0,0 +1,145 @@
+"""
+Local registry of the XML schemas accepted for imports.
+
+Validating an ALTO or PAGE file used to download its schema and compile it
+for every single file. Schemas are now looked up in local directories, the
+bundled one (apps/imports/xsd) and XML_SCHEMAS_DIR where the official schemas
+can be dropped for network restricted deployments. A schema missing from both
+is downloaded once and stored in XML_SCHEMAS_DIR (unless XML_SCHEMAS_DOWNLOAD
+is disabled), and compiled schemas are cached for the lifetime of the process.
+"""
+import logging
+import os
+import tempfile
+import threading
+
+import requests
+from django.conf import settings
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xsd")
+
+ESCRIPTORIUM_ALTO = "https://gitlab.inria.fr/scripta/escriptorium/-/raw/develop/app/escriptorium/static/alto-4-1-baselines.xsd"
+
+# schema location -> local file name
+SCHEMAS = {
+    "http://www.loc.gov/standards/alto/v4/alto.xsd": "alto-4.xsd",
+    "http://www.loc.gov/standards/alto/v4/alto-4-2.xsd": "alto-4-2.xsd",
+    ESCRIPTORIUM_ALTO: "alto-4-1-baselines.xsd",
+    "http://www.loc.gov/standards/xlink/xlink.xsd": "xlink.xsd",
+    "http://schema.primaresearch.org/PAGE/gts/pagecontent/2019-07-15/pagecontent.xsd": "pagecontent-2019-07-15.xsd",
+}
+
+_compiled = {}
+_lock = threading.Lock()
+
+
+class SchemaUnavailable(Exception):
+    pass
+
+
+def schemas_dir():
+    return getattr(settings, "XML_SCHEMAS_DIR", os.path.join(settings.MEDIA_ROOT, "xsd"))
+
+
+def find_schema(location):
+    """
+    Returns the path of the local copy of the schema, None if there isn't any.
+    """
+    if location not in SCHEMAS:
+        raise SchemaUnavailable("%s is not in the schema registry" % location)
+    for directory in (schemas_dir(), BUNDLED_DIR):
+        path = os.path.join(directory, SCHEMAS[location])
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def fetch_schema(location):
+    """
+    Returns the content of the schema, downloading it and storing it
+    in the registry the first time if there is no local copy.
+    """
+    path = find_schema(location)
+    if path:
+        with open(path, "rb") as fh:
+            return fh.read()
+
+    if not getattr(settings, "XML_SCHEMAS_DOWNLOAD", True):
+        raise SchemaUnavailable("No local copy of %s in %s" % (location, schemas_dir()))
+
+    try:
+        response = requests.get(location, timeout=getattr(settings, "XML_SCHEMAS_DOWNLOAD_TIMEOUT", 30))
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise SchemaUnavailable("Can't download %s: %s" % (location, e))
+
+    path = os.path.join(schemas_dir(), SCHEMAS[location])
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # other workers may be reading it, the complete file is moved in place
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as fh:
+            fh.write(response.content)
+        os.replace(fh.name, path)
+    except OSError as e:
+        logger.warning("Couldn't store schema %s in %s: %s", location, path, e)
+    return response.content
+
+
+class RegistryResolver(etree.Resolver):
+    """
+    Resolves the imports and includes of the schemas (xlink for ALTO) from the registry.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.unavailable = []
+
+    def resolve(self, url, pubid, context):
+        if url in SCHEMAS:
+            try:
+                return self.resolve_string(fetch_schema(url), context, base_url=url)
+            except SchemaUnavailable as e:
+                logger.warning(e)
+                self.unavailable.append(e)
+        return None
+
+
+def compile_schema(location):
+    """
+    Returns the compiled XMLSchema of the location or the SchemaUnavailable error
+    if it is invalid, raises SchemaUnavailable if it or one of its imports couldn't be fetched.
+    """
+    resolver = RegistryResolver()
+    parser = etree.XMLParser()
+    parser.resolvers.add(resolver)
+    try:
+        schema_root = etree.XML(fetch_schema(location), parser, base_url=location)
+        return etree.XMLSchema(schema_root)
+    except (etree.XMLSyntaxError, etree.XMLSchemaParseError) as e:
+        if resolver.unavailable:
+            # an import of the schema couldn't be fetched
+            raise SchemaUnavailable(str(e))
+        return SchemaUnavailable(str(e))
+
+
+def get_schema(location):
+    """
+    Returns the compiled XMLSchema of an accepted schema location,
+    it is compiled only once per process.
+    Invalid schemas are also kept, so that an import of thousands of files doesn't retry each time,
+    but not the schemas that couldn't be fetched, they may be downloaded
+    or dropped in XML_SCHEMAS_DIR later on.
+    The schema is fetched and compiled outside of the lock, a slow download doesn't block
+    the other workers, the first compiled schema is the one kept.
+    """
+    schema = _compiled.get(location)
+    if schema is None:
+        schema = compile_schema(location)
+        with _lock:
+            schema = _compiled.setdefault(location, schema)
+    if isinstance(schema, SchemaUnavailable):
+        raise schema
+    return schema
@@ -4,6 +4,7 @@ from unittest import mock
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db import transaction
+from django.test import override_settings
 from django.urls import reverse
 
 from core.models import (
@@ -16,7 +17,7 @@ from core.models import (
 )
 from core.tests.factory import CoreFactoryTestCase
 from imports.models import DocumentImport
-from imports.parsers import AltoParser, IIIFManifestParser
+from imports.parsers import AltoParser, IIIFManifestParser, make_parser
 from reporting.models import TaskReport
 
 # DO NOT REMOVE THIS IMPORT, it will break a lot of tests
@@ -48,7 +49,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'test_single.alto'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(25):
+            with self.assertNumQueries(26):
                 response = self.client.post(uri, {
                     'upload_file': SimpleUploadedFile(filename, fh.read())
                 })
@@ -81,7 +82,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'test_single.alto'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(61):
+            with self.assertNumQueries(44):
                 response = self.client.post(uri, {
                     'upload_file': SimpleUploadedFile(filename, fh.read())
                 })
@@ -105,7 +106,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'test_single_baselines.alto'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(45):
+            with self.assertNumQueries(44):
                 response = self.client.post(uri, {
                     'upload_file': SimpleUploadedFile(filename, fh.read())
                 })
@@ -129,7 +130,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'test.zip'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(80):
+            with self.assertNumQueries(61):
                 response = self.client.post(uri, {
                     'upload_file': SimpleUploadedFile(filename, fh.read())
                 })
@@ -154,7 +155,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'test_composedblock.alto'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(87):
+            with self.assertNumQueries(58):
                 response = self.client.post(uri, {
                     'upload_file': SimpleUploadedFile(filename, fh.read())
                 })
@@ -277,7 +278,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'pagexml_test.xml'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(25):
+            with self.assertNumQueries(26):
                 response = self.client.post(uri, {'upload_file': SimpleUploadedFile(filename,
                                                                                     fh.read())})
                 # Note: the ParseError is raised by the processing of the import,
@@ -351,7 +352,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'test_pagexml.zip'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(417):  # there's a lot of lines in there
+            with self.assertNumQueries(54):
                 response = self.client.post(uri, {
                     'upload_file': SimpleUploadedFile(filename, fh.read())
                 })
@@ -368,6 +369,40 @@ class XmlImportTestCase(CoreFactoryTestCase):
         self.assertEqual(self.part3.blocks.count(), 0)
         self.assertEqual(self.part3.lines.count(), 19)
 
+    @override_settings(XML_IMPORT_STREAMING_SIZE=0)
+    def test_parse_pagexml_streaming_resume(self):
+        # a 3 pages PAGE file, imported one page at a time, resumed after the first page
+        mock_path = os.path.join(os.path.dirname(__file__), 'mocks', 'pagexml_test.xml')
+        with open(mock_path, 'rb') as fh:
+            content = fh.read()
+        start = content.index(b'<Page ')
+        end = content.index(b'</Page>') + len(b'</Page>')
+        pages = b''.join(content[start:end].replace(b'test3.png', b'test%d.png' % i) for i in (1, 2, 3))
+        content = content[:start] + pages + content[end:]
+
+        with transaction.atomic():
+            imp = DocumentImport.objects.create(
+                document=self.document,
+                started_by=self.document.owner,
+                import_file=SimpleUploadedFile('multi_pages.xml', content),
+                workflow_state=DocumentImport.WORKFLOW_STATE_ERROR,
+                processed=1)
+
+        parser = make_parser(self.document, imp.import_file)
+        self.assertTrue(parser.streaming)
+        self.assertEqual(parser.total, 3)
+
+        uri = reverse('api:document-imports', kwargs={'pk': self.document.pk})
+        response = self.client.post(uri, {'resume_import': True})
+        self.assertEqual(response.status_code, 200)
+        imp.refresh_from_db()
+        self.assertEqual(imp.workflow_state, imp.WORKFLOW_STATE_DONE)
+        self.assertEqual(imp.processed, 3)
+        self.assertEqual(self.part1.lines.count(), 0)
+        self.assertEqual(self.part2.lines.count(), 21)
+        self.assertEqual(self.part3.lines.count(), 21)
+        self.assertEqual(self.part3.blocks.count(), 2)
+
     def test_pagexml_types(self):
         non_word_block_type = "test-non-word-block-type"
         word_block_type = 'heading'
@@ -383,7 +418,7 @@ class XmlImportTestCase(CoreFactoryTestCase):
         filename = 'test_pagexml_types.xml'
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
-            with self.assertNumQueries(93):
+            with self.assertNumQueries(59):
                 response = self.client.post(uri, {
                     'upload_file': SimpleUploadedFile(filename, fh.read())
                 })
@@ -439,8 +474,10 @@ class XmlImportTestCase(CoreFactoryTestCase):
         mock_path = os.path.join(os.path.dirname(__file__), 'mocks', filename)
         with open(mock_path, 'rb') as fh:
             # mock the image grabbing
-            mock_resp = mock.Mock(content=fh.read(), status_code=200)
-            with mock.patch('requests.get', return_value=mock_resp):
+            content = fh.read()
+            mock_resp = mock.Mock(status_code=200, headers={'content-type': 'image/png'})
+            mock_resp.iter_content.side_effect = lambda chunk_size: iter([content])
+            with mock.patch('requests.Session.get', return_value=mock_resp):
                 for part in imp.process():  # exhaust the generator
                     pass
 
@@ -479,8 +516,11 @@ class ImportEndpointTestCase(CoreFactoryTestCase):
 
         # Note image grabbing get mocked with the same .json file but it doesn't matter
         with open(mock_iiif, 'rb') as fh:
-            mock_resp = mock.Mock(content=fh.read(), status_code=200)
-            with mock.patch('requests.get', return_value=mock_resp):
+            content = fh.read()
+            mock_resp = mock.Mock(content=content, status_code=200, headers={})
+            mock_resp.iter_content.side_effect = lambda chunk_size: iter([content])
+            with mock.patch('requests.get', return_value=mock_resp), \
+                 mock.patch('requests.Session.get', return_value=mock_resp):
                 with mock.patch('imports.parsers.ParserDocument.post_process_image'):
                     uri = reverse('api:import-list', kwargs={'document_pk': self.doc.pk})
                     resp = self.client.post(uri, {
@@ -519,19 +559,20 @@ class ImportEndpointTestCase(CoreFactoryTestCase):
                                        status_code=200,
                                        headers={'content-type': 'text/xml'})
         with open(mock_xml, 'rb') as fh:
-            mock_xml_resp = mock.Mock(content=fh.read(),
-                                      status_code=200,
-                                      headers={'content-type': 'text/xml'})
+            xml_content = fh.read()
         with open(mock_image, 'rb') as fh:
-            mock_img_resp = mock.Mock(content=fh.read(),
-                                      status_code=200,
-                                      headers={'content-type': 'image/png'})
-
-        with mock.patch('requests.get', side_effect=[mock_mets_resp,
-                                                     mock_img_resp,
-                                                     mock_xml_resp,
-                                                     mock_img_resp,
-                                                     mock_xml_resp]):
+            img_content = fh.read()
+
+        def mock_file_resp(uri, **kwargs):
+            # files are downloaded concurrently, answer depending on the uri
+            content, content_type = ((img_content, 'image/png') if uri.endswith('.png')
+                                     else (xml_content, 'text/xml'))
+            resp = mock.Mock(status_code=200, headers={'content-type': content_type})
+            resp.iter_content.side_effect = lambda chunk_size: iter([content])
+            return resp
+
+        with mock.patch('requests.get', return_value=mock_mets_resp), \
+             mock.patch('requests.Session.get', side_effect=mock_file_resp):
             uri = reverse('api:import-list', kwargs={'document_pk': self.doc.pk})
             resp = self.client.post(uri, {
                 'mode': 'mets',
@@ -592,7 +633,7 @@ class DocumentExportTestCase(CoreFactoryTestCase):
 
     def test_simple(self):
         self.client.force_login(self.user)
-        with self.assertNumQueries(22):
+        with self.assertNumQueries(23):
             response = self.client.post(reverse('api:document-export',
                                                 kwargs={'pk': self.trans.document.pk}),
                                         {'transcription': self.trans.pk,
@@ -606,7 +647,7 @@ class DocumentExportTestCase(CoreFactoryTestCase):
 
     def test_alto(self):
         self.client.force_login(self.user)
-        with self.assertNumQueries(32):
+        with self.assertNumQueries(33):
             response = self.client.post(reverse('api:document-export',
                                                 kwargs={'pk': self.trans.document.pk}),
                                         {'transcription': self.trans.pk,
@@ -631,7 +672,7 @@ class DocumentExportTestCase(CoreFactoryTestCase):
                     transcription=self.trans,
                     content='line %d:%d' % (i, j))
         self.client.force_login(self.user)
-        with self.assertNumQueries(32):
+        with self.assertNumQueries(33):
             response = self.client.post(reverse('api:document-export',
                                                 kwargs={'pk': self.trans.document.pk}),
                                         {'transcription': self.trans.pk,
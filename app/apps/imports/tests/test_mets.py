@@ -3,6 +3,7 @@ import os
 from unittest.mock import Mock, patch
 from zipfile import ZipFile
 
+from django.core.files.uploadedfile import UploadedFile
 from django.test import override_settings
 from lxml import etree, html
 from requests.exceptions import RequestException
@@ -20,6 +21,13 @@ SAMPLES_DIR = os.path.join(
 PFX = "{http://www.loc.gov/METS/}"
 
 
+def mocked_get(uri, **kwargs):
+    content_type = "image/png" if uri.endswith(".png") else "text/xml"
+    response = Mock(status_code=200, headers={"content-type": content_type})
+    response.iter_content.side_effect = lambda chunk_size: iter([b"some content"])
+    return response
+
+
 class METSProcessorTestCase(CoreFactoryTestCase):
     def setUp(self):
         super().setUp()
@@ -328,11 +336,9 @@ class METSProcessorTestCase(CoreFactoryTestCase):
         ])
         self.assertEqual(mets_page, METSPage(image=None, sources={}, metadata={}))
 
-    @patch("requests.get")
-    @patch("imports.mets.METSProcessor.check_is_image")
-    def test_process_single_page_remote_file_not_found(self, mock_check_is_image, mock_get):
+    @patch("requests.Session.get")
+    def test_process_single_page_remote_file_not_found(self, mock_get):
         mock_get.side_effect = RequestException("Uhoh, something went wrong.")
-        mock_check_is_image.side_effect = [(True, "image/png"), (False, "text/xml")]
 
         processor = METSProcessor(self.root, self.report, mets_base_uri="https://whatever.com")
         files = processor.get_files_from_file_sec()
@@ -371,11 +377,8 @@ class METSProcessorTestCase(CoreFactoryTestCase):
             "mods/note-about-reproduction": "Present",
         }))
 
-    @patch("requests.get")
-    @patch("imports.mets.METSProcessor.check_is_image")
-    def test_process_single_page_remote_file(self, mock_check_is_image, mock_get):
-        mock_get.return_value = Mock(content=b"some content", status_code=200)
-        mock_check_is_image.side_effect = [(True, "image/png"), (False, "text/xml")]
+    @patch("requests.Session.get", side_effect=mocked_get)
+    def test_process_single_page_remote_file(self, mock_get):
 
         processor = METSProcessor(self.root, self.report, mets_base_uri="https://whatever.com")
         files = processor.get_files_from_file_sec()
@@ -383,12 +386,12 @@ class METSProcessorTestCase(CoreFactoryTestCase):
         mets_page = processor.process_single_page(pages[0], files)
 
         self.assertEqual(mets_page.image.name, "Kifayat_al-ghulam.pdf_000005.png")
-        self.assertTrue(isinstance(mets_page.image, io.BytesIO))
+        self.assertTrue(isinstance(mets_page.image, UploadedFile))
         self.assertEqual(mets_page.image.read(), b"some content")
 
         self.assertEqual(list(mets_page.sources.keys()), ["transcript"])
         self.assertEqual(mets_page.sources["transcript"].name, "Kifayat_al-ghulam.pdf_000005.xml")
-        self.assertTrue(isinstance(mets_page.sources["transcript"], io.BytesIO))
+        self.assertTrue(isinstance(mets_page.sources["transcript"], UploadedFile))
         self.assertEqual(mets_page.sources["transcript"].read(), b"some content")
 
         self.assertDictEqual(mets_page.metadata, {
@@ -462,11 +465,8 @@ class METSProcessorTestCase(CoreFactoryTestCase):
             "mets-header/agent-role-CREATOR-type-ORGANIZATION": "eScriptorium testing",
         })
 
-    @patch("requests.get")
-    @patch("imports.mets.METSProcessor.check_is_image")
-    def test_process_remote_file(self, mock_check_is_image, mock_get):
-        mock_get.return_value = Mock(content=b"some content", status_code=200)
-        mock_check_is_image.side_effect = [(True, "image/png"), (False, "text/xml")] * 4
+    @patch("requests.Session.get", side_effect=mocked_get)
+    def test_process_remote_file(self, mock_get):
 
         processor = METSProcessor(self.root, self.report, mets_base_uri="https://whatever.com")
         mets_pages, metadata = processor.process()
@@ -479,12 +479,12 @@ class METSProcessorTestCase(CoreFactoryTestCase):
         ]
         for index, mets_page in enumerate(mets_pages):
             self.assertEqual(mets_page.image.name, f"{names[index]}.png")
-            self.assertTrue(isinstance(mets_page.image, io.BytesIO))
+            self.assertTrue(isinstance(mets_page.image, UploadedFile))
             self.assertEqual(mets_page.image.read(), b"some content")
 
             self.assertEqual(list(mets_page.sources.keys()), ["transcript"])
             self.assertEqual(mets_page.sources["transcript"].name, f"{names[index]}.xml")
-            self.assertTrue(isinstance(mets_page.sources["transcript"], io.BytesIO))
+            self.assertTrue(isinstance(mets_page.sources["transcript"], UploadedFile))
             self.assertEqual(mets_page.sources["transcript"].read(), b"some content")
 
             if not index:
@@ -1,9 +1,14 @@
+import io
 import os
+import shutil
+from tempfile import TemporaryDirectory
 from unittest.mock import Mock, patch
-from zipfile import ZipFile
+from zipfile import ZIP_STORED, ZipFile
 
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
 from lxml import etree
-from requests.exceptions import RequestException
+from requests.exceptions import HTTPError, RequestException
 
 from core.models import (
     Block,
@@ -14,7 +19,16 @@ from core.models import (
     Metadata,
 )
 from core.tests.factory import CoreFactoryTestCase
-from imports.parsers import METSRemoteParser, METSZipParser, ParseError
+from imports import schemas
+from imports.downloads import Downloader
+from imports.parsers import (
+    DiskQuotaReachedError,
+    METSRemoteParser,
+    METSZipParser,
+    ParseError,
+    PdfParser,
+    ZipParser,
+)
 from reporting.models import TaskReport
 
 SAMPLES_DIR = os.path.join(
@@ -25,14 +39,104 @@ SAMPLES_DIR = os.path.join(
 PFX = "{http://www.loc.gov/METS/}"
 
 
-def mocked_get(uri):
+def mocked_response(status_code, content=b"", headers=None):
+    response = Mock(status_code=status_code, headers=headers or {})
+    response.iter_content.side_effect = lambda chunk_size: iter([content])
+    if status_code >= 400:
+        response.raise_for_status.side_effect = HTTPError(response=response)
+    return response
+
+
+def mocked_get(uri, **kwargs):
     with ZipFile(SAMPLES_DIR + "/complex_archive.zip") as archive:
         filename = os.path.basename(uri)
         try:
             with archive.open(filename) as file:
-                return Mock(content=file.read(), status_code=200)
+                content = file.read()
         except Exception:
             raise RequestException("Uhoh, something went wrong.")
+    content_type = "image/png" if filename.endswith(".png") else "text/xml"
+    return mocked_response(200, content, headers={"content-type": content_type})
+
+
+@override_settings(XML_SCHEMAS_DOWNLOAD=False)
+class SchemaRegistryTestCase(SimpleTestCase):
+    def setUp(self):
+        schemas._compiled.clear()
+
+    @patch("requests.get")
+    def test_bundled_schema(self, mock_get):
+        schema = schemas.get_schema(schemas.ESCRIPTORIUM_ALTO)
+        self.assertIs(schemas.get_schema(schemas.ESCRIPTORIUM_ALTO), schema)
+        mock_get.assert_not_called()
+
+        mocks_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mocks")
+        root = etree.parse(os.path.join(mocks_dir, "test_single_baselines.alto")).getroot()
+        schema.assertValid(root)
+
+    @override_settings(XML_SCHEMAS_DIR="/nonexistent")
+    def test_bundled_schemas_compile(self):
+        for location, filename in schemas.SCHEMAS.items():
+            self.assertTrue(os.path.exists(os.path.join(schemas.BUNDLED_DIR, filename)))
+            if filename != "xlink.xsd":
+                with self.subTest(location=location):
+                    schemas.get_schema(location)
+
+    @override_settings(XML_SCHEMAS_DOWNLOAD=True)
+    @patch("requests.get")
+    def test_unavailable_schema(self, mock_get):
+        location = "http://www.loc.gov/standards/alto/v4/alto-4-0.xsd"
+        with self.assertRaises(schemas.SchemaUnavailable):
+            schemas.get_schema(location)
+        mock_get.assert_not_called()
+
+    @patch("requests.get")
+    def test_download_failure_not_kept(self, mock_get):
+        location = "http://www.loc.gov/standards/alto/v4/alto-4-2.xsd"
+        with open(os.path.join(schemas.BUNDLED_DIR, "alto-4-2.xsd"), "rb") as fh:
+            content = fh.read()
+        mock_get.side_effect = [RequestException("Uhoh, something went wrong."),
+                                Mock(content=content)]
+
+        xlink = os.path.join(schemas.BUNDLED_DIR, "xlink.xsd")
+
+        with TemporaryDirectory() as tmp_dir, \
+                self.settings(XML_SCHEMAS_DOWNLOAD=True, XML_SCHEMAS_DIR=tmp_dir), \
+                patch("imports.schemas.BUNDLED_DIR", "/nonexistent"):
+            shutil.copy(xlink, tmp_dir)
+            with self.assertRaises(schemas.SchemaUnavailable):
+                schemas.get_schema(location)
+            # retried on the next file
+            schema = schemas.get_schema(location)
+
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertIs(schemas.get_schema(location), schema)
+
+
+class DownloaderTestCase(SimpleTestCase):
+    @patch("requests.Session.get")
+    def test_retry_after(self, mock_get):
+        mock_get.side_effect = [
+            mocked_response(429, headers={"Retry-After": "0"}),
+            mocked_response(200, b"image content"),
+        ]
+        with Downloader() as downloader:
+            image = downloader.download("https://iiif.example.com/image/full/full/0/default.jpg")
+            host = downloader.get_host("https://iiif.example.com/")
+            # throttled, it will slowly go back down
+            self.assertGreater(host.delay, 0)
+
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(image.name, "default.jpg")
+        self.assertEqual(image.read(), b"image content")
+        image.close()
+
+    @patch("requests.Session.get")
+    def test_max_size(self, mock_get):
+        mock_get.return_value = mocked_response(200, b"x" * 100)
+        with Downloader(max_size=10) as downloader:
+            with self.assertRaises(ParseError):
+                downloader.download("https://iiif.example.com/image/full/full/0/default.jpg")
 
 
 class METSRemoteParserTestCase(CoreFactoryTestCase):
@@ -60,7 +164,7 @@ class METSRemoteParserTestCase(CoreFactoryTestCase):
             with archive.open("transcript-ocr.xml") as mets:
                 self.complex_root = etree.parse(mets).getroot()
 
-    @patch("imports.mets.METSProcessor.process")
+    @patch("imports.mets.METSProcessor.iter_process")
     def test_parse_error_during_mets_processing(self, mock_process):
         mock_process.side_effect = Exception("Uhoh, something went wrong.")
 
@@ -70,11 +174,29 @@ class METSRemoteParserTestCase(CoreFactoryTestCase):
 
         self.assertTrue("An error occurred during the processing of the remote METS file: Uhoh, something went wrong." in str(context.exception))
 
-    @patch("requests.get")
-    @patch("imports.mets.METSProcessor.check_is_image")
-    def test_parse_mets_with_one_source(self, mock_check_is_image, mock_get):
-        mock_get.side_effect = mocked_get
-        mock_check_is_image.side_effect = [(True, "image/png"), (False, "text/xml")] * 4
+    @patch("imports.parsers.make_parser", side_effect=ParseError("Invalid XML."))
+    @patch("imports.mets.METSProcessor.iter_process")
+    def test_parse_closes_downloaded_files(self, mock_process, mock_make_parser):
+        sources = [Mock(), Mock()]
+        closed_before = []
+
+        def pages():
+            for source in sources:
+                # the files of the previous page are closed before the next one is resolved
+                closed_before.append([s.close.called for s in sources])
+                yield Mock(image=None, sources={"transcript": source}, metadata={})
+
+        mock_process.return_value = (pages(), {})
+        parser = METSRemoteParser(self.document, SimpleUploadedFile("mets.xml", b""), self.report,
+                                  self.simple_root, "https://whatever.com")
+        list(parser.parse())
+
+        self.assertEqual(closed_before, [[False, False], [True, False]])
+        self.assertTrue(sources[1].close.called)
+        self.assertEqual(parser.total, 2)
+
+    @patch("requests.Session.get", side_effect=mocked_get)
+    def test_parse_mets_with_one_source(self, mock_get):
 
         self.assertEqual(Metadata.objects.count(), 0)
         self.assertEqual(DocumentMetadata.objects.count(), 0)
@@ -102,11 +224,8 @@ class METSRemoteParserTestCase(CoreFactoryTestCase):
         self.assertEqual(Line.objects.count(), 66)
         self.assertEqual(LineTranscription.objects.count(), 65)
 
-    @patch("requests.get")
-    @patch("imports.mets.METSProcessor.check_is_image")
-    def test_parse_mets_with_tags_prefixed_by_namespace(self, mock_check_is_image, mock_get):
-        mock_get.side_effect = mocked_get
-        mock_check_is_image.side_effect = [(True, "image/png"), (False, "text/xml")] * 4
+    @patch("requests.Session.get", side_effect=mocked_get)
+    def test_parse_mets_with_tags_prefixed_by_namespace(self, mock_get):
 
         self.assertEqual(Block.objects.count(), 0)
         self.assertEqual(Line.objects.count(), 0)
@@ -128,11 +247,8 @@ class METSRemoteParserTestCase(CoreFactoryTestCase):
         self.assertEqual(Line.objects.count(), 66)
         self.assertEqual(LineTranscription.objects.count(), 65)
 
-    @patch("requests.get")
-    @patch("imports.mets.METSProcessor.check_is_image")
-    def test_parse_mets_with_multiple_sources(self, mock_check_is_image, mock_get):
-        mock_get.side_effect = mocked_get
-        mock_check_is_image.side_effect = [(True, "image/png"), (False, "text/xml"), (False, "text/xml")] * 4
+    @patch("requests.Session.get", side_effect=mocked_get)
+    def test_parse_mets_with_multiple_sources(self, mock_get):
 
         self.assertEqual(Block.objects.count(), 0)
         self.assertEqual(Line.objects.count(), 0)
@@ -155,6 +271,80 @@ class METSRemoteParserTestCase(CoreFactoryTestCase):
         self.assertEqual(LineTranscription.objects.count(), 129)
 
 
+class ZipParserTestCase(CoreFactoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = self.factory.make_document()
+        self.report = TaskReport.objects.create(
+            user=self.document.owner,
+            label="Zip import",
+            document=self.document,
+            method="imports.tasks.document_import",
+        )
+
+    def test_parse_corrupted_member(self):
+        mock_image = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mocks", "test.png")
+        with open(mock_image, "rb") as fh:
+            image = fh.read()
+        buff = io.BytesIO()
+        with ZipFile(buff, "w", compression=ZIP_STORED) as archive:
+            archive.writestr("page1.png", image)
+            archive.writestr("page2.png", image)
+        # flip the last byte of the stored data of page2.png, its CRC doesn't match anymore
+        content = bytearray(buff.getvalue())
+        with ZipFile(io.BytesIO(bytes(content))) as archive:
+            info = archive.getinfo("page2.png")
+        offset = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra) + info.compress_size - 1
+        content[offset] ^= 0xFF
+
+        parser = ZipParser(self.document, SimpleUploadedFile("pages.zip", bytes(content)), self.report)
+        parser.validate()  # the central directory is fine
+        self.assertEqual(parser.total, 2)
+        list(parser.parse(user=self.document.owner))
+
+        self.assertEqual(list(self.document.parts.values_list("original_filename", flat=True)), ["page1.png"])
+        self.assertIn("Corrupted file in pages.zip: page2.png", self.report.messages)
+
+
+@override_settings(PDF_IMPORT_WORKERS=2)
+@patch("imports.parsers.pyvips.Image.pdfload_buffer", return_value=Mock(get=Mock(return_value=3)), create=True)
+class PdfParserTestCase(CoreFactoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = self.factory.make_document()
+        self.report = TaskReport.objects.create(
+            user=self.document.owner,
+            label="PDF import",
+            document=self.document,
+            method="imports.tasks.document_import",
+        )
+        mock_image = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mocks", "test.png")
+        with open(mock_image, "rb") as fh:
+            self.image = fh.read()
+        self.parser = PdfParser(self.document, SimpleUploadedFile("doc.pdf", b"%PDF-1.4"), self.report)
+
+    def test_parse_pages_in_threads(self, mock_load):
+        with patch.object(PdfParser, "rasterize_page", return_value=self.image) as mock_rasterize:
+            parts = list(self.parser.parse(user=self.document.owner))
+
+        self.assertEqual(sorted(call.args[1] for call in mock_rasterize.call_args_list), [0, 1, 2])
+        self.assertEqual([part.original_filename for part in parts],
+                         ["doc.pdf_page_1.png", "doc.pdf_page_2.png", "doc.pdf_page_3.png"])
+        self.assertEqual(list(self.document.parts.values_list("original_filename", flat=True)),
+                         ["doc.pdf_page_1.png", "doc.pdf_page_2.png", "doc.pdf_page_3.png"])
+
+    @override_settings(DISABLE_QUOTAS=False)
+    def test_parse_no_free_disk_storage(self, mock_load):
+        with patch.object(PdfParser, "rasterize_page", return_value=self.image) as mock_rasterize, \
+             patch("users.models.User.has_free_disk_storage", return_value=False):
+            with self.assertRaises(DiskQuotaReachedError):
+                list(self.parser.parse(user=self.document.owner))
+
+        # no page was rendered once the quota was reached
+        mock_rasterize.assert_not_called()
+        self.assertFalse(self.document.parts.exists())
+
+
 class METSZipParserTestCase(CoreFactoryTestCase):
     def setUp(self):
         super().setUp()
@@ -0,0 +1,46 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def completed(fct, item):
+    # a future already resolved in the calling thread
+    future = Future()
+    try:
+        future.set_result(fct(item))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def prefetch(fct, items, workers):
+    """
+    Runs fct on the items in a pool of threads and yields the futures in the order
+    of the items, at most `workers` items ahead of the one being consumed so that
+    memory use stays bounded. future.result() returns the value or raises the exception of fct.
+    With workers <= 1 everything happens in the calling thread.
+
+    Closing the generator (the import stopped early) cancels the items not started yet.
+    """
+    if workers <= 1:
+        for item in items:
+            yield completed(fct, item)
+        return
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(fct, item))
+                if len(pending) >= workers:
+                    break
+            while pending:
+                future = pending.popleft()
+                future.exception()  # wait for it to be done
+                item = next(items, pending)
+                if item is not pending:
+                    pending.append(executor.submit(fct, item))
+                yield future
+        finally:
+            for future in pending:
+                future.cancel()
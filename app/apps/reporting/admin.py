@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from reporting.models import TaskGroup, TaskReport
+from reporting.models import TaskGroup, TaskReport, UsageBucket
 
 
 class TaskGroupAdmin(admin.ModelAdmin):
@@ -14,5 +14,11 @@ class TaskReportAdmin(admin.ModelAdmin):
     raw_id_fields = ('document', 'document_part', 'user', 'ocr_model')
 
 
+class UsageBucketAdmin(admin.ModelAdmin):
+    list_display = ['user', 'hour', 'cpu_cost', 'gpu_cost']
+    raw_id_fields = ('user',)
+
+
 admin.site.register(TaskGroup, TaskGroupAdmin)
 admin.site.register(TaskReport, TaskReportAdmin)
+admin.site.register(UsageBucket, UsageBucketAdmin)
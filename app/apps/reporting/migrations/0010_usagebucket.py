@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:57
+
+from datetime import timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce, TruncHour
+
+
+def populate_buckets(apps, schema_editor):
+    TaskReport = apps.get_model('reporting', 'TaskReport')
+    UsageBucket = apps.get_model('reporting', 'UsageBucket')
+    usages = (TaskReport.objects.filter(started_at__isnull=False)
+              .annotate(hour=TruncHour('started_at', tzinfo=timezone.utc))
+              .values('user', 'hour')
+              .annotate(cpu=Coalesce(Sum('cpu_cost'), 0.0), gpu=Coalesce(Sum('gpu_cost'), 0.0))
+              .exclude(cpu=0, gpu=0)
+              .order_by())
+    UsageBucket.objects.bulk_create(
+        (UsageBucket(user_id=usage['user'], hour=usage['hour'], cpu_cost=usage['cpu'], gpu_cost=usage['gpu'])
+         for usage in usages.iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reporting', '0009_alter_taskgroup_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('cpu_cost', models.FloatField(default=0)),
+                ('gpu_cost', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'hour')},
+            },
+        ),
+        migrations.RunPython(populate_buckets, migrations.RunPython.noop),
+    ]
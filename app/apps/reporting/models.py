@@ -3,7 +3,7 @@ from datetime import datetime, timezone
 import psutil
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connection, models
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
@@ -97,6 +97,12 @@ class TaskReport(models.Model):
         task_cpu_times[task_id] = psutil.Process().cpu_times()
         self.save()
 
+    @property
+    def celery_task_id(self):
+        # the reports of the parts transcribed by a chunk task have the id of the chunk
+        # suffixed by the pk of the part, cf Document.queue_transcription
+        return self.task_id and self.task_id.split(':')[0]
+
     def cancel(self, username):
         self.workflow_state = self.WORKFLOW_STATE_CANCELED
         self.done_at = datetime.now(timezone.utc)
@@ -106,7 +112,10 @@ class TaskReport(models.Model):
             canceled_by = f"user {username}"
         self.append(f"Canceled by {canceled_by}")
 
-        app.control.revoke(self.task_id, terminate=True)
+        if self.celery_task_id == self.task_id:
+            app.control.revoke(self.task_id, terminate=True)
+        # else the part belongs to a chunk, revoking the chunk task would stop the other parts,
+        # the chunk task skips it or stops transcribing it once it sees the canceled state
         self.save()
 
     def error(self, message):
@@ -126,6 +135,7 @@ class TaskReport(models.Model):
         if not self.started_at:
             return
 
+        previous_cost = self.cpu_cost or 0
         task_id = self.task_id
         if task_id in task_cpu_times:
             start_cpu_times = task_cpu_times.pop(task_id)
@@ -136,15 +146,47 @@ class TaskReport(models.Model):
         else:
             self.cpu_cost = 0
         self.save()
+        UsageBucket.add(self.user_id, self.started_at, cpu_cost=self.cpu_cost - previous_cost)
 
     def calc_gpu_cost(self):
         # No need to calculate the GPU usage if the task was canceled/crashed before even starting
         if not self.started_at:
             return
 
+        previous_cost = self.gpu_cost or 0
         task_duration = (self.done_at - self.started_at).total_seconds()
         self.gpu_cost = (task_duration * settings.GPU_COST) / 60
         self.save()
+        UsageBucket.add(self.user_id, self.started_at, gpu_cost=self.gpu_cost - previous_cost)
+
+
+class UsageBucket(models.Model):
+    """
+    CPU and GPU minutes used by the tasks of a user started during an hour,
+    so that quotas can be checked without summing all the task reports of the week.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    cpu_cost = models.FloatField(default=0)
+    gpu_cost = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = (('user', 'hour'),)
+
+    @classmethod
+    def add(cls, user_id, started_at, cpu_cost=0, gpu_cost=0):
+        if not cpu_cost and not gpu_cost:
+            return
+        hour = started_at.replace(minute=0, second=0, microsecond=0)
+        # a single upsert, concurrent tasks of the user may add to the same bucket
+        with connection.cursor() as cursor:
+            cursor.execute('''
+            INSERT INTO "reporting_usagebucket" ("user_id", "hour", "cpu_cost", "gpu_cost")
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT ("user_id", "hour") DO UPDATE
+            SET "cpu_cost" = "reporting_usagebucket"."cpu_cost" + EXCLUDED."cpu_cost",
+                "gpu_cost" = "reporting_usagebucket"."gpu_cost" + EXCLUDED."gpu_cost"
+            ''', [user_id, hour, cpu_cost, gpu_cost])
 
 
 TASK_FINAL_STATES = [TaskReport.WORKFLOW_STATE_ERROR, TaskReport.WORKFLOW_STATE_DONE, TaskReport.WORKFLOW_STATE_CANCELED]
@@ -1 +1,36 @@
-# Create your tests here.
+from datetime import datetime, timedelta, timezone
+
+from django.test import override_settings
+from django.urls import reverse
+
+from core.tests.factory import CoreFactoryTestCase
+from reporting.models import TaskReport, UsageBucket
+
+
+class UsageBucketTestCase(CoreFactoryTestCase):
+    @override_settings(GPU_COST=1)
+    def test_gpu_cost(self):
+        user = self.factory.make_user()
+        started_at = datetime.now(timezone.utc) - timedelta(hours=1)
+        for minutes in (2, 3):
+            report = TaskReport.objects.create(user=user, label='test', started_at=started_at,
+                                               done_at=started_at + timedelta(minutes=minutes))
+            report.calc_gpu_cost()
+        # computing the cost again doesn't count it twice
+        report.calc_gpu_cost()
+
+        self.assertEqual(UsageBucket.objects.get(user=user).gpu_cost, 5)
+        self.assertEqual(user.calc_gpu_usage(), 5)
+        self.assertEqual(user.calc_cpu_usage(), 0)
+
+    def test_leaderboard_without_buckets(self):
+        staff = self.factory.make_user(is_staff=True)
+        UsageBucket.objects.create(user=staff, hour=datetime.now(timezone.utc), cpu_cost=2, gpu_cost=1)
+        user = self.factory.make_user()
+
+        self.client.force_login(staff)
+        resp = self.client.get(reverse('quotas-leaderboard'))
+        self.assertEqual(resp.status_code, 200)
+        usages = {leader.pk: (leader.total_cpu_usage, leader.last_week_gpu_usage) for leader in resp.context['page_obj']}
+        self.assertEqual(usages[staff.pk], (2, 1))
+        self.assertEqual(usages[user.pk], (None, None))
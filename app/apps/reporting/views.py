@@ -11,7 +11,7 @@ from django.views.generic import DetailView, ListView
 from django.views.generic.base import TemplateView
 
 from core.models import Document, LineTranscription, Project
-from reporting.models import TaskReport
+from reporting.models import TaskReport, UsageBucket
 from users.models import User
 
 
@@ -29,7 +29,7 @@ class ReportList(LoginRequiredMixin, ListView):
         disk_storage_limit = self.request.user.disk_storage_limit()
         context['enforce_disk_storage'] = not settings.DISABLE_QUOTAS and disk_storage_limit is not None
         if context['enforce_disk_storage']:
-            context['disk_storage_used_percentage'] = min(round((self.request.user.calc_disk_usage() * 100) / disk_storage_limit, 2) if disk_storage_limit else 100, 100)
+            context['disk_storage_used_percentage'] = min(round((self.request.user.disk_usage * 100) / disk_storage_limit, 2) if disk_storage_limit else 100, 100)
 
         cpu_minutes_limit = self.request.user.cpu_minutes_limit()
         context['enforce_cpu'] = not settings.DISABLE_QUOTAS and cpu_minutes_limit is not None
@@ -50,6 +50,7 @@ class ReportList(LoginRequiredMixin, ListView):
             'core.tasks.lossless_compression',
             'core.tasks.convert',
             'core.tasks.generate_part_thumbnails',
+            'core.tasks.generate_part_tiles',
             'users.tasks.async_email',
             'core.tasks.recalculate_masks'
         ]
@@ -110,10 +111,6 @@ class QuotasLeaderboard(LoginRequiredMixin, TemplateView):
         qs = User.objects.all()
         results = list(
             qs.annotate(
-                total_cpu_usage=Sum('taskreport__cpu_cost'),
-                total_gpu_usage=Sum('taskreport__gpu_cost'),
-                last_week_cpu_usage=Sum('taskreport__cpu_cost', filter=filter_last_week),
-                last_week_gpu_usage=Sum('taskreport__gpu_cost', filter=filter_last_week),
                 total_tasks=Count('taskreport'),
                 total_runtime=Sum(runtime),
                 last_week_tasks=Count('taskreport', filter=filter_last_week),
@@ -122,12 +119,21 @@ class QuotasLeaderboard(LoginRequiredMixin, TemplateView):
                 last_day_runtime=Sum(runtime, filter=filter_last_day)
             ).order_by(F('total_runtime').desc(nulls_last=True))[offset:offset + self.paginate_by]
         )
-        disk_usages_left = dict(qs.values('id').annotate(disk_usage=Sum('ocrmodel__file_size')).values_list('id', 'disk_usage'))
-        disk_usages_right = dict(qs.values('id').annotate(disk_usage=Sum('document__parts__image_file_size')).values_list('id', 'disk_usage'))
 
+        # the costs are read from the hourly usage buckets of the users of the page
+        filter_bucket_last_week = Q(hour__gte=today - timedelta(days=7))
+        usages = UsageBucket.objects.filter(user__in=[user.id for user in results]).values('user').annotate(
+            total_cpu_usage=Sum('cpu_cost'),
+            total_gpu_usage=Sum('gpu_cost'),
+            last_week_cpu_usage=Sum('cpu_cost', filter=filter_bucket_last_week),
+            last_week_gpu_usage=Sum('gpu_cost', filter=filter_bucket_last_week),
+        )
+        usages = {usage.pop('user'): usage for usage in usages}
+        # like the sums of the tasks, the usages of the users without buckets are None
+        no_usage = dict.fromkeys(['total_cpu_usage', 'total_gpu_usage', 'last_week_cpu_usage', 'last_week_gpu_usage'])
         for user in results:
-            user.disk_usage = (disk_usages_left[user.id] or 0) + (disk_usages_right[user.id] or 0)
-
+            for key, value in usages.get(user.id, no_usage).items():
+                setattr(user, key, value)
         # Pagination
         paginator = CustomPaginator(results, self.paginate_by, total=qs.count())
 
@@ -27,7 +27,7 @@ class Command(BaseCommand):
             if has_disk_storage and has_cpu_minutes and has_gpu_minutes:
                 continue
 
-            disk_storage_usage = user.calc_disk_usage()
+            disk_storage_usage = user.disk_usage
             cpu_minutes_usage = user.calc_cpu_usage()
             gpu_minutes_usage = user.calc_gpu_usage()
             events = QuotaEvent.objects.filter(
@@ -0,0 +1,43 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.models import DocumentPart, OcrModel
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the disk usage of the users and fix the counters that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the users whose counter drifted.',
+        )
+
+    def handle(self, *args, **options):
+        models_size = (OcrModel.objects.filter(owner=OuterRef('pk'))
+                       .values('owner').annotate(size=Sum('file_size')).values('size'))
+        images_size = (DocumentPart.objects.filter(document__owner=OuterRef('pk'))
+                       .values('document__owner').annotate(size=Sum('image_file_size')).values('size'))
+        drifted = (User.objects
+                   .annotate(actual_disk_usage=Coalesce(Subquery(models_size), Value(0))
+                             + Coalesce(Subquery(images_size), Value(0)))
+                   .exclude(disk_usage=F('actual_disk_usage'))
+                   .values_list('pk', 'disk_usage', 'actual_disk_usage'))
+
+        count = 0
+        for pk, disk_usage, actual in drifted.iterator():
+            count += 1
+            logger.info(f'The disk usage of user {pk} drifted by {disk_usage - actual} bytes.')
+            if not options['dry_run']:
+                # apply the difference to not lose the uploads that happened in the meantime
+                User.objects.filter(pk=pk).update(disk_usage=F('disk_usage') - (disk_usage - actual))
+
+        self.stdout.write(f'{count} user(s) had a drifted disk usage'
+                          + (' (dry run).' if options['dry_run'] else ', fixed.'))
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_disk_usage(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    OcrModel = apps.get_model('core', 'OcrModel')
+    DocumentPart = apps.get_model('core', 'DocumentPart')
+
+    models_size = (OcrModel.objects.filter(owner=OuterRef('pk'))
+                   .values('owner').annotate(size=Sum('file_size')).values('size'))
+    images_size = (DocumentPart.objects.filter(document__owner=OuterRef('pk'))
+                   .values('document__owner').annotate(size=Sum('image_file_size')).values('size'))
+    User.objects.update(disk_usage=(
+        Coalesce(Subquery(models_size), Value(0)) + Coalesce(Subquery(images_size), Value(0))
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_alter_user_legacy_mode'),
+        ('core', '0073_remove_documentpart_bw_backend_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='disk_usage',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_disk_usage, migrations.RunPython.noop),
+    ]
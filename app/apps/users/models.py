@@ -37,6 +37,9 @@ class User(AbstractUser):
     quota_cpu = models.PositiveIntegerField(null=True, blank=True)
     # quota_gpu is to be defined in GPU-min (spread over a week)
     quota_gpu = models.PositiveIntegerField(null=True, blank=True)
+    # bytes used by the images of the owned documents and by the owned models, cf calc_disk_usage(),
+    # it is kept up to date by core.models signal receivers and fixed by the reconcile_disk_usage command.
+    disk_usage = models.BigIntegerField(default=0, editable=False)
 
     class Meta:
         permissions = (('can_invite', 'Can invite users'),)
@@ -63,6 +66,11 @@ class User(AbstractUser):
         images_size = self.document_set.aggregate(Sum('parts__image_file_size'))['parts__image_file_size__sum'] or 0
         return models_size + images_size
 
+    def get_disk_usage(self):
+        # the counter may have been updated since the user was loaded, by an import for example
+        self.refresh_from_db(fields=['disk_usage'])
+        return self.disk_usage
+
     def disk_storage_limit(self):
         if self.quota_disk_storage is not None:
             return self.quota_disk_storage * MEGABYTES_TO_BYTES
@@ -73,11 +81,11 @@ class User(AbstractUser):
     def has_free_disk_storage(self):
         quota = self.disk_storage_limit()
         if quota is not None:
-            return quota > self.calc_disk_usage()
+            return quota > self.get_disk_usage()
         return True   # Unlimited disk storage
 
     def calc_cpu_usage(self):
-        return self.taskreport_set.filter(started_at__gte=date.today() - timedelta(days=7)).aggregate(Sum('cpu_cost'))['cpu_cost__sum'] or 0
+        return self.usagebucket_set.filter(hour__gte=date.today() - timedelta(days=7)).aggregate(Sum('cpu_cost'))['cpu_cost__sum'] or 0
 
     def cpu_minutes_limit(self):
         if self.quota_cpu is not None:
@@ -93,7 +101,7 @@ class User(AbstractUser):
         return True   # Unlimited CPU usage
 
     def calc_gpu_usage(self):
-        return self.taskreport_set.filter(started_at__gte=date.today() - timedelta(days=7)).aggregate(Sum('gpu_cost'))['gpu_cost__sum'] or 0
+        return self.usagebucket_set.filter(hour__gte=date.today() - timedelta(days=7)).aggregate(Sum('gpu_cost'))['gpu_cost__sum'] or 0
 
     def gpu_minutes_limit(self):
         if self.quota_gpu is not None:
@@ -6,6 +6,7 @@ from celery import shared_task
 from django.apps import apps
 from django.conf import settings
 from django.core.mail import send_mail
+from django.core.management import call_command
 
 # DO NOT REMOVE THIS IMPORT, it will break celery tasks located in this file
 from reporting.tasks import create_task_reporting  # noqa F401
@@ -51,3 +52,9 @@ def async_email(subject, message, recipients, html=None, result_interface=None):
     else:
         if result_interface:
             email_result(result_interface, success=success)
+
+
+@shared_task
+def reconcile_disk_usage():
+    # scheduled by CELERY_BEAT_SCHEDULE
+    call_command('reconcile_disk_usage')
@@ -1,11 +1,17 @@
+from io import StringIO
+
 from django.contrib.auth import get_user, get_user_model
 from django.contrib.auth.models import Group, Permission
 from django.core import mail
+from django.core.management import call_command
 from django.test import TestCase, override_settings
 from django.urls import reverse
 
+from core.models import OcrModel
+from core.tests.factory import CoreFactoryTestCase
 from users.models import GroupOwner, Invitation, ResearchField
 from users.models import User as CustomUser
+from users.tasks import reconcile_disk_usage
 
 User = get_user_model()
 
@@ -128,7 +134,7 @@ class InvitationTestCase(TestCase):
             response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
 
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(12):
             response = self.client.post(url, {
                 'email': invitation.recipient_email,
                 'username': 'jimd',
@@ -179,7 +185,7 @@ class TeamTestCase(TestCase):
 
         self.client.force_login(self.invitee)
         url = reverse('accept-group-invitation', kwargs={'slug': invitation.token})
-        with self.assertNumQueries(8):
+        with self.assertNumQueries(11):
             response = self.client.get(url)
         self.assertEqual(response.status_code, 302)
 
@@ -196,7 +202,7 @@ class TeamTestCase(TestCase):
         self.group.user_set.add(self.invitee)
         self.client.force_login(self.owner)
         url = reverse('team-remove-user', kwargs={'pk': self.group.pk})
-        with self.assertNumQueries(13):
+        with self.assertNumQueries(15):
             response = self.client.post(url, data={'user': self.invitee.pk})
         self.assertEqual(response.status_code, 302)
 
@@ -208,7 +214,7 @@ class TeamTestCase(TestCase):
         self.group.user_set.add(self.invitee)
         self.client.force_login(self.invitee)
         url = reverse('team-leave', kwargs={'pk': self.group.pk})
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(6):
             response = self.client.post(url)
         self.assertEqual(response.status_code, 302)
         self.assertEqual(self.invitee.groups.count(), 0)
@@ -223,3 +229,46 @@ class TeamTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
         self.group.groupowner.refresh_from_db()
         self.assertEqual(self.group.groupowner.owner, self.invitee)
+
+
+class DiskUsageTestCase(CoreFactoryTestCase):
+    def test_counter(self):
+        user = self.factory.make_user()
+        document = self.factory.make_document(owner=user)
+        part1 = self.factory.make_part(document=document)
+        part2 = self.factory.make_part(document=document)
+        model = self.factory.make_model(document=document)
+        user.refresh_from_db()
+        self.assertEqual(user.disk_usage, user.calc_disk_usage())
+        self.assertEqual(user.disk_usage, part1.image_file_size + part2.image_file_size + model.file_size)
+
+        self.factory.cleanup_registry.remove(part1)
+        part1.delete()
+        self.assertEqual(user.get_disk_usage(), part2.image_file_size + model.file_size)
+
+        self.factory.cleanup_registry.remove(part2)
+        document.delete()
+        self.assertEqual(user.get_disk_usage(), model.file_size)
+
+    def test_owner_change(self):
+        user, new_owner = self.factory.make_user(), self.factory.make_user()
+        document = self.factory.make_document(owner=user)
+        part = self.factory.make_part(document=document)
+        model = OcrModel.objects.get(pk=self.factory.make_model(document=document).pk)
+
+        document.owner = new_owner
+        document.save()
+        model.owner = new_owner
+        model.save(update_fields=['owner'])
+        self.assertEqual(user.get_disk_usage(), 0)
+        self.assertEqual(new_owner.get_disk_usage(), part.image_file_size + model.file_size)
+
+    def test_reconcile(self):
+        user = self.factory.make_user()
+        part = self.factory.make_part(document=self.factory.make_document(owner=user))
+        CustomUser.objects.filter(pk=user.pk).update(disk_usage=42)
+
+        call_command('reconcile_disk_usage', '--dry-run', stdout=StringIO())
+        self.assertEqual(user.get_disk_usage(), 42)
+        reconcile_disk_usage.delay()
+        self.assertEqual(user.get_disk_usage(), part.image_file_size)
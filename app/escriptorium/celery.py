@@ -3,6 +3,7 @@ from __future__ import absolute_import, unicode_literals
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'escriptorium.settings')
@@ -19,6 +20,14 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@worker_process_init.connect
+def setup_prometheus_exports(**kwargs):
+    # expose the metrics of each worker process (model cache hits/misses...)
+    # only does something if PROMETHEUS_METRICS_EXPORT_PORT(_RANGE) is set
+    from django_prometheus.exports import SetupPrometheusExportsFromConfig
+    SetupPrometheusExportsFromConfig()
+
+
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
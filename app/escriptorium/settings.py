@@ -93,6 +93,10 @@ MIDDLEWARE = [
 ]
 
 PROMETHEUS_EXPORT_MIGRATIONS = False
+# Celery worker processes export their metrics (kraken model cache etc) on a port in this range
+if os.getenv('PROMETHEUS_METRICS_EXPORT_PORT_RANGE'):
+    PROMETHEUS_METRICS_EXPORT_PORT_RANGE = range(
+        *map(int, os.getenv('PROMETHEUS_METRICS_EXPORT_PORT_RANGE').split('-')))
 
 ROOT_URLCONF = 'escriptorium.urls'
 
@@ -211,6 +215,14 @@ CACHES = {
 DISABLE_ELASTICSEARCH = os.getenv('DISABLE_ELASTICSEARCH', 'True').lower() not in ('false', '0')
 ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200')
 ELASTICSEARCH_COMMON_INDEX = os.getenv('ELASTICSEARCH_COMMON_INDEX', 'es-transcriptions')
+# the changed lines are reindexed in batches by a low priority task scheduled at most every SEARCH_INDEXING_DELAY seconds
+SEARCH_INDEXING_DELAY = int(os.getenv('SEARCH_INDEXING_DELAY', 10))
+SEARCH_INDEXING_BATCH_SIZE = int(os.getenv('SEARCH_INDEXING_BATCH_SIZE', 1000))
+# the search results and page cursors are cached for SEARCH_CACHE_TIMEOUT seconds,
+# unless the transcriptions they cover or the accesses of the user change
+SEARCH_CACHE_TIMEOUT = int(os.getenv('SEARCH_CACHE_TIMEOUT', 600))
+# the find and replace updates the line transcriptions by ranges of FIND_AND_REPLACE_CHUNK_SIZE primary keys
+FIND_AND_REPLACE_CHUNK_SIZE = int(os.getenv('FIND_AND_REPLACE_CHUNK_SIZE', 10000))
 
 
 CELERY_BROKER_URL = 'redis://%s:%d/0' % (REDIS_HOST, REDIS_PORT)
@@ -231,26 +243,48 @@ CELERY_TASK_QUEUES = (
     Queue('jvm', routing_key='jvm'),  # for everything that needs a java virtual machine (excepts elasticsearch)
 )
 CELERY_TASK_DEFAULT_QUEUE = 'default'
+# run by the celerybeat service
+CELERY_BEAT_SCHEDULE = {
+    # fixes the disk usage counters of the users that drifted, every DISK_USAGE_RECONCILE_INTERVAL seconds
+    'reconcile-disk-usage': {
+        'task': 'users.tasks.reconcile_disk_usage',
+        'schedule': int(os.getenv('DISK_USAGE_RECONCILE_INTERVAL', 60 * 60 * 24)),
+    },
+}
 # When updating 'gpu' queue don't forget to add or remove the GPU quota check in the affected tasks
 CELERY_TASK_ROUTES = {
     # 'core.tasks.*': {'queue': 'default'},
     'core.tasks.recalculate_masks': {'queue': 'live'},
+    'core.tasks.transcribe': {'queue': 'default'},
+    'core.tasks.transcribe_parts': {'queue': 'default'},
     'core.tasks.generate_part_thumbnails': {'queue': 'low-priority'},
+    'core.tasks.generate_part_tiles': {'queue': 'low-priority'},
+    'core.tasks.index_pending_lines': {'queue': 'low-priority'},
+    'core.tasks.update_search_documents': {'queue': 'low-priority'},
+    'core.tasks.delete_search_entries': {'queue': 'low-priority'},
     'core.tasks.train': {'queue': 'gpu'},
     'core.tasks.segtrain': {'queue': 'gpu'},
     'core.tasks.align': {'queue': 'jvm'},
     # 'escriptorium.celery.debug_task': '',
     'imports.tasks.*': {'queue': 'low-priority'},
     'users.tasks.async_email': {'queue': 'low-priority'},
+    'users.tasks.reconcile_disk_usage': {'queue': 'low-priority'},
 }
 
 REPORTING_TASKS_BLACKLIST = [
     'users.tasks.async_email',
+    'users.tasks.reconcile_disk_usage',
     # if the user still has disk space but no cpu quota it will just slow everything down
     # to forbid thumbnails creation or image compression.
     'core.tasks.convert',
     'core.tasks.lossless_compression',
-    'core.tasks.generate_part_thumbnails'
+    'core.tasks.generate_part_thumbnails',
+    'core.tasks.generate_part_tiles',
+    # reports are created for each part of the chunk by Document.queue_transcription
+    'core.tasks.transcribe_parts',
+    'core.tasks.index_pending_lines',
+    'core.tasks.update_search_documents',
+    'core.tasks.delete_search_entries',
 ]
 
 CHANNEL_LAYERS = {
@@ -368,6 +402,13 @@ CSRF_TRUSTED_ORIGINS = os.getenv("CSRF_TRUSTED_ORIGINS", "http://localhost:8000"
 
 COMPRESS_ENABLE = True
 ALWAYS_CONVERT = False
+# 'vips' converts and compresses images in process with pyvips (falling back to the subprocesses on error),
+# 'subprocess' uses ImageMagick's convert and pngcrush
+IMAGE_PROCESSING_BACKEND = os.getenv('IMAGE_PROCESSING_BACKEND', 'vips')
+# zlib compression level of the png files written by pyvips (0-9)
+PNG_COMPRESSION_LEVEL = int(os.getenv('PNG_COMPRESSION_LEVEL', 6))
+# Remove the metadata (exif, icc profile..) of the images written by pyvips
+IMAGE_STRIP_METADATA = os.getenv('IMAGE_STRIP_METADATA', 'False').lower() not in ('false', '0')
 
 FILE_UPLOAD_PERMISSIONS = 0o644
 FILE_UPLOAD_HANDLERS = [
@@ -376,6 +417,11 @@ FILE_UPLOAD_HANDLERS = [
 
 
 THUMBNAIL_ENABLE = True
+# Generate a Deep Zoom (DZI) tile pyramid of the images so that the editor can load only the visible tiles
+TILES_ENABLE = os.getenv('TILES_ENABLE', 'False').lower() not in ('false', '0')
+TILES_SIZE = int(os.getenv('TILES_SIZE', 256))
+TILES_OVERLAP = 1
+TILES_FORMAT = os.getenv('TILES_FORMAT', '.jpg[Q=90]')
 THUMBNAIL_ALIASES = {
     '': {
         'list': {'size': (50, 50), 'crop': 'center'},
@@ -401,6 +447,14 @@ IIIF_IMPORT_QUALITY = 'full'
 
 KRAKEN_TRAINING_DEVICE = os.getenv('KRAKEN_TRAINING_DEVICE', 'cpu')
 KRAKEN_TRAINING_LOAD_THREADS = int(os.getenv('KRAKEN_TRAINING_LOAD_THREADS', 0))
+# Number of lines recognized in a single kraken pass, 0 means all the lines of a part at once
+KRAKEN_RECOGNITION_BATCH_SIZE = int(os.getenv('KRAKEN_RECOGNITION_BATCH_SIZE', 0))
+# Number of loaded models kept in memory by each worker process, 0 disables the cache
+KRAKEN_MODEL_CACHE_SIZE = int(os.getenv('KRAKEN_MODEL_CACHE_SIZE', 4))
+# Maximum size (in Mb) of the models kept in memory by each worker process
+KRAKEN_MODEL_CACHE_MAX_MEMORY = int(os.getenv('KRAKEN_MODEL_CACHE_MAX_MEMORY', 1024))
+# Number of parts transcribed by a single celery task when transcribing a document
+TRANSCRIBE_PARTS_CHUNK_SIZE = int(os.getenv('TRANSCRIBE_PARTS_CHUNK_SIZE', 50))
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -452,6 +506,21 @@ EXPORT_STRICT = False
 TEXT_ALIGNMENT_ENABLED = os.getenv('TEXT_ALIGNMENT', "False").lower() not in ("false", "0")
 
 IMPORT_ALLOWED_DOMAINS = os.getenv('IMPORT_ALLOWED_DOMAINS', '*').split(',')
+# Local copies of the ALTO/PAGE schemas used to validate imports,
+# the ones missing are downloaded there once unless XML_SCHEMAS_DOWNLOAD is disabled
+XML_SCHEMAS_DIR = os.getenv('XML_SCHEMAS_DIR', os.path.join(MEDIA_ROOT, 'xsd'))
+XML_SCHEMAS_DOWNLOAD = os.getenv('XML_SCHEMAS_DOWNLOAD', 'True').lower() not in ('false', '0')
+# XML files bigger than this (in bytes) are imported one page at a time instead of being loaded at once
+XML_IMPORT_STREAMING_SIZE = int(os.getenv('XML_IMPORT_STREAMING_SIZE', 50 * 1024 * 1024))
+# Number of pages of a PDF rasterized in parallel during an import, 1 renders them one at a time
+PDF_IMPORT_WORKERS = int(os.getenv('PDF_IMPORT_WORKERS', 1))
+# Remote files of the imports (IIIF images, METS pages) are downloaded by IMPORT_DOWNLOAD_WORKERS threads,
+# with at most IMPORT_DOWNLOAD_PER_HOST concurrent requests on the same server
+IMPORT_DOWNLOAD_WORKERS = int(os.getenv('IMPORT_DOWNLOAD_WORKERS', 8))
+IMPORT_DOWNLOAD_PER_HOST = int(os.getenv('IMPORT_DOWNLOAD_PER_HOST', 4))
+IMPORT_DOWNLOAD_TIMEOUT = int(os.getenv('IMPORT_DOWNLOAD_TIMEOUT', 30))
+# Maximum size (in bytes) of a single downloaded file
+IMPORT_DOWNLOAD_MAX_SIZE = int(os.getenv('IMPORT_DOWNLOAD_MAX_SIZE', 500 * 1024 * 1024))
 
 # Sentry support
 SENTRY_DSN = os.getenv('SENTRY_DSN')